@@ -1,3 +1,10 @@
 from django.contrib import admin
+from .models import OutboxEmail
 
-# Register your models here.
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ['id', 'subject', 'to', 'created_at', 'sent_at', 'attempts', 'next_attempt_at']
+    list_filter = ['sent_at', 'created_at']
+    search_fields = ['subject', 'to']
+    readonly_fields = ['created_at', 'sent_at', 'attempts', 'error']
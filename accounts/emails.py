@@ -1,18 +1,11 @@
-from django.shortcuts import render, redirect
-from .forms import CustomUserCreationForm
-from .emails import send_welcome_email  # import the function
+from django.template.loader import render_to_string
 
-def register_view(request):
-    if request.method == 'POST':
-        form = CustomUserCreationForm(request.POST)
-        if form.is_valid():
-            user = form.save()
-            
-            # Send welcome email
-            send_welcome_email(user)
-            
-            return redirect('login')  # or wherever you want
-    else:
-        form = CustomUserCreationForm()
-    
-    return render(request, 'accounts/register.html', {'form': form})
+from . import outbox
+
+
+def send_welcome_email(user):
+    """Queue the welcome email for a newly registered user (sent after commit)."""
+    if not user.email:
+        return None
+    message = render_to_string('accounts/email.html', {'username': user.username})
+    return outbox.enqueue("Welcome to our Platform!", message, [user.email])
@@ -1,3 +1,29 @@
 from django.db import models
 
-# Create your models here.
+
+class OutboxEmail(models.Model):
+    """
+    Transactional email outbox. Messages are added in the transaction of
+    whatever they are about (e.g. a new user) and sent afterwards by
+    accounts.outbox, so no request waits on the SMTP server.
+    """
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html = models.BooleanField(default=True)
+    from_email = models.CharField(max_length=255, blank=True)
+    to = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Not before this time: set on retries, and while a sender holds the message
+    next_attempt_at = models.DateTimeField()
+    sent_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)} - {'sent' if self.sent_at else 'pending'}"
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['sent_at', 'next_attempt_at'], name='outboxemail_pending_idx'),
+        ]
@@ -0,0 +1,135 @@
+"""
+Email outbox delivery.
+
+enqueue() stores a message in OutboxEmail inside the caller's transaction,
+so an email exists exactly when the change it announces was committed,
+and schedules a send for after the commit. send_pending() drains due
+messages in batches: each batch is claimed with a short transaction (its
+next_attempt_at is pushed out by CLAIM_SECONDS, so concurrent senders
+skip it and a crashed sender's messages come back later), then sent
+over one SMTP connection that stays open for the whole run. Failed
+messages are retried with exponential backoff up to MAX_ATTEMPTS: while
+any are left, the process drains the outbox again every RETRY_SECONDS,
+and the send_outbox_emails command drains it from a separate worker.
+
+Any EMAIL_BACKEND works, so tests and development can use the locmem,
+console or file backends.
+"""
+import logging
+from datetime import timedelta
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from pikaquick import background
+
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 6
+CLAIM_SECONDS = 600
+BACKOFF_SECONDS = 60        # first retry; doubled per attempt
+MAX_BACKOFF_SECONDS = 3600
+RETRY_SECONDS = BACKOFF_SECONDS
+
+
+def enqueue(subject, body, to, from_email=None, html=True):
+    """Add a message to the outbox; it is sent once the current transaction commits."""
+    email = OutboxEmail.objects.create(
+        subject=subject,
+        body=body,
+        html=html,
+        from_email=from_email or '',
+        to=list(to),
+        next_attempt_at=timezone.now(),
+    )
+    schedule_sending()
+    return email
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a message that has failed ``attempts`` times."""
+    return min(BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+
+
+def _claim(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(sent_at__isnull=True, attempts__lt=MAX_ATTEMPTS, next_attempt_at__lte=now)
+            .order_by('id')[:batch_size]
+        )
+        if batch:
+            OutboxEmail.objects.filter(pk__in=[email.pk for email in batch]).update(
+                next_attempt_at=now + timedelta(seconds=CLAIM_SECONDS)
+            )
+    return batch
+
+
+def _message(email, connection):
+    message = EmailMessage(
+        email.subject,
+        email.body,
+        email.from_email or None,
+        email.to,
+        connection=connection,
+    )
+    if email.html:
+        message.content_subtype = 'html'
+    return message
+
+
+def send_pending(batch_size=50, connection=None):
+    """Send due outbox messages; returns (sent, failed)."""
+    sent = failed = 0
+    connection = connection or get_connection()
+    try:
+        while True:
+            batch = _claim(batch_size)
+            if not batch:
+                break
+
+            for email in batch:
+                try:
+                    # Opens the connection on first use; it stays open until the end
+                    connection.open()
+                    _message(email, connection).send()
+                except Exception as e:
+                    email.attempts += 1
+                    email.error = str(e)
+                    email.next_attempt_at = timezone.now() + timedelta(seconds=backoff(email.attempts))
+                    if email.attempts >= MAX_ATTEMPTS:
+                        logger.error(f"Giving up on email {email.pk} to {', '.join(email.to)}: {e}")
+                    else:
+                        logger.warning(f"Email {email.pk} failed (attempt {email.attempts}): {e}")
+                    failed += 1
+                    # The connection may be broken; the next message opens a fresh one
+                    connection.close()
+                else:
+                    email.sent_at = timezone.now()
+                    email.attempts += 1
+                    email.error = ''
+                    sent += 1
+
+            OutboxEmail.objects.bulk_update(batch, ['sent_at', 'attempts', 'error', 'next_attempt_at'])
+            if len(batch) < batch_size:
+                break
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def _send_scheduled():
+    send_pending()
+    return OutboxEmail.objects.filter(sent_at__isnull=True, attempts__lt=MAX_ATTEMPTS).exists()
+
+
+_sending = background.CoalescedJob(_send_scheduled, retry_interval=RETRY_SECONDS)
+
+
+def schedule_sending():
+    """Drain the outbox on the background executor (once per burst)."""
+    _sending.schedule()
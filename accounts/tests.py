@@ -1,3 +1,56 @@
+from unittest import mock
+
+from django.core import mail
+from django.db import transaction
 from django.test import TestCase
 
-# Create your tests here.
+from . import outbox
+from .models import OutboxEmail
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        outbox._sending._queued = False
+        patcher = mock.patch('pikaquick.background.submit')
+        self.submit = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_messages_are_sent_once(self):
+        outbox.enqueue('Hello', '<p>Hi</p>', ['a@example.com'])
+        self.assertEqual(outbox.send_pending(), (1, 0))
+        self.assertEqual(outbox.send_pending(), (0, 0))
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['a@example.com'])
+        email = OutboxEmail.objects.get()
+        self.assertIsNotNone(email.sent_at)
+        self.assertEqual(email.attempts, 1)
+
+    def test_failed_messages_are_retried_later(self):
+        outbox.enqueue('Hello', 'Hi', ['a@example.com'], html=False)
+        connection = mock.Mock()
+        connection.send_messages.side_effect = OSError('SMTP down')
+        with self.assertLogs('accounts.outbox', 'WARNING'):
+            self.assertEqual(outbox.send_pending(connection=connection), (0, 1))
+
+        email = OutboxEmail.objects.get()
+        self.assertIsNone(email.sent_at)
+        self.assertEqual((email.attempts, email.error), (1, 'SMTP down'))
+        # Backed off: not due again yet, but left for the periodic drain
+        self.assertEqual(outbox.send_pending(), (0, 0))
+        self.assertTrue(outbox._send_scheduled())
+
+    def test_rolled_back_enqueue_leaves_nothing_behind(self):
+        try:
+            with transaction.atomic():
+                outbox.enqueue('Hello', 'Hi', ['a@example.com'])
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(OutboxEmail.objects.exists())
+        self.submit.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            outbox.enqueue('Hello', 'Hi', ['a@example.com'])
+            outbox.enqueue('Again', 'Hi', ['b@example.com'])
+        self.submit.assert_called_once()
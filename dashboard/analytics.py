@@ -0,0 +1,164 @@
+"""
+Sales analytics rollups.
+
+Revenue, units and order counts are kept pre-aggregated per day, per
+hour, per category and day, and per food and day. record_order() adds
+each completed order to them in the transaction that creates the order
+(payments/orders.py); backfill() rebuilds a date range from the orders
+with one GROUP BY query per rollup and chunk. The dashboard charts only
+ever read the rollups.
+
+Days and hours are in the current time zone (TIME_ZONE).
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+
+from payments.models import Order, OrderLine
+
+from .models import CategorySales, FoodSales, SalesByDay, SalesByHour
+
+
+def _add(model, key, orders=0, units=0, revenue=Decimal('0.00'), **fields):
+    """Add to the rollup row identified by ``key``, creating it if needed."""
+    increments = {
+        'orders': F('orders') + orders,
+        'units': F('units') + units,
+        'revenue': F('revenue') + revenue,
+    }
+    if model.objects.filter(**key).update(**increments, **fields):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **fields, orders=orders, units=units, revenue=revenue)
+    except IntegrityError:
+        # Created concurrently by another order
+        model.objects.filter(**key).update(**increments, **fields)
+
+
+def record_order(order, lines):
+    """Add a newly created order and its lines to every rollup."""
+    created = timezone.localtime(order.created_at)
+    day = created.date()
+    hour = created.replace(minute=0, second=0, microsecond=0)
+
+    _add(SalesByDay, {'day': day}, 1, order.item_count, order.total)
+    _add(SalesByHour, {'hour': hour}, 1, order.item_count, order.total)
+
+    categories = defaultdict(lambda: [0, Decimal('0.00')])
+    foods = {}
+    for line in lines:
+        category = categories[line.category]
+        category[0] += line.quantity
+        category[1] += line.line_total
+        food = foods.setdefault(line.food_id, [0, Decimal('0.00'), line.name])
+        food[0] += line.quantity
+        food[1] += line.line_total
+
+    for category, (units, revenue) in categories.items():
+        _add(CategorySales, {'day': day, 'category': category}, 1, units, revenue)
+    for food_id, (units, revenue, name) in foods.items():
+        _add(FoodSales, {'day': day, 'food_id': food_id}, 1, units, revenue, name=name)
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def backfill(start, end, chunk_days=7):
+    """
+    Rebuild the rollups for the days ``start`` to ``end`` (inclusive) from
+    the orders, ``chunk_days`` days per transaction. Yields (first_day,
+    last_day, orders) per chunk. Rollups for today keep moving while it
+    runs, so rebuild today only when no payments are coming in.
+    """
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end)
+        since, until = _day_start(chunk_start), _day_start(chunk_end + timedelta(days=1))
+        orders = Order.objects.filter(created_at__gte=since, created_at__lt=until).order_by()
+        lines = OrderLine.objects.filter(order__created_at__gte=since, order__created_at__lt=until).order_by()
+
+        with transaction.atomic():
+            SalesByDay.objects.filter(day__range=(chunk_start, chunk_end)).delete()
+            SalesByHour.objects.filter(hour__gte=since, hour__lt=until).delete()
+            CategorySales.objects.filter(day__range=(chunk_start, chunk_end)).delete()
+            FoodSales.objects.filter(day__range=(chunk_start, chunk_end)).delete()
+
+            totals = {'orders': Count('id'), 'units': Sum('item_count'), 'revenue': Sum('total')}
+            SalesByDay.objects.bulk_create(
+                SalesByDay(**row)
+                for row in orders.annotate(day=TruncDate('created_at')).values('day').annotate(**totals)
+            )
+            SalesByHour.objects.bulk_create(
+                SalesByHour(**row)
+                for row in orders.annotate(hour=TruncHour('created_at')).values('hour').annotate(**totals)
+            )
+
+            line_totals = {
+                'orders': Count('order', distinct=True),
+                'units': Sum('quantity'),
+                'revenue': Sum('line_total'),
+            }
+            lines = lines.annotate(day=TruncDate('order__created_at'))
+            CategorySales.objects.bulk_create(
+                CategorySales(**row) for row in lines.values('day', 'category').annotate(**line_totals)
+            )
+            FoodSales.objects.bulk_create(
+                FoodSales(**row)
+                for row in lines.values('day', 'food_id').annotate(**line_totals, name=Max('name'))
+            )
+            count = orders.count()
+
+        yield chunk_start, chunk_end, count
+        chunk_start = chunk_end + timedelta(days=1)
+
+
+def sales_summary(days=30):
+    """Chart data for the last ``days`` days, read from the rollups only."""
+    today = timezone.localdate()
+    since = today - timedelta(days=days - 1)
+
+    by_day = dict(SalesByDay.objects.filter(day__gte=since).values_list('day', 'revenue'))
+    daily = [
+        {'day': (since + timedelta(days=i)).isoformat(), 'revenue': float(by_day.get(since + timedelta(days=i), 0))}
+        for i in range(days)
+    ]
+
+    hourly = [0.0] * 24
+    for hour, revenue in SalesByHour.objects.filter(hour__gte=_day_start(since)).values_list('hour', 'revenue'):
+        hourly[timezone.localtime(hour).hour] += float(revenue)
+
+    categories = (
+        CategorySales.objects.filter(day__gte=since).values('category')
+        .annotate(units=Sum('units'), revenue=Sum('revenue')).order_by('-revenue')
+    )
+    top_foods = (
+        FoodSales.objects.filter(day__gte=since).values('food_id')
+        .annotate(name=Max('name'), units=Sum('units'), revenue=Sum('revenue')).order_by('-revenue')[:10]
+    )
+    totals = SalesByDay.objects.filter(day__gte=since).aggregate(
+        orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue')
+    )
+
+    return {
+        'days': days,
+        'daily': daily,
+        'hourly': hourly,
+        'categories': [
+            {'category': row['category'] or 'Uncategorized', 'units': row['units'], 'revenue': float(row['revenue'])}
+            for row in categories
+        ],
+        'top_foods': [
+            {'name': row['name'], 'units': row['units'], 'revenue': float(row['revenue'])}
+            for row in top_foods
+        ],
+        'orders': totals['orders'] or 0,
+        'units': totals['units'] or 0,
+        'revenue': float(totals['revenue'] or 0),
+    }
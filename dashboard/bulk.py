@@ -0,0 +1,108 @@
+"""
+Bulk availability and price changes.
+
+Staff select foods by id or by category and change them all at once:
+the rows are locked and read (ids only), changed with a single UPDATE,
+and read back for the response, so a request costs the same few
+queries for two foods or two hundred. QuerySet.update() sends no
+signals, so the catalog version is bumped once per batch here instead
+of once per Food save, and a price change recomputes the active carts
+holding the repriced foods in the same transaction.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import DecimalField, F, Max, Value
+from django.db.models.functions import Round
+from django.utils import timezone
+
+from foods import cart as cart_service, catalog
+from foods.models import Food
+
+MAX_PRICE = Decimal('9999.99')
+MAX_IDS = 500
+RESULT_FIELDS = ('id', 'name', 'category', 'price', 'available')
+
+
+class BulkError(ValueError):
+    """Invalid bulk request (no selection, bad price or percentage)."""
+
+
+def select_foods(ids=None, category=None):
+    """Foods matching the given ids and/or category; at least one is required."""
+    if not ids and not category:
+        raise BulkError('Select foods by "ids" or "category".')
+    queryset = Food.objects.order_by()
+    if ids:
+        if not isinstance(ids, list) or not all(
+            isinstance(food_id, int) and not isinstance(food_id, bool) for food_id in ids
+        ):
+            raise BulkError('"ids" must be a list of food ids.')
+        if len(ids) > MAX_IDS:
+            raise BulkError(f'Select at most {MAX_IDS} foods by id at a time.')
+        queryset = queryset.filter(pk__in=ids)
+    if category:
+        queryset = queryset.filter(category__iexact=str(category).strip())
+    return queryset
+
+
+def _decimal(value, name):
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        raise BulkError(f'"{name}" must be a number.')
+    if not number.is_finite():
+        raise BulkError(f'"{name}" must be a number.')
+    return number
+
+
+def _apply(queryset, changes, **exclude):
+    """Run one UPDATE over the selected rows that differ; returns their new values."""
+    with transaction.atomic():
+        ids = list(queryset.exclude(**exclude).select_for_update().values_list('pk', flat=True))
+        if not ids:
+            return []
+        Food.objects.filter(pk__in=ids).update(**changes, updated_at=timezone.now())
+        if 'price' in changes:
+            cart_service.recalculate_for_foods(ids)
+        transaction.on_commit(catalog.bump_version)
+        return list(Food.objects.filter(pk__in=ids).order_by('pk').values(*RESULT_FIELDS))
+
+
+def set_availability(queryset, available):
+    """Mark the selected foods available or sold out; returns the changed rows."""
+    if not isinstance(available, bool):
+        raise BulkError('"available" must be true or false.')
+    return _apply(queryset, {'available': available}, available=available)
+
+
+def set_price(queryset, price=None, percent=None):
+    """
+    Set the selected foods to an absolute ``price``, or change their
+    prices by ``percent`` (e.g. 10 or -15), rounded to cents. Returns the
+    changed rows.
+    """
+    if (price is None) == (percent is None):
+        raise BulkError('Give either "price" or "percent".')
+
+    if price is not None:
+        price = _decimal(price, 'price').quantize(Decimal('0.01'))
+        if price < 0 or price > MAX_PRICE:
+            raise BulkError(f'"price" must be between 0 and {MAX_PRICE}.')
+        return _apply(queryset, {'price': price}, price=price)
+
+    percent = _decimal(percent, 'percent')
+    if percent <= -100:
+        raise BulkError('"percent" must be greater than -100.')
+    if percent == 0:
+        return []
+    factor = 1 + percent / 100
+    highest = queryset.aggregate(highest=Max('price'))['highest']
+    if highest is not None and (highest * factor).quantize(Decimal('0.01')) > MAX_PRICE:
+        raise BulkError(f'That would take a price above {MAX_PRICE}.')
+
+    new_price = Round(
+        F('price') * Value(factor, output_field=DecimalField()), 2, output_field=Food._meta.get_field('price')
+    )
+    # A price of 0 stays 0
+    return _apply(queryset, {'price': new_price}, price=0)
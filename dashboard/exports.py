@@ -0,0 +1,158 @@
+"""
+Streaming CSV / NDJSON exports of foods, payments and orders.
+
+Rows are read in primary-key order, ``chunk_size`` at a time, with keyset
+pagination (``pk > last seen``) rather than OFFSET or one big cursor.
+Only the requested columns are selected, and each chunk is written out
+before the next one is read. Memory use therefore stays flat however
+many rows are exported, including on MySQL, whose client buffers whole
+result sets. Used by the dashboard export view and ``manage.py
+export_data``. CSV text cells that a spreadsheet would read as a formula
+are prefixed with a quote.
+"""
+import csv
+from datetime import date, datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from foods.models import Food
+from payments.models import MpesaPayment, Order, OrderLine
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# dataset -> (queryset factory, exportable columns, default columns, date column)
+DATASETS = {
+    'foods': (
+        lambda: Food.objects.all(),
+        ['id', 'name', 'description', 'category', 'price', 'available', 'created_at', 'updated_at'],
+        ['id', 'name', 'category', 'price', 'available', 'created_at'],
+        'created_at',
+    ),
+    'payments': (
+        lambda: MpesaPayment.objects.all(),
+        ['id', 'user_id', 'user__username', 'phone_number', 'amount', 'status', 'result_code', 'result_desc',
+         'mpesa_receipt_number', 'merchant_request_id', 'checkout_request_id', 'transaction_date',
+         'created_at', 'updated_at'],
+        ['id', 'user__username', 'phone_number', 'amount', 'status', 'mpesa_receipt_number',
+         'transaction_date', 'created_at'],
+        'created_at',
+    ),
+    'orders': (
+        lambda: Order.objects.all(),
+        ['id', 'payment_id', 'payment__mpesa_receipt_number', 'user_id', 'user__username', 'cart_id',
+         'total', 'item_count', 'created_at'],
+        ['id', 'payment__mpesa_receipt_number', 'user__username', 'total', 'item_count', 'created_at'],
+        'created_at',
+    ),
+    'order_lines': (
+        lambda: OrderLine.objects.all(),
+        ['id', 'order_id', 'order__created_at', 'food_id', 'name', 'category', 'unit_price', 'quantity',
+         'line_total'],
+        ['order_id', 'order__created_at', 'name', 'category', 'unit_price', 'quantity', 'line_total'],
+        'order__created_at',
+    ),
+}
+
+
+class ExportError(ValueError):
+    """Invalid export request (unknown dataset, format or column)."""
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def parse_date(value):
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ExportError(f'Invalid date "{value}", expected YYYY-MM-DD.')
+
+
+def columns_for(dataset, fields=None):
+    if dataset not in DATASETS:
+        raise ExportError(f'Unknown dataset "{dataset}"; choose from {", ".join(DATASETS)}.')
+    _, allowed, default, _ = DATASETS[dataset]
+    if not fields:
+        return list(default)
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ExportError(f'Unknown columns for {dataset}: {", ".join(unknown)}. Available: {", ".join(allowed)}.')
+    return list(fields)
+
+
+def iter_rows(dataset, columns, since=None, until=None, chunk_size=2000):
+    """Yield value tuples for ``columns``, optionally limited to a date range (inclusive)."""
+    queryset_factory, _, _, date_field = DATASETS[dataset]
+    queryset = queryset_factory().order_by('pk')
+    if since:
+        queryset = queryset.filter(**{f'{date_field}__gte': _day_start(since)})
+    if until:
+        queryset = queryset.filter(**{f'{date_field}__lt': _day_start(until + timedelta(days=1))})
+
+    rows = queryset.values_list('pk', *columns)
+    last_pk = None
+    while True:
+        chunk = list((rows.filter(pk__gt=last_pk) if last_pk is not None else rows)[:chunk_size])
+        if not chunk:
+            return
+        for row in chunk:
+            yield row[1:]
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1][0]
+
+
+class _Echo:
+    """File-like object whose write() returns the line, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+# Cells a spreadsheet would evaluate as a formula (CSV injection)
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        # Customer-supplied text (names, descriptions, M-Pesa messages) is
+        # exported as text, never as a formula
+        return "'" + value
+    return value
+
+
+def stream(dataset, export_format='csv', fields=None, since=None, until=None, chunk_size=2000):
+    """Return an iterator of text lines for an export (CSV starts with a header row)."""
+    if export_format not in FORMATS:
+        raise ExportError(f'Unknown format "{export_format}"; choose from {", ".join(FORMATS)}.')
+    columns = columns_for(dataset, fields)
+    rows = iter_rows(dataset, columns, since, until, chunk_size)
+
+    if export_format == 'csv':
+        writer = csv.writer(_Echo())
+
+        def generate():
+            yield writer.writerow(columns)
+            for row in rows:
+                yield writer.writerow([_csv_value(value) for value in row])
+    else:
+        encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+        def generate():
+            for row in rows:
+                yield encoder.encode(dict(zip(columns, row))) + '\n'
+
+    return generate()
+
+
+def filename(dataset, export_format):
+    return f'pikaquick-{dataset}-{timezone.localdate():%Y%m%d}.{export_format}'
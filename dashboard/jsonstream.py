@@ -0,0 +1,132 @@
+"""
+Incremental JSON reading for large uploads and fixtures.
+
+iter_values() yields the elements of a top-level JSON array (or a stream
+of concatenated / newline-delimited JSON values) one at a time, reading
+the text in fixed-size chunks, so memory use is bounded by the largest
+single element rather than by the document. open_text() wraps a binary
+file in a text reader, picking the encoding from its byte-order mark
+(UTF-8, UTF-16 or UTF-32; plain UTF-8 without one).
+"""
+import codecs
+import io
+import json
+
+CHUNK_SIZE = 64 * 1024
+
+_BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+
+_NUMBER_CHARS = frozenset('0123456789.eE+-')
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def detect_encoding(head, default='utf-8'):
+    """Encoding of a byte string's document, from its BOM (UTF-32 is checked before UTF-16)."""
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding
+    return default
+
+
+def open_text(binary, default='utf-8'):
+    """Wrap a binary file object in a text reader with the encoding its BOM names."""
+    if hasattr(binary, 'peek'):
+        head = binary.peek(4)[:4]
+    else:
+        position = binary.tell()
+        head = binary.read(4)
+        binary.seek(position)
+    return io.TextIOWrapper(binary, encoding=detect_encoding(head, default), newline='')
+
+
+def iter_values(text, chunk_size=CHUNK_SIZE):
+    """
+    Yield the values of a JSON array read from the text stream ``text``, or
+    every value of a stream of concatenated JSON values (e.g. NDJSON).
+    Raises ValueError, with the character offset, on malformed input:
+    array elements must be separated by exactly one comma.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+    offset = 0  # characters dropped from the front of buffer so far
+
+    def fill():
+        nonlocal buffer, pos, eof, offset
+        chunk = text.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        # Drop what has been consumed before growing the buffer
+        offset += pos
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return True
+
+    def skip_whitespace():
+        """Skip whitespace; returns the next character, or '' at the end of input."""
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not fill():
+                return ''
+
+    def error(message):
+        return ValueError(f'Invalid JSON: {message} at character {offset + pos}')
+
+    def read_value():
+        nonlocal pos
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if eof or not fill():
+                    raise ValueError(f'Invalid JSON: {e.msg} at character {offset + e.pos}') from None
+                continue
+            # A number or literal cut off by the chunk boundary also decodes
+            # (as a shorter number, e.g. '2' of '2.5'); read on and retry
+            if not eof and (end == len(buffer) or (_is_number(value) and buffer[end] in _NUMBER_CHARS)):
+                if fill():
+                    continue
+            pos = end
+            return value
+
+    if skip_whitespace() != '[':
+        # A stream of whitespace-separated values
+        while skip_whitespace():
+            yield read_value()
+        return
+
+    pos += 1
+    if skip_whitespace() == ']':
+        pos += 1
+    else:
+        while True:
+            if skip_whitespace() in ('', ',', ']'):
+                raise error('expected a value')
+            yield read_value()
+
+            separator = skip_whitespace()
+            if separator == ']':
+                pos += 1
+                break
+            if separator == '':
+                raise ValueError('Unexpected end of JSON input: array is not closed')
+            if separator != ',':
+                raise error("expected ',' or ']'")
+            pos += 1
+
+    if skip_whitespace():
+        raise error('extra data after the array')
@@ -0,0 +1,42 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from dashboard.analytics import backfill
+from payments.models import Order
+
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Invalid date "{value}", expected YYYY-MM-DD.')
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the sales rollups (by day, hour, category and food) from the orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='First day to rebuild (YYYY-MM-DD, default: first order)')
+        parser.add_argument('--until', help='Last day to rebuild (YYYY-MM-DD, default: today)')
+        parser.add_argument('--chunk-days', type=int, default=7, help='Days rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        if options['since']:
+            since = _parse_date(options['since'])
+        else:
+            first = Order.objects.order_by('created_at').values_list('created_at', flat=True).first()
+            if first is None:
+                self.stdout.write('No orders yet.')
+                return
+            since = timezone.localtime(first).date()
+        until = _parse_date(options['until']) if options['until'] else timezone.localdate()
+        if since > until:
+            raise CommandError('--since is after --until.')
+
+        total = 0
+        for first_day, last_day, orders in backfill(since, until, chunk_days=max(options['chunk_days'], 1)):
+            total += orders
+            self.stdout.write(f'{first_day} - {last_day}: {orders} orders')
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt sales rollups from {total} orders.'))
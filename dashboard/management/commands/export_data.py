@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard import exports
+
+
+class Command(BaseCommand):
+    help = 'Export foods, payments, orders or order lines as CSV or NDJSON, streaming in constant memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=list(exports.DATASETS))
+        parser.add_argument('--format', choices=list(exports.FORMATS), default='csv')
+        parser.add_argument('--fields', default='', help='Comma-separated columns (default: a standard set)')
+        parser.add_argument('--since', help='First day to include (YYYY-MM-DD)')
+        parser.add_argument('--until', help='Last day to include (YYYY-MM-DD)')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--output', '-o', help='Write to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        try:
+            chunks = exports.stream(
+                options['dataset'],
+                options['format'],
+                fields=[field for field in options['fields'].split(',') if field],
+                since=exports.parse_date(options['since']),
+                until=exports.parse_date(options['until']),
+                chunk_size=options['chunk_size'],
+            )
+        except exports.ExportError as e:
+            raise CommandError(str(e))
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(chunks)
+            self.stderr.write(self.style.SUCCESS(f'Exported {options["dataset"]} to {options["output"]}.'))
+        else:
+            sys.stdout.writelines(chunks)
@@ -0,0 +1,236 @@
+"""
+Load a dumpdata JSON fixture with batched bulk inserts.
+
+``loaddata`` parses the whole file into memory and saves each object on
+its own, sending signals. fastload reads the fixture incrementally
+(dashboard/jsonstream.py, any of the UTF-8/16/32 encodings dumpdata may
+have been redirected into, optionally gzip/bz2/xz-compressed), buffers
+objects per model and writes each buffer with one multi-row INSERT per
+batch. Like loaddata, it runs in one transaction with constraint checks
+deferred and checked at the end, replaces rows whose primary key already
+exists, and resets sequences afterwards. Memory use is bounded by
+``--batch-size`` objects per model.
+
+No signals are sent and cart totals aren't maintained, so that state is
+rebuilt once at the end: the stored totals of every cart the fixture
+touched (loaded carts, carts of loaded items, active carts holding loaded
+foods) inside the load transaction, then the dashboard counters and the
+menu catalog version. Sales rollups for loaded orders come from
+``manage.py backfill_sales``.
+"""
+import bz2
+import gzip
+import lzma
+import time
+from collections import Counter, defaultdict
+
+from django.core import serializers
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.core.serializers.base import DeserializationError
+from django.core.serializers.python import Deserializer
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.db.models.constants import OnConflict
+
+from dashboard import jsonstream, stats
+from foods import cart as cart_service, catalog
+from foods.models import Cart, CartItem, Food
+from payments.models import Order
+
+OPENERS = {
+    'gz': gzip.open,
+    'bz2': bz2.open,
+    'xz': lzma.open,
+    'lzma': lzma.open,
+}
+
+
+class Loader:
+    """Per-model buffers of deserialized objects, flushed as bulk inserts."""
+
+    def __init__(self, using, batch_size):
+        self.using = using
+        self.connection = connections[using]
+        self.batch_size = batch_size
+        self.objects = defaultdict(list)
+        self.m2m_rows = defaultdict(list)  # through model -> [(field, source pk, [target pks])]
+        self.deferred = []
+        self.counts = Counter()
+        self.cart_ids = set()  # carts whose stored totals need recomputing
+        self.food_ids = set()
+
+    def add(self, deserialized):
+        obj = deserialized.object
+        model = type(obj)
+        self.track(obj)
+        if deserialized.deferred_fields:
+            # Natural keys of objects later in the file: saved once everything is in
+            self.deferred.append(deserialized)
+        if obj.pk is None or model._meta.parents:
+            # Rows without a pk, and multi-table children, can't be bulk inserted
+            deserialized.save(using=self.using)
+            self.counts[model] += 1
+            return
+        self.objects[model].append(obj)
+        for name, values in (deserialized.m2m_data or {}).items():
+            field = model._meta.get_field(name)
+            if field.remote_field.through._meta.auto_created:
+                self.m2m_rows[field.remote_field.through].append((field, obj.pk, values))
+        if len(self.objects[model]) >= self.batch_size:
+            self.flush(model)
+
+    def track(self, obj):
+        if isinstance(obj, Cart):
+            self.cart_ids.add(obj.pk)
+        elif isinstance(obj, CartItem):
+            self.cart_ids.add(obj.cart_id)
+        elif isinstance(obj, Food):
+            self.food_ids.add(obj.pk)
+
+    def recalculate_carts(self):
+        """Recompute the stored totals of the carts the load touched; returns how many."""
+        food_ids = list(self.food_ids)
+        for start in range(0, len(food_ids), self.batch_size):
+            self.cart_ids.update(cart_service.active_cart_ids(food_ids[start:start + self.batch_size]))
+        cart_ids = sorted(cart_id for cart_id in self.cart_ids if cart_id is not None)
+        return sum(
+            cart_service.recalculate_carts(cart_ids[start:start + self.batch_size])
+            for start in range(0, len(cart_ids), self.batch_size)
+        )
+
+    def flush(self, model):
+        objs = self.objects.pop(model, [])
+        if not objs:
+            return
+        opts = model._meta
+        fields = [field for field in opts.concrete_fields if not field.generated]
+        update_fields = [field for field in fields if not field.primary_key]
+        features = self.connection.features
+        # Existing rows are replaced, as loaddata does
+        on_conflict = OnConflict.UPDATE if update_fields else OnConflict.IGNORE
+        unique_fields = [opts.pk] if features.supports_update_conflicts_with_target else None
+
+        batch_size = min(self.batch_size, self.connection.ops.bulk_batch_size(fields, objs) or self.batch_size)
+        queryset = model._base_manager.using(self.using)
+        for start in range(0, len(objs), batch_size):
+            # raw=True stores the fixture's values as they are, skipping
+            # pre_save() (which would overwrite auto_now/auto_now_add fields)
+            queryset._insert(
+                objs[start:start + batch_size],
+                fields=fields,
+                raw=True,
+                using=self.using,
+                on_conflict=on_conflict,
+                update_fields=update_fields or None,
+                unique_fields=unique_fields if update_fields else None,
+            )
+        self.counts[model] += len(objs)
+
+        for through in [through for through in self.m2m_rows if through._meta.auto_created is model]:
+            self.flush_m2m(through)
+
+    def flush_m2m(self, through):
+        rows = self.m2m_rows.pop(through, [])
+        if not rows:
+            return
+        field = rows[0][0]
+        source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+        # Like ManyRelatedManager.set(): the fixture's list replaces the current one
+        through._base_manager.using(self.using).filter(
+            **{f'{source}__in': [source_pk for _, source_pk, _ in rows]}
+        ).delete()
+        through._base_manager.using(self.using).bulk_create(
+            [
+                through(**{f'{source}_id': source_pk, f'{target}_id': target_pk})
+                for _, source_pk, target_pks in rows
+                for target_pk in target_pks
+            ],
+            batch_size=self.batch_size,
+        )
+
+    def finish(self):
+        """Flush what is left (in dependency order) and save deferred fields."""
+        pending = defaultdict(list)
+        for model in self.objects:
+            pending[model._meta.app_config].append(model)
+        for model in serializers.sort_dependencies(pending.items(), allow_cycles=True):
+            self.flush(model)
+        for through in list(self.m2m_rows):
+            self.flush_m2m(through)
+        for deserialized in self.deferred:
+            deserialized.save_deferred_fields(using=self.using)
+
+
+class Command(BaseCommand):
+    help = 'Load dumpdata JSON fixtures with streaming parsing and batched bulk inserts (no signals)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('fixtures', nargs='+', metavar='fixture')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--ignorenonexistent', '-i', action='store_true',
+                            help='Ignore models and fields that are no longer in the project')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        connection = connections[using]
+        loader = Loader(using, options['batch_size'])
+        started = time.perf_counter()
+
+        try:
+            with transaction.atomic(using=using):
+                with connection.constraint_checks_disabled():
+                    for path in options['fixtures']:
+                        self._load(path, loader, options)
+                    loader.finish()
+                # Everything is in; now check the references between the rows
+                connection.check_constraints(table_names=[model._meta.db_table for model in loader.counts])
+                if using == DEFAULT_DB_ALIAS:
+                    recalculated = loader.recalculate_carts()
+        except (DatabaseError, DeserializationError, ValueError) as e:
+            raise CommandError(f'Nothing was loaded: {e}')
+
+        self._reset_sequences(connection, list(loader.counts))
+        elapsed = time.perf_counter() - started
+        total = sum(loader.counts.values())
+
+        for model, count in sorted(loader.counts.items(), key=lambda item: item[0]._meta.label):
+            self.stdout.write(f'  {model._meta.label}: {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Loaded {total} objects from {len(options["fixtures"])} fixture(s) in {elapsed:.2f}s '
+            f'({total / elapsed if elapsed else 0:.0f} objects/s).'
+        ))
+
+        if using == DEFAULT_DB_ALIAS:
+            stats.rebuild_counters()
+            catalog.bump_version()
+            self.stdout.write(
+                f'Recalculated {recalculated} cart totals, rebuilt dashboard counters and refreshed the menu cache.'
+            )
+        if Order in loader.counts:
+            self.stdout.write('Orders were loaded: run "manage.py backfill_sales" to update the sales rollups.')
+
+    def _load(self, path, loader, options):
+        opener = OPENERS.get(path.rsplit('.', 1)[-1].lower(), open)
+        try:
+            binary = opener(path, 'rb')
+        except OSError as e:
+            raise CommandError(f'Cannot read {path}: {e}')
+
+        with binary:
+            values = jsonstream.iter_values(jsonstream.open_text(binary))
+            objects = Deserializer(
+                values,
+                using=loader.using,
+                ignorenonexistent=options['ignorenonexistent'],
+                handle_forward_references=True,
+            )
+            for deserialized in objects:
+                loader.add(deserialized)
+
+    def _reset_sequences(self, connection, models):
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard import menu_io
+
+
+class Command(BaseCommand):
+    help = 'Add or update menu items from a CSV, JSON or NDJSON file with batched bulk writes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=menu_io.FORMATS, help='Default: from the file extension')
+        parser.add_argument('--dry-run', action='store_true', help='Show the changes without saving them')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        import_format = options['format'] or menu_io.detect_format(options['path'])
+        if import_format is None:
+            raise CommandError('Cannot tell the format from the file name; pass --format.')
+
+        try:
+            with open(options['path'], 'rb') as menu_file:
+                menu_plan, created, updated = menu_io.import_menu(
+                    menu_file, import_format, dry_run=options['dry_run'], batch_size=options['batch_size']
+                )
+        except OSError as e:
+            raise CommandError(f'Cannot read {options["path"]}: {e}')
+        except menu_io.MenuImportError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(menu_plan.summary())
+        if options['verbosity'] > 1:
+            for food in menu_plan.creates:
+                self.stdout.write(f'  + {food.name} (Ksh {food.price})')
+            for food, changes in menu_plan.updates:
+                self.stdout.write(f'  ~ #{food.pk} {food.name}: ' + ', '.join(
+                    f'{field} {old!r} -> {new!r}' for field, (old, new) in changes.items()
+                ))
+        for number, message in menu_plan.errors:
+            self.stderr.write(f'  row {number}: {message}')
+
+        if menu_plan.errors:
+            raise CommandError(f'{len(menu_plan.errors)} rows have errors; nothing was imported.')
+        if options['dry_run']:
+            self.stdout.write('Dry run: nothing was saved.')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Imported menu: {created} added, {updated} updated.'))
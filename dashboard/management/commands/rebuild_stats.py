@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard.stats import COUNTERS, rebuild_counters
+
+
+class Command(BaseCommand):
+    help = 'Recount the dashboard counters (users, carts, cart items, payments) from their tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f'Counters to rebuild (default: all of {", ".join(COUNTERS)})')
+
+    def handle(self, *args, **options):
+        unknown = set(options['names']) - set(COUNTERS)
+        if unknown:
+            raise CommandError(f'Unknown counters: {", ".join(sorted(unknown))}')
+
+        for name, value in rebuild_counters(options['names']).items():
+            self.stdout.write(f'{name}: {value}')
+        self.stdout.write(self.style.SUCCESS('Dashboard counters rebuilt.'))
@@ -0,0 +1,248 @@
+"""
+Bulk menu import.
+
+A menu file (CSV with a header row, a JSON array of objects, or NDJSON)
+is read row by row: CSV through csv.DictReader, JSON through
+jsonstream.iter_values, so an upload is never loaded whole. Each row is
+validated and matched to an existing Food by ``id`` or, without one, by
+name (case-insensitive). plan() builds the diff against the current menu
+(creates, updates, unchanged rows and errors); apply() writes it with
+batched bulk_create / bulk_update in one transaction and bumps the
+catalog version once. Files with errors are never applied.
+
+The columns are those of the foods export (``COLUMNS``), so an export
+edited in a spreadsheet can be imported back. Columns left out of a row
+keep their current value on update.
+"""
+import csv
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from foods import cart as cart_service, catalog
+from foods.models import Food
+
+from . import jsonstream
+
+COLUMNS = ['id', 'name', 'description', 'category', 'price', 'available']
+FORMATS = ('csv', 'json', 'ndjson')
+
+MAX_PRICE = Decimal('9999.99')
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'off'}
+
+
+class MenuImportError(ValueError):
+    """Invalid menu file, or an invalid row in one."""
+
+
+class MenuPlan:
+    """The changes a menu file makes: new Foods, changed Foods and rejected rows."""
+
+    def __init__(self):
+        self.creates = []
+        self.updates = []  # (food, {field: (old, new)})
+        self.unchanged = 0
+        self.errors = []  # (row number, message)
+
+    @property
+    def rows(self):
+        return len(self.creates) + len(self.updates) + self.unchanged + len(self.errors)
+
+    @property
+    def has_changes(self):
+        return bool(self.creates or self.updates)
+
+    def summary(self):
+        return (
+            f'{self.rows} rows: {len(self.creates)} to create, {len(self.updates)} to update, '
+            f'{self.unchanged} unchanged, {len(self.errors)} errors'
+        )
+
+
+def detect_format(filename):
+    """Import format from a file name's extension, or None."""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension == 'jsonl':
+        return 'ndjson'
+    return extension if extension in FORMATS else None
+
+
+def read_rows(binary, import_format):
+    """Yield (row number, dict) from a binary menu file, one row at a time."""
+    if import_format not in FORMATS:
+        raise MenuImportError(f'Unknown format "{import_format}"; choose from {", ".join(FORMATS)}.')
+    text = jsonstream.open_text(binary)
+
+    if import_format == 'csv':
+        reader = csv.DictReader(text)
+        if not reader.fieldnames or 'name' not in [name.strip().lower() for name in reader.fieldnames]:
+            raise MenuImportError('The CSV header row must include a "name" column.')
+        for row in reader:
+            yield reader.line_num, {
+                (key or '').strip().lower(): value for key, value in row.items() if key is not None
+            }
+        return
+
+    # JSON array and NDJSON are both sequences of values to iter_values
+    for number, value in enumerate(jsonstream.iter_values(text), 1):
+        yield number, value
+
+
+def _text(row, field):
+    value = str(row[field]).strip()
+    max_length = Food._meta.get_field(field).max_length
+    if max_length and len(value) > max_length:
+        raise MenuImportError(f'{field} is longer than {max_length} characters')
+    return value
+
+
+def _price(value):
+    try:
+        price = Decimal(str(value).strip().replace(',', ''))
+    except InvalidOperation:
+        raise MenuImportError(f'price "{value}" is not a number')
+    if not price.is_finite() or price < 0 or price > MAX_PRICE:
+        raise MenuImportError(f'price must be between 0 and {MAX_PRICE}')
+    return price.quantize(Decimal('0.01'))
+
+
+def _available(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise MenuImportError(f'available "{value}" is not yes/no')
+
+
+def clean_row(row):
+    """
+    Validate one row; returns (id or None, {field: value}) with only the
+    columns the row has. Raises MenuImportError.
+    """
+    if not isinstance(row, dict):
+        raise MenuImportError('expected an object')
+    # Empty cells (and JSON nulls) leave the current value alone
+    row = {key: value for key, value in row.items() if key in COLUMNS and value not in (None, '')}
+
+    food_id = None
+    if 'id' in row:
+        try:
+            food_id = int(str(row['id']).strip())
+        except ValueError:
+            raise MenuImportError(f'id "{row["id"]}" is not a number')
+
+    fields = {}
+    if 'name' in row:
+        fields['name'] = _text(row, 'name')
+    if 'description' in row:
+        fields['description'] = _text(row, 'description')
+    if 'category' in row:
+        fields['category'] = _text(row, 'category')
+    if 'price' in row:
+        fields['price'] = _price(row['price'])
+    if 'available' in row:
+        fields['available'] = _available(row['available'])
+
+    if food_id is None and not fields.get('name'):
+        raise MenuImportError('name is required')
+    return food_id, fields
+
+
+def plan(rows):
+    """Diff (row number, dict) pairs against the current menu; returns a MenuPlan."""
+    foods = {food.pk: food for food in Food.objects.only(*COLUMNS).order_by()}
+    by_name = {}
+    for food in foods.values():
+        by_name.setdefault(food.name.lower(), []).append(food)
+
+    result = MenuPlan()
+    seen = {}  # food id or lower-cased new name -> row number
+    for number, row in rows:
+        try:
+            food_id, fields = clean_row(row)
+            if food_id is not None:
+                food = foods.get(food_id)
+                if food is None:
+                    raise MenuImportError(f'no menu item with id {food_id}')
+            else:
+                matches = by_name.get(fields['name'].lower(), [])
+                if len(matches) > 1:
+                    raise MenuImportError(f'{len(matches)} menu items are named "{fields["name"]}"; give an id')
+                food = matches[0] if matches else None
+
+            key = food.pk if food is not None else fields['name'].lower()
+            if key in seen:
+                raise MenuImportError(f'same menu item as row {seen[key]}')
+            seen[key] = number
+        except MenuImportError as e:
+            result.errors.append((number, str(e)))
+            continue
+
+        if food is None:
+            if 'price' not in fields:
+                result.errors.append((number, 'price is required for a new menu item'))
+                continue
+            result.creates.append(Food(**fields))
+            continue
+
+        changes = {
+            field: (getattr(food, field), value)
+            for field, value in fields.items()
+            if getattr(food, field) != value
+        }
+        if changes:
+            result.updates.append((food, changes))
+        else:
+            result.unchanged += 1
+    return result
+
+
+def apply(menu_plan, batch_size=500):
+    """Write a plan's creates and updates in one transaction; returns (created, updated)."""
+    if menu_plan.errors:
+        raise MenuImportError(f'The file has {len(menu_plan.errors)} invalid rows; nothing was imported.')
+    if not menu_plan.has_changes:
+        return 0, 0
+
+    now = timezone.now()
+    fields = {'updated_at'}
+    for food, changes in menu_plan.updates:
+        for field, (_, new) in changes.items():
+            setattr(food, field, new)
+        # bulk_update() doesn't apply auto_now
+        food.updated_at = now
+        fields.update(changes)
+
+    with transaction.atomic():
+        Food.objects.bulk_create(menu_plan.creates, batch_size=batch_size)
+        updated = Food.objects.bulk_update(
+            [food for food, _ in menu_plan.updates], sorted(fields), batch_size=batch_size
+        )
+        # Bulk writes send no signals: invalidate the menu once, not per row,
+        # and reprice the active carts holding foods whose price changed
+        cart_service.recalculate_for_foods(
+            [food.pk for food, changes in menu_plan.updates if 'price' in changes]
+        )
+        transaction.on_commit(catalog.bump_version)
+    return len(menu_plan.creates), updated
+
+
+def import_menu(binary, import_format, dry_run=False, batch_size=500):
+    """Read, diff and (unless ``dry_run``) apply a menu file; returns (plan, created, updated)."""
+    try:
+        menu_plan = plan(read_rows(binary, import_format))
+    except MenuImportError:
+        raise
+    except UnicodeDecodeError as e:
+        raise MenuImportError(f'The file is not valid text: {e.reason}.')
+    except (ValueError, csv.Error) as e:
+        raise MenuImportError(f'Could not read the file: {e}')
+    if dry_run or menu_plan.errors:
+        return menu_plan, 0, 0
+    created, updated = apply(menu_plan, batch_size)
+    return menu_plan, created, updated
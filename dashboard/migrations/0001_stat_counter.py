@@ -0,0 +1,50 @@
+# Generated by Django 6.0 on 2026-10-16 20:53
+
+from django.db import migrations, models
+
+
+def seed_counters(apps, schema_editor):
+    """Start the counters from the current table sizes."""
+    User = apps.get_model('auth', 'User')
+    Cart = apps.get_model('foods', 'Cart')
+    CartItem = apps.get_model('foods', 'CartItem')
+    MpesaPayment = apps.get_model('payments', 'MpesaPayment')
+    StatCounter = apps.get_model('dashboard', 'StatCounter')
+
+    counts = {
+        'users': User.objects.filter(is_staff=False).count(),
+        'carts': Cart.objects.count(),
+        'cart_items': CartItem.objects.count(),
+        'payments': MpesaPayment.objects.count(),
+        'payments_completed': MpesaPayment.objects.filter(status='completed').count(),
+    }
+    StatCounter.objects.bulk_create(
+        StatCounter(name=name, shard=0, value=value) for name, value in counts.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('foods', '0007_cart_constraints'),
+        ('payments', '0005_order_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('name', 'shard'), name='unique_stat_counter_shard')],
+            },
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
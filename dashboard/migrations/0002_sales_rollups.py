@@ -0,0 +1,72 @@
+# Generated by Django 6.0 on 2026-10-16 20:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0001_stat_counter'),
+        ('foods', '0007_cart_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesByDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('day', models.DateField(unique=True)),
+            ],
+            options={
+                'ordering': ['day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SalesByHour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('hour', models.DateTimeField(unique=True)),
+            ],
+            options={
+                'ordering': ['hour'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CategorySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('day', models.DateField()),
+                ('category', models.CharField(blank=True, max_length=100)),
+            ],
+            options={
+                'ordering': ['day', 'category'],
+                'constraints': [models.UniqueConstraint(fields=('day', 'category'), name='unique_category_sales_day')],
+            },
+        ),
+        migrations.CreateModel(
+            name='FoodSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('day', models.DateField()),
+                ('name', models.CharField(max_length=200)),
+                ('food', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='foods.food')),
+            ],
+            options={
+                'ordering': ['day', 'name'],
+                'constraints': [models.UniqueConstraint(fields=('day', 'food'), name='unique_food_sales_day')],
+            },
+        ),
+    ]
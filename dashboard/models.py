@@ -1,3 +1,83 @@
 from django.db import models
 
-# Create your models here.
+
+class StatCounter(models.Model):
+    """
+    Running row counts for the dashboard, kept up to date by
+    dashboard/signals.py. Each counter is split over a few shards so
+    concurrent increments (every add-to-cart bumps ``cart_items``) don't
+    all queue on one row lock; a counter's value is the sum of its shards.
+    """
+    name = models.CharField(max_length=50)
+    shard = models.PositiveSmallIntegerField(default=0)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}[{self.shard}] = {self.value}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'shard'], name='unique_stat_counter_shard'),
+        ]
+
+
+class SalesRollup(models.Model):
+    """
+    Pre-aggregated sales, added to as orders complete (dashboard/analytics.py)
+    and rebuilt from orders by ``manage.py backfill_sales``.
+    """
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
+
+
+class SalesByDay(SalesRollup):
+    day = models.DateField(unique=True)
+
+    def __str__(self):
+        return f"{self.day}: KES {self.revenue}"
+
+    class Meta:
+        ordering = ['day']
+
+
+class SalesByHour(SalesRollup):
+    hour = models.DateTimeField(unique=True)  # start of the hour
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H:00}: KES {self.revenue}"
+
+    class Meta:
+        ordering = ['hour']
+
+
+class CategorySales(SalesRollup):
+    day = models.DateField()
+    category = models.CharField(max_length=100, blank=True)
+
+    def __str__(self):
+        return f"{self.day} {self.category or 'Uncategorized'}: KES {self.revenue}"
+
+    class Meta:
+        ordering = ['day', 'category']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category'], name='unique_category_sales_day'),
+        ]
+
+
+class FoodSales(SalesRollup):
+    day = models.DateField()
+    food = models.ForeignKey('foods.Food', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    name = models.CharField(max_length=200)  # as last sold
+
+    def __str__(self):
+        return f"{self.day} {self.name}: KES {self.revenue}"
+
+    class Meta:
+        ordering = ['day', 'name']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'food'], name='unique_food_sales_day'),
+        ]
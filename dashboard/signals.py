@@ -0,0 +1,67 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from foods.models import Cart, CartItem
+from payments.models import MpesaPayment
+
+from . import stats
+
+
+def _tracks(update_fields, field):
+    return update_fields is None or field in update_fields
+
+
+@receiver(pre_save, sender=User)
+@receiver(pre_save, sender=MpesaPayment)
+def remember_previous_state(sender, instance, update_fields=None, **kwargs):
+    """Load the counted field's stored value, so post_save can tell what changed."""
+    field = 'is_staff' if sender is User else 'status'
+    if instance.pk is None or not _tracks(update_fields, field):
+        return
+    instance._stats_previous = sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    was_staff = vars(instance).pop('_stats_previous', instance.is_staff)
+    if created:
+        stats.increment('users', 0 if instance.is_staff else 1)
+    elif was_staff != instance.is_staff:
+        stats.increment('users', -1 if instance.is_staff else 1)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    if not instance.is_staff:
+        stats.increment('users', -1)
+
+
+@receiver(post_save, sender=MpesaPayment)
+def payment_saved(sender, instance, created, **kwargs):
+    previous = vars(instance).pop('_stats_previous', instance.status)
+    if created:
+        previous = None
+        stats.increment('payments')
+    if previous != instance.status and 'completed' in (previous, instance.status):
+        stats.increment('payments_completed', 1 if instance.status == 'completed' else -1)
+
+
+@receiver(post_delete, sender=MpesaPayment)
+def payment_deleted(sender, instance, **kwargs):
+    stats.increment('payments', -1)
+    if instance.status == 'completed':
+        stats.increment('payments_completed', -1)
+
+
+@receiver(post_save, sender=Cart)
+@receiver(post_save, sender=CartItem)
+def row_created(sender, instance, created, **kwargs):
+    if created:
+        stats.increment('carts' if sender is Cart else 'cart_items')
+
+
+@receiver(post_delete, sender=Cart)
+@receiver(post_delete, sender=CartItem)
+def row_deleted(sender, instance, **kwargs):
+    stats.increment('carts' if sender is Cart else 'cart_items', -1)
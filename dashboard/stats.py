@@ -0,0 +1,85 @@
+"""
+Dashboard statistics.
+
+Counts over small tables (foods) are computed in a single conditional
+aggregate. Counts over tables that grow with traffic (users, carts, cart
+items, payments) are maintained incrementally in StatCounter by signal
+handlers, in the same transaction as the change they count, so the
+dashboard reads them in one query whatever the table sizes.
+rebuild_counters() (``manage.py rebuild_stats``) recounts them from
+scratch if they ever drift, e.g. after raw SQL or bulk loads; it is safe
+to run while the site takes traffic.
+"""
+import random
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+
+from foods.models import Cart, CartItem, Food
+from payments.models import MpesaPayment
+
+from .models import StatCounter
+
+SHARDS = 8
+
+# Counter name -> queryset it counts, used by rebuild_counters()
+COUNTERS = {
+    'users': lambda: User.objects.filter(is_staff=False),
+    'carts': lambda: Cart.objects.all(),
+    'cart_items': lambda: CartItem.objects.all(),
+    'payments': lambda: MpesaPayment.objects.all(),
+    'payments_completed': lambda: MpesaPayment.objects.filter(status='completed'),
+}
+
+
+def increment(name, delta=1):
+    """Add ``delta`` to a counter, in the caller's transaction."""
+    if not delta:
+        return
+    shard = random.randrange(SHARDS)
+    counters = StatCounter.objects.filter(name=name, shard=shard)
+    if counters.update(value=F('value') + delta):
+        return
+    try:
+        with transaction.atomic():
+            StatCounter.objects.create(name=name, shard=shard, value=delta)
+    except IntegrityError:
+        # Someone else created the shard first
+        counters.update(value=F('value') + delta)
+
+
+def get_counters():
+    """Return {name: value} for every counter, in one query."""
+    totals = dict(
+        StatCounter.objects.order_by().values_list('name').annotate(total=Sum('value'))
+    )
+    return {name: totals.get(name, 0) for name in COUNTERS}
+
+
+def food_stats():
+    """Total, available, out-of-stock and category counts of foods, in one query."""
+    stats = Food.objects.aggregate(
+        total_foods=Count('id'),
+        available_foods=Count('id', filter=Q(available=True)),
+        total_categories=Count('category', distinct=True),
+    )
+    stats['out_of_stock'] = stats['total_foods'] - stats['available_foods']
+    return stats
+
+
+def rebuild_counters(names=None):
+    """
+    Recount counters from their tables; returns {name: value}. Each
+    counter's shard rows (and, on InnoDB, the gaps for new shards) are
+    locked before counting, so a concurrent change either commits before
+    the count sees it or waits and increments the rebuilt value.
+    """
+    values = {}
+    with transaction.atomic():
+        for name in names or COUNTERS:
+            list(StatCounter.objects.select_for_update().filter(name=name).values_list('id', flat=True))
+            values[name] = COUNTERS[name]().count()
+            StatCounter.objects.filter(name=name).delete()
+            StatCounter.objects.create(name=name, shard=0, value=values[name])
+    return values
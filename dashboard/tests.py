@@ -1,3 +1,245 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db.models import Count, Sum
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from foods import cart as cart_service
+from foods.models import Cart, Food
+from payments import orders
+from payments.models import MpesaPayment, Order, OrderLine
+
+from . import analytics, exports, jsonstream, stats
+from .models import CategorySales, FoodSales, SalesByDay, SalesByHour, StatCounter
+
+
+class BulkPriceTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.force_login(self.staff)
+
+    def post(self, name, data):
+        return self.client.post(reverse(f'dashboard:{name}'), json.dumps(data), content_type='application/json')
+
+    def test_bulk_price_reprices_active_carts(self):
+        food = Food.objects.create(name='Pizza', price=Decimal('100.00'))
+        cart = cart_service.get_active_cart(User.objects.create_user('customer'))
+        cart_service.add_item(cart, food, 3)
+
+        response = self.post('bulk_price', {'ids': [food.pk], 'percent': 10})
+        self.assertEqual(response.status_code, 200, response.content)
+        cart.refresh_from_db()
+        self.assertEqual(str(cart.subtotal), '330.00')
+
+    def test_ids_must_be_a_list_of_ints(self):
+        foods = [Food.objects.create(name=f'Food {n}', price=Decimal('10.00')) for n in range(3)]
+        ids_as_text = ''.join(str(food.pk) for food in foods[:2])
+        for ids in (ids_as_text, [str(foods[0].pk)], [True], {'id': foods[0].pk}, list(range(1, 502))):
+            with self.subTest(ids=ids):
+                response = self.post('bulk_price', {'ids': ids, 'price': 5})
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(Food.objects.filter(price=Decimal('5.00')).exists())
+
+        response = self.post('bulk_availability', {'ids': [foods[2].pk], 'available': False})
+        self.assertEqual(response.json()['updated'], 1)
+
+
+class JsonStreamTests(SimpleTestCase):
+    def values(self, text, chunk_size=4):
+        return list(jsonstream.iter_values(io.StringIO(text), chunk_size))
+
+    def test_reads_arrays_and_value_streams_across_chunks(self):
+        self.assertEqual(self.values('[{"a": [1, 2]}, "x,y", 12345.678]'), [{'a': [1, 2]}, 'x,y', 12345.678])
+        self.assertEqual(self.values(' [ ] '), [])
+        self.assertEqual(self.values('{"a": 1}\n{"a": 2.5}\n'), [{'a': 1}, {'a': 2.5}])
+
+    def test_rejects_malformed_arrays_with_the_offset(self):
+        for text, offset in (('[1 2 ,, 3]', 3), ('[1,,2]', 3), ('[1,]', 3), ('[,1]', 1), ('[1] 2', 4)):
+            with self.subTest(text=text):
+                with self.assertRaisesRegex(ValueError, f'at character {offset}$'):
+                    self.values(text)
+        with self.assertRaisesRegex(ValueError, 'not closed'):
+            self.values('[1, 2')
+
+
+class FastloadTests(TestCase):
+    def test_loaded_carts_get_their_totals(self):
+        now = '2026-01-01T12:00:00Z'
+        fixture = [
+            {'model': 'auth.user', 'pk': 900, 'fields': {
+                'username': 'loaded', 'password': '!', 'date_joined': now,
+            }},
+            {'model': 'foods.food', 'pk': 900, 'fields': {
+                'name': 'Pizza', 'price': '100.00', 'created_at': now, 'updated_at': now,
+            }},
+            {'model': 'foods.food', 'pk': 901, 'fields': {
+                'name': 'Soda', 'price': '80.00', 'created_at': now, 'updated_at': now,
+            }},
+            {'model': 'foods.cart', 'pk': 900, 'fields': {
+                'user': 900, 'is_active': True, 'created_at': now, 'updated_at': now,
+            }},
+            {'model': 'foods.cartitem', 'pk': 900, 'fields': {
+                'cart': 900, 'food': 900, 'quantity': 2, 'created_at': now,
+            }},
+            {'model': 'foods.cartitem', 'pk': 901, 'fields': {
+                'cart': 900, 'food': 901, 'quantity': 1, 'created_at': now,
+            }},
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump(fixture, f)
+        self.addCleanup(os.unlink, f.name)
+
+        call_command('fastload', f.name, stdout=io.StringIO())
+
+        cart = Cart.objects.get(pk=900)
+        self.assertEqual(cart.subtotal, Decimal('280.00'))
+        self.assertEqual(cart.item_count, 3)
+
+
+class StatCounterTests(TestCase):
+    def test_increments_spread_over_shards_and_sum_up(self):
+        shards = iter(range(stats.SHARDS))
+        with mock.patch('dashboard.stats.random.randrange', side_effect=lambda n: next(shards)):
+            for delta in (1, 2, 3, -1, 0):
+                stats.increment('payments', delta)
+        self.assertEqual(StatCounter.objects.filter(name='payments').count(), 4)
+        self.assertEqual(stats.get_counters()['payments'], 5)
+
+    def test_rebuild_counters_recounts_from_the_tables(self):
+        user = User.objects.create_user('customer', password='pw')
+        food = Food.objects.create(name='Pizza', price=Decimal('100.00'))
+        cart_service.add_item(cart_service.get_active_cart(user), food)
+        counted = stats.get_counters()
+        self.assertEqual((counted['users'], counted['carts'], counted['cart_items']), (1, 1, 1))
+
+        StatCounter.objects.update(value=42)  # drifted
+        stats.increment('users', 5)
+        self.assertEqual(stats.rebuild_counters(), {
+            'users': 1, 'carts': 1, 'cart_items': 1, 'payments': 0, 'payments_completed': 0,
+        })
+        self.assertEqual(stats.get_counters(), stats.rebuild_counters())
+        self.assertEqual(StatCounter.objects.filter(name='users').count(), 1)
+
+        stats.increment('users')
+        self.assertEqual(stats.get_counters()['users'], 2)
+
+
+class SalesAnalyticsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('customer', password='pw')
+        self.pizza = Food.objects.create(name='Pizza', category='Mains', price=Decimal('100.00'))
+        self.soda = Food.objects.create(name='Soda', category='Drinks', price=Decimal('80.00'))
+
+    def order(self, *items, days_ago=0):
+        lines = [
+            {'food_id': food.pk, 'name': food.name, 'category': food.category,
+             'unit_price': str(food.price), 'quantity': quantity}
+            for food, quantity in items
+        ]
+        amount = sum(food.price * quantity for food, quantity in items)
+        payment = MpesaPayment.objects.create(
+            user=self.user, phone_number='254712345678', amount=amount, status='completed', lines=lines,
+        )
+        order = orders.create_order(payment, None)
+        if days_ago:
+            Order.objects.filter(pk=order.pk).update(created_at=order.created_at - timedelta(days=days_ago))
+        return order
+
+    def assertSummaryMatchesOrders(self):
+        summary = analytics.sales_summary(days=30)
+        since = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=29)
+        recent = Order.objects.filter(created_at__gte=since)
+        totals = recent.aggregate(orders=Count('id'), units=Sum('item_count'), revenue=Sum('total'))
+        self.assertEqual(
+            (summary['orders'], summary['units'], summary['revenue']),
+            (totals['orders'], totals['units'], float(totals['revenue'])),
+        )
+        by_category = OrderLine.objects.filter(order__in=recent).values('category').annotate(
+            units=Sum('quantity'), revenue=Sum('line_total')
+        )
+        self.assertEqual(
+            {row['category']: (row['units'], row['revenue']) for row in summary['categories']},
+            {row['category']: (row['units'], float(row['revenue'])) for row in by_category},
+        )
+        by_food = OrderLine.objects.filter(order__in=recent).values('name').annotate(
+            units=Sum('quantity'), revenue=Sum('line_total')
+        )
+        self.assertEqual(
+            {row['name']: (row['units'], row['revenue']) for row in summary['top_foods']},
+            {row['name']: (row['units'], float(row['revenue'])) for row in by_food},
+        )
+        self.assertEqual(sum(day['revenue'] for day in summary['daily']), summary['revenue'])
+        self.assertEqual(sum(summary['hourly']), summary['revenue'])
+
+    def rollups(self):
+        return [
+            sorted(model.objects.values_list(*fields, 'orders', 'units', 'revenue'))
+            for model, fields in (
+                (SalesByDay, ('day',)), (SalesByHour, ('hour',)),
+                (CategorySales, ('day', 'category')), (FoodSales, ('day', 'food_id', 'name')),
+            )
+        ]
+
+    def test_summary_matches_the_orders(self):
+        self.order((self.pizza, 2), (self.soda, 1))
+        self.order((self.pizza, 1))
+        self.order((self.soda, 3))
+        self.assertSummaryMatchesOrders()
+
+    def test_backfill_is_idempotent(self):
+        self.order((self.pizza, 2), (self.soda, 1))
+        self.order((self.pizza, 1), days_ago=1)
+        self.order((self.soda, 3), days_ago=3)
+        self.order((self.pizza, 4), days_ago=40)  # outside the summary
+        # The rollups were recorded for today; the backfill moves the older orders
+        call_command('backfill_sales', '--chunk-days', '2', stdout=io.StringIO())
+        self.assertSummaryMatchesOrders()
+        self.assertEqual(SalesByDay.objects.count(), 4)
+        once = self.rollups()
+
+        call_command('backfill_sales', '--chunk-days', '2', stdout=io.StringIO())
+        self.assertEqual(self.rollups(), once)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.foods = [Food.objects.create(name=f'Food {i}', price=Decimal('100.00')) for i in range(8)]
+        self.foods.pop(4).delete()  # a gap in the primary keys
+
+    def test_keyset_pages_cover_every_row_once(self):
+        ids = [food.pk for food in self.foods]
+        for chunk_size in (1, 3, 7, 100):
+            with self.subTest(chunk_size=chunk_size):
+                rows = list(exports.iter_rows('foods', ['id', 'name'], chunk_size=chunk_size))
+                self.assertEqual([row[0] for row in rows], ids)
+
+        # 7 rows in chunks of 3: a short last chunk ends it without another query
+        with self.assertNumQueries(3):
+            list(exports.iter_rows('foods', ['id'], chunk_size=3))
+
+    def test_export_view_streams_csv(self):
+        self.client.force_login(User.objects.create_user('staff', password='pw', is_staff=True))
+        response = self.client.get(reverse('dashboard:export_data', args=['foods']), {'fields': 'id,name'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ['id', 'name'])
+        self.assertEqual(rows[1:], [[str(food.pk), food.name] for food in self.foods])
+
+    def test_formulas_are_exported_as_text(self):
+        Food.objects.filter(pk=self.foods[0].pk).update(name='=HYPERLINK("http://example.com")')
+        Food.objects.filter(pk=self.foods[1].pk).update(name='-20% off')
+        Food.objects.filter(pk=self.foods[2].pk).update(name='Chips & Co-op')
+        lines = ''.join(exports.stream('foods', fields=['name']))
+        names = [row[0] for row in csv.reader(io.StringIO(lines))][1:4]
+        self.assertEqual(names, ["'=HYPERLINK(\"http://example.com\")", "'-20% off", 'Chips & Co-op'])
@@ -7,11 +7,15 @@ urlpatterns = [
     path('', views.dashboard_home, name='dashboard_home'),
     path('manage/', views.manage_foods, name='manage_foods'),
     path('add/', views.add_food, name='add_food'),
+    path('import/', views.import_menu, name='import_menu'),
     path('edit/<int:food_id>/', views.edit_food, name='edit_food'),
     path('delete/<int:food_id>/', views.delete_food, name='delete_food'),
     path('print-report/', views.print_report, name='print_report'),
+    path('export/<slug:dataset>/', views.export_data, name='export_data'),
     
     # AJAX endpoints
     path('toggle-availability/<int:food_id>/', views.toggle_availability, name='toggle_availability'),
     path('update-price/<int:food_id>/', views.update_price, name='update_price'),
+    path('bulk/availability/', views.bulk_availability, name='bulk_availability'),
+    path('bulk/price/', views.bulk_price, name='bulk_price'),
 ]
\ No newline at end of file
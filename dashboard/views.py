@@ -2,15 +2,12 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_POST
 from foods.models import Food
-from django.db.models import Count, Q
 import json
-from django.contrib.auth.models import User 
 from datetime import datetime
-from foods.models import Cart
-from foods.models import CartItem
+from . import analytics, bulk, exports, menu_io, stats
 
 
 # Check if user is staff/admin
@@ -23,20 +20,12 @@ def dashboard_home(request):
     """Main dashboard view with statistics"""
     foods = Food.objects.all().order_by('-id')
     
-    # Calculate statistics
-    total_foods = foods.count()
-    available_foods = foods.filter(available=True).count()
-    out_of_stock = foods.filter(available=False).count()
-    
-    
-    total_categories = foods.values('category').distinct().count()
-    
+    # Calculate statistics (one aggregate query)
     context = {
         'foods': foods,
-        'total_foods': total_foods,
-        'available_foods': available_foods,
-        'out_of_stock': out_of_stock,
-        'total_categories': total_categories,
+        **stats.food_stats(),
+        # Sales charts, read from the rollup tables only
+        'sales': analytics.sales_summary(days=30),
     }
     
     return render(request, 'dashboard/home.html', context)
@@ -88,6 +77,42 @@ def add_food(request):
     return render(request, 'dashboard/add_food.html')
 
 
+@login_required
+@user_passes_test(is_staff_user)
+def import_menu(request):
+    """Bulk add/update menu items from a CSV, JSON or NDJSON file, with a dry-run preview"""
+    context = {'export_fields': ','.join(menu_io.COLUMNS)}
+    if request.method == 'POST':
+        upload = request.FILES.get('file')
+        dry_run = request.POST.get('dry_run') == 'on'
+        if not upload:
+            context['error'] = 'Choose a file to import.'
+            return render(request, 'dashboard/import_menu.html', context)
+
+        import_format = request.POST.get('format') or menu_io.detect_format(upload.name)
+        if import_format is None:
+            context['error'] = 'Cannot tell the file format from its name; choose one.'
+            return render(request, 'dashboard/import_menu.html', context)
+        try:
+            menu_plan, created, updated = menu_io.import_menu(upload, import_format, dry_run=dry_run)
+        except menu_io.MenuImportError as e:
+            context['error'] = f'Error importing menu: {str(e)}'
+            return render(request, 'dashboard/import_menu.html', context)
+
+        context.update({
+            'plan': menu_plan,
+            'dry_run': dry_run,
+            'applied': not dry_run and not menu_plan.errors,
+            'created': created,
+            'updated': updated,
+            # Enough to review; the counts cover the rest
+            'creates': menu_plan.creates[:100],
+            'updates': menu_plan.updates[:100],
+            'errors': menu_plan.errors[:100],
+        })
+    return render(request, 'dashboard/import_menu.html', context)
+
+
 @login_required
 @user_passes_test(is_staff_user)
 def edit_food(request, food_id):
@@ -190,34 +215,102 @@ def update_price(request, food_id):
         return JsonResponse({'success': False, 'message': str(e)}, status=400)
 
 
+def _bulk_response(foods):
+    return JsonResponse({
+        'success': True,
+        'updated': len(foods),
+        'foods': [{**food, 'price': float(food['price'])} for food in foods],
+    })
+
+
+@login_required
+@user_passes_test(is_staff_user)
+@require_POST
+def bulk_availability(request):
+    """
+    Mark many foods available or sold out in one UPDATE via AJAX.
+    Body: {"ids": [...]} and/or {"category": "..."}, plus {"available": true/false}
+    """
+    try:
+        data = json.loads(request.body)
+        if 'available' not in data:
+            return JsonResponse({'success': False, 'message': '"available" is required'}, status=400)
+        foods = bulk.set_availability(
+            bulk.select_foods(data.get('ids'), data.get('category')), data['available']
+        )
+        return _bulk_response(foods)
+    except (ValueError, AttributeError) as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+
+@login_required
+@user_passes_test(is_staff_user)
+@require_POST
+def bulk_price(request):
+    """
+    Set or adjust the price of many foods in one UPDATE via AJAX.
+    Body: {"ids": [...]} and/or {"category": "..."}, plus {"price": 250}
+    or {"percent": 10} (negative for a discount)
+    """
+    try:
+        data = json.loads(request.body)
+        foods = bulk.set_price(
+            bulk.select_foods(data.get('ids'), data.get('category')),
+            price=data.get('price'),
+            percent=data.get('percent'),
+        )
+        return _bulk_response(foods)
+    except (ValueError, AttributeError) as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+
 @login_required
 @user_passes_test(is_staff_user)
 def print_report(request):
     """Generate printable report"""
     
-    # Get all statistics
-    total_foods = Food.objects.count()
-    available_foods = Food.objects.filter(available=True).count()
-    out_of_stock = Food.objects.filter(available=False).count()
-    total_users = User.objects.filter(is_staff=False).count()
+    # Food counts in one aggregate; users and carts from the maintained counters
+    food_stats = stats.food_stats()
+    counters = stats.get_counters()
     
     # Get all foods
     foods = Food.objects.all().order_by('-id')
     
-    # Get cart statistics
-    total_carts = Cart.objects.count()
-    total_cart_items = CartItem.objects.count()
-    
     context = {
-        'total_foods': total_foods,
-        'available_foods': available_foods,
-        'out_of_stock': out_of_stock,
-        'total_users': total_users,
-        'total_carts': total_carts,
-        'total_cart_items': total_cart_items,
+        'total_foods': food_stats['total_foods'],
+        'available_foods': food_stats['available_foods'],
+        'out_of_stock': food_stats['out_of_stock'],
+        'total_users': counters['users'],
+        'total_carts': counters['carts'],
+        'total_cart_items': counters['cart_items'],
         'foods': foods,
         'report_date': datetime.now(),
     }
     
     return render(request, 'dashboard/print_report.html', context)
 
+
+@login_required
+@user_passes_test(is_staff_user)
+def export_data(request, dataset):
+    """
+    Stream foods, payments, orders or order_lines as CSV or NDJSON.
+    Query parameters: format (csv/ndjson), fields (comma-separated
+    columns), since and until (YYYY-MM-DD, inclusive).
+    """
+    export_format = request.GET.get('format', 'csv')
+    fields = [field for field in request.GET.get('fields', '').split(',') if field]
+    try:
+        chunks = exports.stream(
+            dataset,
+            export_format,
+            fields=fields,
+            since=exports.parse_date(request.GET.get('since')),
+            until=exports.parse_date(request.GET.get('until')),
+        )
+    except exports.ExportError as e:
+        return HttpResponseBadRequest(str(e))
+
+    response = StreamingHttpResponse(chunks, content_type=exports.FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{exports.filename(dataset, export_format)}"'
+    return response
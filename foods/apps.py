@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class FoodsConfig(AppConfig):
     name = 'foods'
+
+    def ready(self):
+        from . import signals  # noqa: F401
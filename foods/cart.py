@@ -0,0 +1,331 @@
+"""
+Cart mutations.
+
+Cart.subtotal and Cart.item_count are denormalized from the cart's items.
+Every CartItem change goes through the functions below, which adjust the
+stored totals with DB-side arithmetic in the same transaction as the item
+write, so checkout can price a cart from the cart row alone. Each
+mutation takes the cart row's lock first, before touching any item, so
+concurrent changes to one cart queue up on it instead of deadlocking
+on InnoDB (the FK check of an item write share-locks the cart row). Price
+changes and deleted foods go the other way: the active carts holding
+them are recomputed with recalculate_for_foods(). The navbar badge count
+(lines in the cart) is cached per user and written through after each
+commit.
+"""
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import DecimalField, F, IntegerField, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from dashboard import stats as dashboard_stats
+
+from .models import Cart, CartItem, Food
+
+
+BADGE_TIMEOUT = 60 * 60
+
+
+def _badge_key(user_id):
+    return f'cart:badge:{user_id}'
+
+
+def badge_count(user_id):
+    """Number of lines in the user's active cart, served from the cache."""
+    count = cache.get(_badge_key(user_id))
+    if count is None:
+        count = CartItem.objects.filter(cart__active_user=user_id).count()
+        cache.set(_badge_key(user_id), count, BADGE_TIMEOUT)
+    return count
+
+
+def refresh_badge(cart_id):
+    """Write the cart's current line count through to the badge cache."""
+    cart = Cart.objects.filter(pk=cart_id).values('user_id', 'is_active').first()
+    if cart and cart['user_id']:
+        count = CartItem.objects.filter(cart_id=cart_id).count() if cart['is_active'] else 0
+        cache.set(_badge_key(cart['user_id']), count, BADGE_TIMEOUT)
+
+
+def _adjust_totals(cart_id, quantity, amount):
+    Cart.objects.filter(pk=cart_id).update(
+        item_count=F('item_count') + quantity,
+        subtotal=F('subtotal') + amount,
+    )
+    transaction.on_commit(lambda: refresh_badge(cart_id))
+
+
+def get_active_cart(user):
+    """Return the user's active cart, creating it if there is none."""
+    cart = Cart.objects.filter(active_user=user.pk).first()
+    if cart is None:
+        try:
+            with transaction.atomic():
+                cart = Cart.objects.create(user=user, is_active=True)
+        except IntegrityError:
+            # A concurrent request created it first (one_active_cart_per_user)
+            cart = Cart.objects.get(active_user=user.pk)
+    return cart
+
+
+def _upsert_item(cart_id, food_id, quantity):
+    """
+    Insert the (cart, food) line or add ``quantity`` to it, in one
+    statement; returns True if the line was inserted.
+    """
+    table = CartItem._meta.db_table
+    qn = connection.ops.quote_name
+    created_at = CartItem._meta.get_field('created_at').get_db_prep_value(timezone.now(), connection)
+    insert = (
+        f"INSERT INTO {qn(table)} ({qn('cart_id')}, {qn('food_id')}, {qn('quantity')}, {qn('created_at')}) "
+        "VALUES (%s, %s, %s, %s) "
+    )
+    params = [cart_id, food_id, quantity, created_at]
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            # 1 affected row for an insert, 2 for an update of the existing line
+            cursor.execute(
+                insert + f"ON DUPLICATE KEY UPDATE {qn('quantity')} = {qn('quantity')} + VALUES({qn('quantity')})",
+                params,
+            )
+            return cursor.rowcount == 1
+        cursor.execute(
+            insert + f"ON CONFLICT ({qn('cart_id')}, {qn('food_id')}) "
+            f"DO UPDATE SET {qn('quantity')} = {qn(table)}.{qn('quantity')} + excluded.{qn('quantity')} "
+            f"RETURNING {qn('quantity')}",
+            params,
+        )
+        # Stored lines never have a quantity of 0, so only a new line equals the increment
+        return cursor.fetchone()[0] == quantity
+
+
+def _lock_cart(cart_id):
+    list(Cart.objects.select_for_update().filter(pk=cart_id).values_list('pk', flat=True))
+
+
+def add_item(cart, food, quantity=1):
+    """
+    Add ``quantity`` of ``food`` to ``cart``; returns True if a new line was
+    created. The line is inserted or incremented by a single upsert on the
+    (cart, food) unique constraint, so concurrent adds never lose updates,
+    duplicate lines or race each other between separate statements.
+    """
+    with transaction.atomic():
+        # The totals UPDATE comes first: it takes the cart row lock
+        _adjust_totals(cart.pk, quantity, food.price * quantity)
+        created = _upsert_item(cart.pk, food.pk, quantity)
+        if created:
+            # A raw insert sends no post_save, so count the new line here
+            dashboard_stats.increment('cart_items')
+    return created
+
+
+def set_quantity(item, quantity):
+    """Set the quantity of an existing cart item."""
+    with transaction.atomic():
+        _lock_cart(item.cart_id)
+        current = CartItem.objects.select_for_update().select_related('food').get(pk=item.pk)
+        delta = quantity - current.quantity
+        if delta:
+            CartItem.objects.filter(pk=item.pk).update(quantity=quantity)
+            _adjust_totals(current.cart_id, delta, current.food.price * delta)
+    item.quantity = quantity
+    return item
+
+
+def remove_item(item):
+    """Delete a cart item and take it off the cart's totals."""
+    with transaction.atomic():
+        _lock_cart(item.cart_id)
+        current = CartItem.objects.select_for_update().select_related('food').filter(pk=item.pk).first()
+        if current is None:
+            return
+        current.delete()
+        _adjust_totals(current.cart_id, -current.quantity, -current.food.price * current.quantity)
+
+
+def clear(cart):
+    """Delete every item in ``cart`` and zero its totals."""
+    with transaction.atomic():
+        _lock_cart(cart.pk)
+        cart.items.all().delete()
+        Cart.objects.filter(pk=cart.pk).update(item_count=0, subtotal=0)
+        transaction.on_commit(lambda: refresh_badge(cart.pk))
+
+
+BATCH_OPERATIONS = ('add', 'set', 'remove')
+
+
+class BatchError(ValueError):
+    """A batch of cart operations was rejected; nothing was applied."""
+
+
+def apply_batch(cart, operations):
+    """
+    Apply a list of line operations to ``cart`` in one transaction:
+
+        {"op": "add", "food_id": 3, "quantity": 2}
+        {"op": "set", "item_id": 7, "quantity": 4}   (or "food_id"; 0 removes)
+        {"op": "remove", "item_id": 7}               (or "food_id")
+
+    Operations are folded into a final quantity per food first, then written
+    with one bulk delete, one bulk update and one bulk insert, and the cart
+    totals are recomputed with a single aggregate.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise BatchError('operations must be a non-empty list')
+
+    with transaction.atomic():
+        _lock_cart(cart.pk)
+        items = {
+            item.food_id: item
+            for item in CartItem.objects.select_for_update().filter(cart=cart)
+        }
+        food_by_item = {item.pk: food_id for food_id, item in items.items()}
+        quantities = {food_id: item.quantity for food_id, item in items.items()}
+
+        for position, operation in enumerate(operations):
+            if not isinstance(operation, dict) or operation.get('op') not in BATCH_OPERATIONS:
+                raise BatchError(f'operation {position}: op must be one of {", ".join(BATCH_OPERATIONS)}')
+            op = operation['op']
+
+            if op == 'add' or 'food_id' in operation:
+                try:
+                    food_id = int(operation['food_id'])
+                except (KeyError, TypeError, ValueError):
+                    raise BatchError(f'operation {position}: food_id is required')
+            else:
+                try:
+                    food_id = food_by_item[int(operation.get('item_id'))]
+                except (KeyError, TypeError, ValueError):
+                    raise BatchError(f'operation {position}: item not in cart')
+
+            if op == 'remove':
+                quantities[food_id] = 0
+                continue
+
+            try:
+                quantity = int(operation.get('quantity', 1))
+            except (TypeError, ValueError):
+                raise BatchError(f'operation {position}: quantity must be an integer')
+
+            if op == 'add':
+                if quantity < 1:
+                    raise BatchError(f'operation {position}: quantity must be at least 1')
+                quantities[food_id] = quantities.get(food_id, 0) + quantity
+            else:
+                if quantity < 0:
+                    raise BatchError(f'operation {position}: quantity cannot be negative')
+                if food_id not in quantities:
+                    raise BatchError(f'operation {position}: item not in cart')
+                quantities[food_id] = quantity
+
+        new_food_ids = [food_id for food_id, qty in quantities.items() if qty and food_id not in items]
+        if new_food_ids:
+            available = set(Food.objects.filter(
+                id__in=new_food_ids, available=True
+            ).values_list('id', flat=True))
+            missing = sorted(set(new_food_ids) - available)
+            if missing:
+                raise BatchError(f'foods not available: {", ".join(map(str, missing))}')
+
+        to_delete = [item.pk for food_id, item in items.items() if not quantities[food_id]]
+        to_update = []
+        for food_id, item in items.items():
+            if quantities[food_id] and quantities[food_id] != item.quantity:
+                item.quantity = quantities[food_id]
+                to_update.append(item)
+        to_create = [
+            CartItem(cart=cart, food_id=food_id, quantity=quantities[food_id])
+            for food_id in new_food_ids
+        ]
+
+        if to_delete:
+            CartItem.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            CartItem.objects.bulk_update(to_update, ['quantity'])
+        if to_create:
+            CartItem.objects.bulk_create(to_create)
+            # bulk_create sends no post_save, so count the new lines here
+            dashboard_stats.increment('cart_items', len(to_create))
+        recalculate(cart)
+
+    return cart
+
+
+def cart_state(cart):
+    """JSON-ready view of ``cart`` and its lines."""
+    lines = CartItem.objects.filter(cart=cart).select_related('food')
+    return {
+        'id': cart.pk,
+        'subtotal': str(cart.subtotal),
+        'item_count': cart.item_count,
+        'items': [
+            {
+                'id': item.pk,
+                'food_id': item.food_id,
+                'name': item.food.name,
+                'quantity': item.quantity,
+                'unit_price': str(item.food.price),
+                'total_price': str(item.total_price()),
+            }
+            for item in lines
+        ],
+    }
+
+
+def with_computed_totals(carts):
+    """Annotate ``carts`` with totals recomputed from their items."""
+    return carts.annotate(
+        computed_subtotal=Coalesce(
+            Sum(F('items__quantity') * F('items__food__price')),
+            Value(Decimal('0')),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ),
+        computed_count=Coalesce(Sum('items__quantity'), Value(0), output_field=IntegerField()),
+    )
+
+
+def recalculate(cart):
+    """Recompute and store ``cart``'s totals from its items."""
+    totals = with_computed_totals(Cart.objects.filter(pk=cart.pk)).values(
+        'computed_subtotal', 'computed_count'
+    ).get()
+    subtotal = Decimal(totals['computed_subtotal']).quantize(Decimal('0.01'))
+    Cart.objects.filter(pk=cart.pk).update(subtotal=subtotal, item_count=totals['computed_count'])
+    transaction.on_commit(lambda: refresh_badge(cart.pk))
+    cart.subtotal = subtotal
+    cart.item_count = totals['computed_count']
+    return cart
+
+
+def recalculate_carts(cart_ids, batch_size=500):
+    """Recompute and store the totals of the carts in ``cart_ids``."""
+    cart_ids = list(cart_ids)
+    if not cart_ids:
+        return 0
+    carts = list(with_computed_totals(Cart.objects.filter(pk__in=cart_ids)).only('id'))
+    for cart in carts:
+        cart.subtotal = Decimal(cart.computed_subtotal).quantize(Decimal('0.01'))
+        cart.item_count = cart.computed_count
+    Cart.objects.bulk_update(carts, ['subtotal', 'item_count'], batch_size=batch_size)
+    for cart in carts:
+        transaction.on_commit(lambda cart_id=cart.pk: refresh_badge(cart_id))
+    return len(carts)
+
+
+def active_cart_ids(food_ids):
+    """Ids of the active carts holding any of ``food_ids``."""
+    return list(
+        CartItem.objects.filter(food_id__in=food_ids, cart__is_active=True)
+        .values_list('cart_id', flat=True).distinct()
+    )
+
+
+def recalculate_for_foods(food_ids):
+    """Recompute the active carts holding any of ``food_ids``, e.g. after a price change."""
+    return recalculate_carts(active_cart_ids(food_ids))
@@ -0,0 +1,93 @@
+"""
+In-process menu catalog cache.
+
+The menu only changes when staff edit foods in the dashboard, so the
+ordering page is served from precomputed snapshots of available foods
+keyed by (search, category); searches are ranked by the in-process index
+in foods/search.py. Every snapshot is stored under the current
+catalog version; saving or deleting a Food bumps the version, which makes
+all older snapshots unreachable (they age out through the cache's own
+eviction).
+
+The version counter lives in the CATALOG_CACHE_ALIAS cache. With the
+default LocMem backend that cache is per process, so a bump in one worker
+does not invalidate the others; run several workers only with the alias
+pointed at a shared backend (Redis/Memcached).
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import search as search_index
+from .models import Food
+
+VERSION_KEY = 'catalog:version'
+
+
+def _cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'catalog')]
+
+
+def get_version():
+    """Return the current catalog version, initialising it if needed."""
+    cache = _cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seed from the clock so a restarted process (or an evicted key)
+        # never reuses a version that older snapshots were stored under.
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    """Invalidate every cached snapshot by moving to a new version."""
+    cache = _cache()
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        # Key missing (first write or evicted): start a fresh version.
+        version = int(time.time() * 1000)
+        cache.set(VERSION_KEY, version, timeout=None)
+        return version
+
+
+def _normalize(value):
+    return (value or '').strip().lower()
+
+
+def _snapshot_key(search, category):
+    raw = f'{search}\x00{category}'
+    return 'catalog:menu:' + hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def _build_snapshot(search, category):
+    if not search and not category:
+        return list(Food.objects.filter(available=True).order_by('-id'))
+
+    # Filtered views are derived from the full snapshot, never from the DB
+    if search:
+        return [food for food, score in search_index.search_foods(search, category)]
+
+    return [food for food in get_menu() if (food.category or '').lower() == category]
+
+
+def get_menu(search='', category=''):
+    """
+    Return the list of available foods matching ``search`` and ``category``,
+    newest first, from the cache when possible.
+    """
+    # Normalised once, so the key and the snapshot stored under it agree
+    search, category = _normalize(search), _normalize(category)
+    cache = _cache()
+    version = get_version()
+    key = _snapshot_key(search, category)
+
+    foods = cache.get(key, version=version)
+    if foods is None:
+        foods = _build_snapshot(search, category)
+        cache.set(key, foods, version=version)
+    return foods
+
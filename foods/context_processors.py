@@ -1,15 +1,31 @@
+import functools
+import logging
+
+from django.db import DatabaseError
+
+from .cart import badge_count
+
+logger = logging.getLogger(__name__)
+
+
 def cart_count(request):
     """
     Context processor to add cart item count to all templates.
-    Returns the number of items in the user's cart.
+    Returns the number of lines (distinct foods) in the user's active cart.
+
+    The count is a lazy callable served from the per-user badge cache, so
+    pages that never render the badge don't pay for it.
     """
-    if request.user.is_authenticated:
+    @functools.cache
+    def count():
+        if not request.user.is_authenticated:
+            return 0
         try:
-            from .models import Cart, CartItem
-            cart = Cart.objects.filter(user=request.user).first()
-            if cart:
-                count = CartItem.objects.filter(cart=cart).count()
-                return {'cart_count': count}
-        except Exception:
-            return {'cart_count': 0}
-    return {'cart_count': 0}
\ No newline at end of file
+            return badge_count(request.user.pk)
+        except (DatabaseError, OSError):
+            # The badge must not take the page down with it; the database
+            # or a cache server being unreachable is logged, anything else raises
+            logger.exception("Could not load the cart badge for user %s", request.user.pk)
+            return 0
+
+    return {'cart_count': count}
@@ -0,0 +1,138 @@
+"""
+Food image variants.
+
+Staff upload full-size photos, but the menu card, the cart and the
+dashboard only ever show them at a few hundred pixels or less. After an
+upload, process_food_image() runs on the background executor and writes
+resized, cropped copies of the image for each use (VARIANTS), in WebP
+and JPEG at 1x/2x-style widths, under content-hashed names, and records
+them in Food.image_variants. The ``food_image`` template tag
+(templatetags/food_images.py) turns them into a <picture> with
+srcset/sizes and lazy loading; until the variants exist it falls back to
+the original upload.
+"""
+import hashlib
+import logging
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from .models import Food
+
+logger = logging.getLogger(__name__)
+
+VARIANT_DIR = 'foods/variants'
+
+# use -> box it is cropped to (width, height), widths generated, CSS sizes
+VARIANTS = {
+    'card': {
+        'box': (480, 320),
+        'widths': (320, 480, 640, 960),
+        'sizes': '(max-width: 767px) 100vw, (max-width: 1199px) 33vw, 25vw',
+    },
+    'cart': {'box': (100, 100), 'widths': (100, 200), 'sizes': '100px'},
+    'dashboard': {'box': (50, 50), 'widths': (50, 100), 'sizes': '50px'},
+}
+
+# format -> (file extension, Pillow save options)
+FORMATS = {
+    'webp': ('webp', {'format': 'WEBP', 'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def needs_processing(food):
+    """True if the food has an image whose variants are missing or stale."""
+    return bool(food.image) and (food.image_variants or {}).get('source') != food.image.name
+
+
+def variants_for(food):
+    """The food's recorded variants, or None if they don't match its current image."""
+    variants = food.image_variants or {}
+    if not food.image or variants.get('source') != food.image.name:
+        return None
+    return variants
+
+
+def srcset(food, variant, image_format='webp'):
+    """``srcset`` attribute value for a variant, or '' if it isn't available."""
+    variants = variants_for(food)
+    if not variants or variant not in variants:
+        return ''
+    files = variants[variant].get(image_format, {})
+    return ', '.join(
+        f'{default_storage.url(name)} {width}w'
+        for width, name in sorted(files.items(), key=lambda item: int(item[0]))
+    )
+
+
+def _to_rgb(image):
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _render(image, size, image_format):
+    _, options = FORMATS[image_format]
+    buffer = BytesIO()
+    ImageOps.fit(image, size, Image.Resampling.LANCZOS).save(buffer, **options)
+    return buffer.getvalue()
+
+
+def build_variants(data, source_name):
+    """Write every variant of the image bytes ``data``; returns the variants record."""
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    image = _to_rgb(Image.open(BytesIO(data)))
+
+    record = {'source': source_name, 'hash': digest, 'width': image.width, 'height': image.height}
+    for variant, spec in VARIANTS.items():
+        box_width, box_height = spec['box']
+        # Never upscale: widths beyond the original are dropped (the smallest is always kept)
+        widths = [w for w in spec['widths'] if w <= image.width] or [min(spec['widths'])]
+        record[variant] = {'width': box_width, 'height': box_height}
+
+        for image_format, (extension, _) in FORMATS.items():
+            files = {}
+            for width in widths:
+                name = f'{VARIANT_DIR}/{digest}-{variant}-{width}.{extension}'
+                # Content-hashed: an existing file already holds these pixels
+                if not default_storage.exists(name):
+                    size = (width, round(width * box_height / box_width))
+                    name = default_storage.save(name, ContentFile(_render(image, size, image_format)))
+                files[str(width)] = name
+            record[variant][image_format] = files
+    return record
+
+
+def process_food_image(food_id):
+    """Generate and record the variants of a food's current image."""
+    food = Food.objects.filter(pk=food_id).first()
+    if food is None or not needs_processing(food):
+        return None
+
+    source_name = food.image.name
+    try:
+        with food.image.open('rb') as source:
+            data = source.read()
+        record = build_variants(data, source_name)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.error(f"Could not process image {source_name} of food {food_id}: {e}")
+        # Recorded so the upload isn't retried on every save; the original is served
+        record = {'source': source_name, 'error': str(e)}
+
+    with transaction.atomic():
+        current = Food.objects.select_for_update().filter(pk=food_id).first()
+        # Skip if the image was replaced meanwhile; that upload has its own job
+        if current is None or current.image.name != source_name:
+            return None
+        current.image_variants = record
+        # A normal save, so the menu cache and search index pick it up
+        current.save(update_fields=['image_variants'])
+    return record
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from foods.cart import refresh_badge, with_computed_totals
+from foods.models import Cart
+
+
+class Command(BaseCommand):
+    help = "Compare each cart's stored subtotal/item count with its items and optionally repair drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Write the recomputed totals back')
+        parser.add_argument('--all', action='store_true', help='Check completed carts too, not just active ones')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        carts = Cart.objects.all() if options['all'] else Cart.objects.filter(is_active=True)
+        rows = with_computed_totals(carts.order_by()).values_list(
+            'pk', 'subtotal', 'item_count', 'computed_subtotal', 'computed_count'
+        )
+
+        checked = drifted = 0
+        for pk, subtotal, item_count, computed_subtotal, computed_count in rows.iterator(
+            chunk_size=options['chunk_size']
+        ):
+            checked += 1
+            if subtotal == computed_subtotal and item_count == computed_count:
+                continue
+
+            drifted += 1
+            self.stdout.write(
+                f'Cart {pk}: stored {subtotal} / {item_count} items, '
+                f'actual {computed_subtotal} / {computed_count} items'
+            )
+            if options['fix']:
+                Cart.objects.filter(pk=pk).update(
+                    subtotal=computed_subtotal,
+                    item_count=computed_count,
+                )
+                refresh_badge(pk)
+
+        action = 'repaired' if options['fix'] else 'found'
+        style = self.style.WARNING if drifted and not options['fix'] else self.style.SUCCESS
+        self.stdout.write(style(f'Checked {checked} carts, {action} {drifted} with drift.'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from foods import images
+from foods.models import Food
+
+
+class Command(BaseCommand):
+    help = 'Generate the resized WebP/JPEG variants of food images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Regenerate variants that already exist too')
+
+    def handle(self, *args, **options):
+        foods = Food.objects.exclude(image='').exclude(image__isnull=True).only('id', 'image', 'image_variants')
+        processed = failed = 0
+        for food in foods.iterator():
+            if options['all']:
+                food.image_variants = {}
+                Food.objects.filter(pk=food.pk).update(image_variants={})
+            elif not images.needs_processing(food):
+                continue
+            record = images.process_food_image(food.pk)
+            if record is None or 'error' in record:
+                failed += 1
+                self.stderr.write(f'Food {food.pk}: could not process {food.image.name}')
+            else:
+                processed += 1
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} images, {failed} failed.'))
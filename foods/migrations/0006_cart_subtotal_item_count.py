@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-16 20:41
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, IntegerField, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_cart_totals(apps, schema_editor):
+    Cart = apps.get_model('foods', 'Cart')
+    carts = Cart.objects.annotate(
+        computed_subtotal=Coalesce(
+            Sum(F('items__quantity') * F('items__food__price')),
+            Value(Decimal('0')),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ),
+        computed_count=Coalesce(Sum('items__quantity'), Value(0), output_field=IntegerField()),
+    ).values_list('pk', 'computed_subtotal', 'computed_count')
+
+    for pk, subtotal, count in carts.iterator():
+        Cart.objects.filter(pk=pk).update(subtotal=subtotal, item_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foods', '0005_alter_cart_options_alter_cartitem_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(backfill_cart_totals, migrations.RunPython.noop),
+    ]
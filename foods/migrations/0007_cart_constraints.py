@@ -0,0 +1,57 @@
+# Generated by Django 6.0 on 2026-10-16 20:42
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    """Make existing rows satisfy the new unique constraints."""
+    Cart = apps.get_model('foods', 'Cart')
+    CartItem = apps.get_model('foods', 'CartItem')
+
+    # Keep the newest active cart per user, retire the others
+    duplicated_users = (
+        Cart.objects.filter(is_active=True, user__isnull=False)
+        .values('user').annotate(carts=Count('id')).filter(carts__gt=1)
+        .values_list('user', flat=True)
+    )
+    for user_id in duplicated_users:
+        carts = Cart.objects.filter(user_id=user_id, is_active=True).order_by('-created_at', '-id')
+        Cart.objects.filter(pk__in=list(carts.values_list('pk', flat=True)[1:])).update(is_active=False)
+
+    # Fold duplicate (cart, food) lines into one
+    duplicated_lines = (
+        CartItem.objects.values('cart', 'food')
+        .annotate(lines=Count('id'), total=Sum('quantity')).filter(lines__gt=1)
+    )
+    for line in duplicated_lines:
+        items = CartItem.objects.filter(cart_id=line['cart'], food_id=line['food']).order_by('id')
+        keep = items.first()
+        items.exclude(pk=keep.pk).delete()
+        CartItem.objects.filter(pk=keep.pk).update(quantity=line['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foods', '0006_cart_subtotal_item_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='cart',
+            name='active_user',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(is_active=True, then=models.F('user')), default=None), output_field=models.IntegerField(null=True)),
+        ),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(fields=('active_user',), name='one_active_cart_per_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'food'), name='unique_cart_food'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-16 20:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foods', '0007_cart_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='food',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import Case, F, When
 
 class Food(models.Model):
     name = models.CharField(max_length=200)
@@ -7,6 +8,8 @@ class Food(models.Model):
     price = models.DecimalField(max_digits=6, decimal_places=2)
     category = models.CharField(max_length=100, blank=True)
     image = models.ImageField(upload_to='foods/', blank=True, null=True)
+    # Resized WebP/JPEG copies of ``image``, written by foods/images.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     available = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -22,6 +25,17 @@ class Food(models.Model):
 class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     is_active = models.BooleanField(default=True)  # Track active/inactive carts
+    # Denormalized totals, kept in step with CartItem changes by foods/cart.py
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
+    # user_id while the cart is active, NULL once completed. A unique index on
+    # it allows one active cart per user; MySQL/MariaDB have no partial
+    # unique indexes, but every backend supports this on a stored column.
+    active_user = models.GeneratedField(
+        expression=Case(When(is_active=True, then=F('user')), default=None),
+        output_field=models.IntegerField(null=True),
+        db_persist=True,
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -29,10 +43,13 @@ class Cart(models.Model):
         return f"Cart ({self.user}) - {'Active' if self.is_active else 'Completed'}"
 
     def total_price(self):
-        return sum(item.total_price() for item in self.items.all())
+        return self.subtotal
     
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['active_user'], name='one_active_cart_per_user'),
+        ]
 
 
 class CartItem(models.Model):
@@ -48,4 +65,7 @@ class CartItem(models.Model):
         return f"{self.quantity}x {self.food.name}"
     
     class Meta:
-        ordering = ['created_at']
\ No newline at end of file
+        ordering = ['created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'food'], name='unique_cart_food'),
+        ]
\ No newline at end of file
@@ -0,0 +1,217 @@
+"""
+Tokenized menu search.
+
+An inverted index (term -> foods) over Food.name, Food.category and
+Food.description, plus a trigram index (trigram -> terms) used to match
+misspelt and partially typed words. The index lives in-process, is built
+from the cached catalog snapshot and follows the catalog version: a Food
+save/delete in this process is applied incrementally, while a version
+bumped elsewhere triggers a rebuild on the next search.
+"""
+import bisect
+import math
+import re
+import threading
+from collections import defaultdict
+
+from . import catalog
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Relative importance of a term depending on the field it came from
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'category': 2.0,
+    'description': 1.0,
+}
+
+PREFIX_SIMILARITY = 0.9     # "piz" while typing "pizza"
+MIN_FUZZY_SIMILARITY = 0.3  # trigram Jaccard needed to accept a typo
+MIN_FUZZY_LENGTH = 3
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def trigrams(term):
+    padded = f'  {term} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Inverted + trigram index over the available foods."""
+
+    def __init__(self):
+        self.version = None
+        self._postings = defaultdict(dict)  # term -> {food_id: weight}
+        self._trigrams = defaultdict(set)   # trigram -> {term}
+        self._docs = {}                     # food_id -> {term: weight}
+        self._categories = {}               # food_id -> lowercased category
+        self._sorted_terms = None           # for prefix lookups, built lazily
+
+    def __len__(self):
+        return len(self._docs)
+
+    def clear(self):
+        self._postings.clear()
+        self._trigrams.clear()
+        self._docs.clear()
+        self._categories.clear()
+        self._sorted_terms = None
+
+    def add(self, food):
+        """Index ``food``, replacing any previous entry for it."""
+        self.remove(food.id)
+
+        terms = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(getattr(food, field)):
+                terms[term] = max(terms.get(term, 0.0), weight)
+
+        for term, weight in terms.items():
+            if term not in self._postings:
+                self._sorted_terms = None
+                for gram in trigrams(term):
+                    self._trigrams[gram].add(term)
+            self._postings[term][food.id] = weight
+
+        self._docs[food.id] = terms
+        self._categories[food.id] = (food.category or '').lower()
+
+    def remove(self, food_id):
+        terms = self._docs.pop(food_id, None)
+        self._categories.pop(food_id, None)
+        if not terms:
+            return
+
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(food_id, None)
+            if not postings:
+                del self._postings[term]
+                self._sorted_terms = None
+                for gram in trigrams(term):
+                    self._trigrams[gram].discard(term)
+                    if not self._trigrams[gram]:
+                        del self._trigrams[gram]
+
+    def _expand(self, token):
+        """Return {term: similarity} for the indexed terms matching ``token``."""
+        matches = {}
+        if token in self._postings:
+            matches[token] = 1.0
+
+        if len(token) >= 2:
+            if self._sorted_terms is None:
+                self._sorted_terms = sorted(self._postings)
+            start = bisect.bisect_right(self._sorted_terms, token)
+            for term in self._sorted_terms[start:]:
+                if not term.startswith(token):
+                    break
+                matches[term] = PREFIX_SIMILARITY
+
+        if len(token) >= MIN_FUZZY_LENGTH:
+            token_grams = trigrams(token)
+            shared = defaultdict(int)
+            for gram in token_grams:
+                for term in self._trigrams.get(gram, ()):
+                    shared[term] += 1
+            for term, count in shared.items():
+                similarity = count / (len(token_grams) + len(trigrams(term)) - count)
+                if similarity >= MIN_FUZZY_SIMILARITY and similarity > matches.get(term, 0.0):
+                    matches[term] = similarity
+
+        return matches
+
+    def search(self, query, category='', limit=None):
+        """
+        Rank foods against ``query``. Every query word has to match (exactly,
+        as a prefix or fuzzily); returns a list of (food_id, score), best first.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        category = (category or '').strip().lower()
+        total = len(self._docs) or 1
+        scores = None
+
+        for token in dict.fromkeys(tokens):
+            token_scores = {}
+            for term, similarity in self._expand(token).items():
+                postings = self._postings[term]
+                idf = math.log(1 + total / len(postings))
+                for food_id, weight in postings.items():
+                    score = similarity * weight * idf
+                    if score > token_scores.get(food_id, 0.0):
+                        token_scores[food_id] = score
+
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {
+                    food_id: score + token_scores[food_id]
+                    for food_id, score in scores.items()
+                    if food_id in token_scores
+                }
+            if not scores:
+                return []
+
+        if category:
+            scores = {
+                food_id: score for food_id, score in scores.items()
+                if self._categories.get(food_id) == category
+            }
+
+        # Ties go to the newest food, matching the menu's default ordering
+        ranked = sorted(scores.items(), key=lambda pair: (-pair[1], -pair[0]))
+        return ranked[:limit] if limit else ranked
+
+
+_index = SearchIndex()
+_lock = threading.Lock()
+
+
+def get_index():
+    """Return the process-wide index, rebuilding it if the catalog moved on."""
+    version = catalog.get_version()
+    if _index.version == version:
+        return _index
+
+    with _lock:
+        if _index.version != version:
+            _index.clear()
+            for food in catalog.get_menu():
+                _index.add(food)
+            _index.version = version
+    return _index
+
+
+def apply_change(food, new_version, removed=False):
+    """
+    Fold a single Food change into the index after the catalog version was
+    bumped to ``new_version``. If other changes happened in between the
+    index is left stale and gets rebuilt on the next search instead.
+    """
+    with _lock:
+        if _index.version is None or _index.version != new_version - 1:
+            return
+        if removed or not food.available:
+            _index.remove(food.id)
+        else:
+            _index.add(food)
+        _index.version = new_version
+
+
+def search_foods(query, category='', limit=None):
+    """Return [(food, score)] for the available foods matching ``query``."""
+    index = get_index()
+    by_id = {food.id: food for food in catalog.get_menu()}
+    with _lock:
+        ranked = index.search(query, category)
+    # Limited only after dropping foods that are no longer on the menu
+    results = [(by_id[food_id], score) for food_id, score in ranked if food_id in by_id]
+    return results[:limit] if limit else results
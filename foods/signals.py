@@ -0,0 +1,41 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from pikaquick import background
+
+from . import cart, catalog, images, search
+from .models import Food
+
+
+def _food_changed(food, removed=False):
+    # Runs after commit so a concurrent reader can't cache the old rows
+    # under the new version.
+    new_version = catalog.bump_version()
+    search.apply_change(food, new_version, removed=removed)
+
+
+@receiver(post_save, sender=Food)
+def food_saved(sender, instance, **kwargs):
+    """Any change to a Food makes the cached menu snapshots stale."""
+    transaction.on_commit(lambda: _food_changed(instance))
+    if not kwargs.get('created') and (
+        kwargs.get('update_fields') is None or 'price' in kwargs['update_fields']
+    ):
+        # Active carts store their subtotal; reprice them in this transaction
+        cart.recalculate_for_foods([instance.pk])
+    if images.needs_processing(instance):
+        # New upload: resize it off the request thread
+        background.submit_on_commit(images.process_food_image, instance.pk)
+
+
+@receiver(pre_delete, sender=Food)
+def food_deleting(sender, instance, **kwargs):
+    """Note the carts holding the food before the cascade removes their items."""
+    instance._cart_ids = cart.active_cart_ids([instance.pk])
+
+
+@receiver(post_delete, sender=Food)
+def food_deleted(sender, instance, **kwargs):
+    cart.recalculate_carts(vars(instance).pop('_cart_ids', []))
+    transaction.on_commit(lambda: _food_changed(instance, removed=True))
@@ -0,0 +1,38 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html
+
+from foods import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def food_image(food, variant='card', css_class='', alt=None, eager=False):
+    """
+    Responsive <picture> for a food's image: WebP and JPEG srcsets sized
+    for ``variant`` (see foods.images.VARIANTS), lazily loaded unless
+    ``eager``. Falls back to the original upload until its variants exist.
+    """
+    alt = food.name if alt is None else alt
+    loading = 'eager' if eager else 'lazy'
+    variants = images.variants_for(food)
+
+    if not variants or variant not in variants:
+        return format_html(
+            '<img src="{}" class="{}" alt="{}" loading="{}" decoding="async">',
+            food.image.url, css_class, alt, loading,
+        )
+
+    spec = images.VARIANTS[variant]
+    files = variants[variant]['jpeg']
+    fallback = default_storage.url(files[str(min(int(width) for width in files))])
+    return format_html(
+        '<picture style="display: contents">'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" class="{}" alt="{}" loading="{}" decoding="async">'
+        '</picture>',
+        images.srcset(food, variant, 'webp'), spec['sizes'],
+        fallback, images.srcset(food, variant, 'jpeg'), spec['sizes'],
+        variants[variant]['width'], variants[variant]['height'], css_class, alt, loading,
+    )
@@ -1,3 +1,340 @@
-from django.test import TestCase
+import json
+import tempfile
+import threading
+import unittest
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from . import cart as cart_service, catalog, images, search
+from .context_processors import cart_count
+from .models import Cart, CartItem, Food
+
+
+def reset_catalog():
+    caches['catalog'].clear()
+    search._index.version = None
+
+
+class CatalogTests(TestCase):
+    def setUp(self):
+        reset_catalog()
+        self.pizza = Food.objects.create(name='Pizza', category='Mains', price=Decimal('500.00'))
+        Food.objects.create(name='Soda', category='Drinks', price=Decimal('80.00'))
+
+    def test_search_is_normalised_before_keying_and_searching(self):
+        padded = catalog.get_menu('  PIZZA ', ' mains')
+        plain = catalog.get_menu('pizza', 'Mains')
+        self.assertEqual(padded, [self.pizza])
+        self.assertEqual(plain, [self.pizza])
+        self.assertEqual(
+            catalog._snapshot_key(catalog._normalize(' pizza'), ''),
+            catalog._snapshot_key(catalog._normalize('pizza'), ''),
+        )
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        reset_catalog()
+        self.pizza = Food.objects.create(name='Pizza Margherita', category='Mains', price=Decimal('500.00'))
+        self.soda = Food.objects.create(name='Soda', description='Goes well with pizza', price=Decimal('80.00'))
+        self.chips = Food.objects.create(name='Chips', category='Sides', price=Decimal('150.00'))
+
+    def names(self, query, category='', limit=None):
+        return [food.name for food, score in search.search_foods(query, category, limit)]
+
+    def save(self, food):
+        # Signals apply the change to the index once the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            food.save()
+
+    def test_name_matches_outrank_description_matches(self):
+        self.assertEqual(self.names('pizza'), ['Pizza Margherita', 'Soda'])
+        self.assertEqual(self.names('pizza', category='mains'), ['Pizza Margherita'])
+
+    def test_typos_and_prefixes_match(self):
+        self.assertEqual(self.names('piza'), ['Pizza Margherita', 'Soda'])
+        self.assertEqual(self.names('margh'), ['Pizza Margherita'])
+        self.assertEqual(self.names('chisp'), ['Chips'])
+        self.assertEqual(self.names('burger'), [])
+
+    def test_index_follows_added_edited_and_removed_foods(self):
+        self.assertEqual(self.names('burger'), [])
+        burger = Food(name='Beef Burger', price=Decimal('400.00'))
+        self.save(burger)
+        self.assertEqual(self.names('burger'), ['Beef Burger'])
+
+        burger.name = 'Cheeseburger'
+        self.save(burger)
+        self.assertEqual(self.names('beef'), [])
+        self.assertEqual(self.names('cheeseburger'), ['Cheeseburger'])
+
+        burger.available = False
+        self.save(burger)
+        self.assertEqual(self.names('cheeseburger'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chips.delete()
+        self.assertEqual(self.names('chips'), [])
+
+    def test_limit_applies_after_unavailable_foods_are_dropped(self):
+        self.assertEqual(self.names('pizza', limit=1), ['Pizza Margherita'])
+        # Sold out without a signal, so the index still holds it until the
+        # menu snapshot is rebuilt
+        Food.objects.filter(pk=self.pizza.pk).update(available=False)
+        caches['catalog'].delete(catalog._snapshot_key('', ''), version=catalog.get_version())
+        self.assertEqual(self.names('pizza', limit=1), ['Soda'])
+
+
+class MenuApiTests(TestCase):
+    def setUp(self):
+        reset_catalog()
+        self.user = User.objects.create_user('menu', password='pw')
+        self.client.force_login(self.user)
+
+    def test_search_pages_keep_the_ranking(self):
+        # The older food matches on its name, so it outranks the newer one
+        best = Food.objects.create(name='Pizza', category='Mains', price=Decimal('500.00'))
+        other = Food.objects.create(name='Soda', description='Goes well with pizza', price=Decimal('80.00'))
+
+        first = self.client.get(reverse('menu_api'), {'search': 'pizza', 'limit': 1}).json()
+        self.assertEqual([row['id'] for row in first['results']], [best.id])
+        self.assertIsNotNone(first['next_cursor'])
+
+        second = self.client.get(
+            reverse('menu_api'), {'search': 'pizza', 'limit': 1, 'cursor': first['next_cursor']}
+        ).json()
+        self.assertEqual([row['id'] for row in second['results']], [other.id])
+        self.assertIsNone(second['next_cursor'])
+
+
+class CartTotalsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cart', password='pw')
+        self.food = Food.objects.create(name='Pizza', price=Decimal('100.00'))
+        self.cart = cart_service.get_active_cart(self.user)
+        cart_service.add_item(self.cart, self.food, 2)
+
+    def test_price_change_reprices_active_carts(self):
+        self.food.price = '150.00'
+        self.food.save()
+        self.cart.refresh_from_db()
+        self.assertEqual(str(self.cart.subtotal), '300.00')
+        self.assertEqual(self.cart.item_count, 2)
+
+    def test_completed_carts_keep_their_totals(self):
+        Cart.objects.filter(pk=self.cart.pk).update(is_active=False)
+        self.food.price = '150.00'
+        self.food.save()
+        self.cart.refresh_from_db()
+        self.assertEqual(str(self.cart.subtotal), '200.00')
+
+    def test_deleting_a_food_takes_it_off_active_carts(self):
+        soda = Food.objects.create(name='Soda', price=Decimal('80.00'))
+        cart_service.add_item(self.cart, soda)
+        soda.delete()
+        self.cart.refresh_from_db()
+        self.assertEqual(str(self.cart.subtotal), '200.00')
+        self.assertEqual(self.cart.item_count, 2)
+
+
+class AddItemTests(TestCase):
+    def test_add_reports_whether_the_line_is_new(self):
+        food = Food.objects.create(name='Pizza', price=Decimal('100.00'))
+        cart = cart_service.get_active_cart(User.objects.create_user('cart'))
+        self.assertTrue(cart_service.add_item(cart, food, 2))
+        self.assertFalse(cart_service.add_item(cart, food, 3))
+        self.assertEqual(CartItem.objects.get(cart=cart, food=food).quantity, 5)
+
+
+@unittest.skipUnless(
+    connection.vendor == 'mysql',
+    'InnoDB row locking is what this exercises; SQLite serializes every write',
+)
+class ConcurrentAddItemTests(TransactionTestCase):
+    def test_concurrent_first_adds_make_one_line(self):
+        food = Food.objects.create(name='Pizza', price=Decimal('100.00'))
+        cart = cart_service.get_active_cart(User.objects.create_user('cart'))
+        workers = 8
+        barrier = threading.Barrier(workers)
+        created, errors = [], []
+
+        def add():
+            try:
+                barrier.wait()
+                created.append(cart_service.add_item(cart, food))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(created.count(True), 1)
+        self.assertEqual(CartItem.objects.get(cart=cart, food=food).quantity, workers)
+        cart.refresh_from_db()
+        self.assertEqual(cart.item_count, workers)
+        self.assertEqual(cart.subtotal, Decimal('100.00') * workers)
+
+
+class CartBadgeTests(TestCase):
+    def test_badge_counts_lines_not_units(self):
+        user = User.objects.create_user('badge', password='pw')
+        cart = cart_service.get_active_cart(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            cart_service.add_item(cart, Food.objects.create(name='Pizza', price=Decimal('100.00')), 3)
+            cart_service.add_item(cart, Food.objects.create(name='Soda', price=Decimal('80.00')))
+        self.assertEqual(cart_service.badge_count(user.pk), 2)
+
+        caches['default'].clear()
+        self.assertEqual(cart_service.badge_count(user.pk), 2)
+
+    def test_database_errors_are_logged_and_shown_as_zero(self):
+        user = User.objects.create_user('badge', password='pw')
+        request = RequestFactory().get('/')
+        request.user = user
+        with mock.patch('foods.context_processors.badge_count', side_effect=DatabaseError('gone')):
+            with self.assertLogs('foods.context_processors', 'ERROR'):
+                self.assertEqual(cart_count(request)['cart_count'](), 0)
+
+    def test_other_errors_are_not_hidden(self):
+        request = RequestFactory().get('/')
+        request.user = User.objects.create_user('badge', password='pw')
+        with mock.patch('foods.context_processors.badge_count', side_effect=KeyError('bug')):
+            with self.assertRaises(KeyError):
+                cart_count(request)['cart_count']()
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('batch', password='pw')
+        self.client.force_login(self.user)
+        self.pizza = Food.objects.create(name='Pizza', price=Decimal('100.00'))
+        self.soda = Food.objects.create(name='Soda', price=Decimal('80.00'))
+        self.chips = Food.objects.create(name='Chips', price=Decimal('150.00'))
+        self.cart = cart_service.get_active_cart(self.user)
+        cart_service.add_item(self.cart, self.pizza, 2)
+        cart_service.add_item(self.cart, self.soda)
+
+    def post(self, operations):
+        return self.client.post(
+            reverse('update_cart_batch'), json.dumps({'operations': operations}), content_type='application/json'
+        )
+
+    def lines(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list('food__name', 'quantity'))
+
+    def test_mixed_batch(self):
+        pizza_line = CartItem.objects.get(cart=self.cart, food=self.pizza)
+        response = self.post([
+            {'op': 'add', 'food_id': self.chips.pk, 'quantity': 2},
+            {'op': 'set', 'item_id': pizza_line.pk, 'quantity': 1},
+            {'op': 'remove', 'food_id': self.soda.pk},
+            {'op': 'add', 'food_id': self.chips.pk},
+        ])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.lines(), {'Pizza': 1, 'Chips': 3})
+
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.subtotal, self.cart.item_count), (Decimal('550.00'), 4))
+        state = response.json()['cart']
+        self.assertEqual((state['subtotal'], state['item_count']), ('550.00', 4))
+
+    def test_invalid_operations_reject_the_whole_batch(self):
+        self.chips.available = False
+        self.chips.save()
+        for bad in (
+            {'op': 'set', 'item_id': 999999, 'quantity': 1},
+            {'op': 'add', 'food_id': 'x'},
+            {'op': 'add', 'food_id': self.chips.pk},
+            {'op': 'set', 'food_id': self.pizza.pk, 'quantity': -1},
+            {'op': 'add', 'food_id': self.soda.pk, 'quantity': 0},
+            {'op': 'set', 'food_id': self.pizza.pk, 'quantity': 'lots'},
+            {'op': 'explode'},
+        ):
+            with self.subTest(operation=bad):
+                response = self.post([{'op': 'remove', 'food_id': self.soda.pk}, bad])
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(self.lines(), {'Pizza': 2, 'Soda': 1})
+        self.assertEqual(self.post([]).status_code, 400)
+
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.subtotal, self.cart.item_count), (Decimal('280.00'), 3))
+
+
+class FoodImageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name, MEDIA_URL='/media/')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def food_with_image(self, data, name='photo.png'):
+        return Food.objects.create(
+            name='Pizza', price=Decimal('500.00'), image=SimpleUploadedFile(name, data, content_type='image/png'),
+        )
+
+    def png(self, size):
+        buffer = BytesIO()
+        Image.new('RGBA', size, (200, 40, 40, 128)).save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def render(self, food, variant='card'):
+        template = Template('{% load food_images %}{% food_image food variant %}')
+        return template.render(Context({'food': food, 'variant': variant}))
+
+    def test_variants_are_cropped_to_their_box_without_upscaling(self):
+        food = self.food_with_image(self.png((800, 600)))
+        record = images.process_food_image(food.pk)
+
+        self.assertEqual(record['source'], food.image.name)
+        self.assertEqual(list(record['card']['webp']), ['320', '480', '640'])  # no 960 from an 800px photo
+        self.assertEqual(list(record['cart']['jpeg']), ['100', '200'])
+        for variant, image_format, width, height in (('card', 'webp', 480, 320), ('cart', 'jpeg', 200, 200)):
+            with default_storage.open(record[variant][image_format][str(width)]) as f:
+                variant_image = Image.open(f)
+                self.assertEqual(variant_image.size, (width, height))
+                self.assertEqual(variant_image.format, image_format.upper())
+
+        food.refresh_from_db()
+        self.assertFalse(images.needs_processing(food))
+        self.assertIsNone(images.process_food_image(food.pk))  # already done
+
+    def test_template_tag_serves_the_original_until_variants_exist(self):
+        food = self.food_with_image(self.png((800, 600)))
+        html = self.render(food)
+        self.assertNotIn('<picture', html)
+        self.assertIn(f'src="{food.image.url}"', html)
+
+        images.process_food_image(food.pk)
+        food.refresh_from_db()
+        html = self.render(food)
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn(' 480w', html)
+        self.assertNotIn(food.image.url, html)
+
+    def test_unreadable_uploads_keep_the_original(self):
+        food = self.food_with_image(b'not an image')
+        with self.assertLogs('foods.images', 'ERROR'):
+            record = images.process_food_image(food.pk)
+        self.assertIn('error', record)
+
+        food.refresh_from_db()
+        self.assertFalse(images.needs_processing(food))
+        self.assertIn(f'src="{food.image.url}"', self.render(food, 'cart'))
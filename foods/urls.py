@@ -13,9 +13,14 @@ urlpatterns = [
     # Legacy URL (redirects to appropriate page)
     path('home/', views.home, name='home'),
     path('products/', views.product_list, name='product_list'),
+
+    # Menu search and API (JSON)
+    path('search/', views.search_foods, name='search_foods'),
+    path('api/v1/menu/', views.menu_api, name='menu_api'),
     
     # Cart operations
     path('cart/', views.view_cart, name='view_cart'),
     path('add-to-cart/<int:food_id>/', views.add_to_cart, name='add_to_cart'),
     path('remove-from-cart/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('cart/batch/', views.update_cart_batch, name='update_cart_batch'),
 ]
\ No newline at end of file
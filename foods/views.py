@@ -3,8 +3,34 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
 from .models import Food, Cart, CartItem
+from . import catalog, images, search
+from . import cart as cart_service
+import base64
+import json
+
+
+MENU_PAGE_SIZE = 24
+MENU_MAX_PAGE_SIZE = 100
+
+# Fields the menu API can project; description is opt-in (it's the heavy one)
+MENU_API_FIELDS = ('id', 'name', 'description', 'price', 'category', 'image', 'available')
+MENU_API_DEFAULT_FIELDS = ('id', 'name', 'price', 'category', 'image')
+
+
+def encode_cursor(food_id):
+    return base64.urlsafe_b64encode(str(food_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the food id encoded in ``cursor``, or None if it is invalid"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        return None
 
 
 def landing_page(request):
@@ -15,27 +41,131 @@ def landing_page(request):
 @login_required
 def home(request):
     """Food ordering page - login required"""
-    foods = Food.objects.filter(available=True)
-    
-    # Search functionality
     search_query = request.GET.get('search', '')
-    if search_query:
-        foods = foods.filter(
-            Q(name__icontains=search_query) | 
-            Q(description__icontains=search_query)
-        )
-    
-    # Category filter
     category = request.GET.get('category', '')
-    if category:
-        foods = foods.filter(category__iexact=category)
-    
-    foods = foods.order_by('-id')
+
+    # Served from the versioned catalog cache; only a miss touches the DB
+    foods = catalog.get_menu(search_query, category)
+
+    # Browsing renders the first page only; the rest is fetched from the
+    # menu API as the user scrolls. Search results keep their ranking.
+    next_cursor = None
+    if not search_query and len(foods) > MENU_PAGE_SIZE:
+        foods = foods[:MENU_PAGE_SIZE]
+        next_cursor = encode_cursor(foods[-1].id)
     
     return render(request, 'foods/home.html', {
         'foods': foods,
         'search_query': search_query,
         'selected_category': category,
+        'next_cursor': next_cursor,
+        'page_size': MENU_PAGE_SIZE,
+    })
+
+
+@login_required
+def menu_api(request):
+    """
+    Versioned menu API: available foods newest first, keyset-paginated on id.
+    With ``search`` the results keep the search ranking instead.
+
+    Query params: cursor, limit, fields (comma separated), search, category.
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', MENU_PAGE_SIZE)), 1), MENU_MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+
+    requested = request.GET.get('fields')
+    if requested:
+        fields = [f.strip() for f in requested.split(',') if f.strip()]
+        unknown = sorted(set(fields) - set(MENU_API_FIELDS))
+        if unknown:
+            return JsonResponse({'error': f"Unknown fields: {', '.join(unknown)}"}, status=400)
+        if 'id' not in fields:
+            fields.insert(0, 'id')
+    else:
+        fields = list(MENU_API_DEFAULT_FIELDS)
+
+    foods = Food.objects.filter(available=True)
+    columns = (*fields, 'image_variants') if 'image' in fields else fields
+
+    last_id = None
+    cursor = request.GET.get('cursor')
+    if cursor:
+        last_id = decode_cursor(cursor)
+        if last_id is None:
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    search_query = request.GET.get('search', '').strip()
+    category = request.GET.get('category', '').strip()
+    if search_query:
+        # Searched results are paginated over the ranked ids, best first;
+        # the cursor is the last id of the previous page
+        ranked_ids = [food.id for food, score in search.search_foods(search_query, category)]
+        start = 0
+        if last_id is not None:
+            try:
+                start = ranked_ids.index(last_id) + 1
+            except ValueError:
+                return JsonResponse({'error': 'Invalid cursor'}, status=400)
+        # One extra id tells us whether there is another page
+        page_ids = ranked_ids[start:start + limit + 1]
+        by_id = {row['id']: row for row in foods.filter(id__in=page_ids).values(*columns)}
+        rows = [by_id[food_id] for food_id in page_ids if food_id in by_id]
+    else:
+        if last_id is not None:
+            foods = foods.filter(id__lt=last_id)
+        if category:
+            foods = foods.filter(category__iexact=category)
+        # One extra row tells us whether there is another page
+        rows = list(foods.order_by('-id').values(*columns)[:limit + 1])
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    for row in rows:
+        if 'price' in row:
+            row['price'] = str(row['price'])
+        if 'image' in row:
+            food = Food(image=row['image'], image_variants=row.pop('image_variants'))
+            row['image'] = food.image.url if food.image else None
+            # Resized WebP card images, once foods/images.py has made them
+            row['image_srcset'] = images.srcset(food, 'card')
+
+    return JsonResponse({
+        'version': 1,
+        'results': rows,
+        'next_cursor': encode_cursor(rows[-1]['id']) if has_more else None,
+    })
+
+
+@login_required
+def search_foods(request):
+    """Ranked, typo-tolerant menu search as JSON (for the search box)"""
+    query = request.GET.get('q', '').strip()
+    category = request.GET.get('category', '')
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+    except ValueError:
+        limit = 20
+
+    results = search.search_foods(query, category, limit=limit) if query else []
+
+    return JsonResponse({
+        'query': query,
+        'results': [
+            {
+                'id': food.id,
+                'name': food.name,
+                'category': food.category,
+                'price': str(food.price),
+                'image': food.image.url if food.image else None,
+                'image_srcset': images.srcset(food, 'card'),
+                'score': round(score, 4),
+            }
+            for food, score in results
+        ],
     })
 
 
@@ -57,21 +187,12 @@ def add_to_cart(request, food_id):
         return redirect('food_ordering')
     
     # Get or create ACTIVE cart for user
-    cart, created = Cart.objects.get_or_create(
-        user=request.user,
-        is_active=True
-    )
+    cart = cart_service.get_active_cart(request.user)
     
-    # Get or create cart item
-    cart_item, item_created = CartItem.objects.get_or_create(
-        cart=cart,
-        food=food,
-        defaults={'quantity': 1}
-    )
+    # Atomic upsert; the cart's stored totals are updated in the same transaction
+    item_created = cart_service.add_item(cart, food)
 
     if not item_created:
-        cart_item.quantity += 1
-        cart_item.save()
         messages.success(request, f'{food.name} quantity updated in cart!')
     else:
         messages.success(request, f'{food.name} added to cart!')
@@ -83,12 +204,14 @@ def add_to_cart(request, food_id):
 def update_cart_item(request, item_id):
     """Update cart item quantity"""
     if request.method == 'POST':
-        item = get_object_or_404(CartItem, id=item_id, cart__user=request.user, cart__is_active=True)
+        item = get_object_or_404(
+            CartItem.objects.select_related('food'),
+            id=item_id, cart__user=request.user, cart__is_active=True
+        )
         quantity = int(request.POST.get('quantity', 1))
         
         if quantity > 0:
-            item.quantity = quantity
-            item.save()
+            cart_service.set_quantity(item, quantity)
             messages.success(request, f'{item.food.name} quantity updated!')
         else:
             messages.error(request, 'Quantity must be at least 1.')
@@ -96,12 +219,33 @@ def update_cart_item(request, item_id):
     return redirect('view_cart')
 
 
+@login_required
+@require_POST
+def update_cart_batch(request):
+    """Apply several cart line changes in one request via AJAX"""
+    try:
+        data = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+
+    cart = cart_service.get_active_cart(request.user)
+    try:
+        cart_service.apply_batch(cart, data.get('operations') if isinstance(data, dict) else None)
+    except cart_service.BatchError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    return JsonResponse({'success': True, 'cart': cart_service.cart_state(cart)})
+
+
 @login_required
 def remove_from_cart(request, item_id):
     """Remove item from cart"""
-    item = get_object_or_404(CartItem, id=item_id, cart__user=request.user, cart__is_active=True)
+    item = get_object_or_404(
+        CartItem.objects.select_related('food'),
+        id=item_id, cart__user=request.user, cart__is_active=True
+    )
     food_name = item.food.name
-    item.delete()
+    cart_service.remove_item(item)
     messages.success(request, f'{food_name} removed from cart.')
     return redirect('view_cart')
 
@@ -112,20 +256,15 @@ def remove_from_cart(request, item_id):
 def view_cart(request):
     """Display cart with all items"""
     # Get or create ACTIVE cart
-    cart, created = Cart.objects.get_or_create(
-        user=request.user,
-        is_active=True
-    )
+    cart = cart_service.get_active_cart(request.user)
     
     # Get all items in the active cart
     cart_items = CartItem.objects.filter(cart=cart).select_related('food')
-    total_amount = sum(item.total_price() for item in cart_items)
     
     return render(request, 'foods/cart.html', {
         'cart': cart,
         'cart_items': cart_items,
-        # 🔑 CHANGE THIS LINE: Mismatch fixed
-        'total': total_amount 
+        'total': cart.subtotal,
     })
 
 
@@ -134,7 +273,7 @@ def clear_cart(request):
     """Clear all items from active cart"""
     try:
         cart = Cart.objects.get(user=request.user, is_active=True)
-        cart.items.all().delete()
+        cart_service.clear(cart)
         messages.success(request, 'Cart cleared successfully!')
     except Cart.DoesNotExist:
         messages.info(request, 'Cart is already empty.')
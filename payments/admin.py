@@ -1,9 +1,33 @@
 from django.contrib import admin
-from .models import MpesaPayment
+from .models import MpesaCallback, MpesaPayment, Order, OrderLine
 
 @admin.register(MpesaPayment)
 class MpesaPaymentAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'phone_number', 'amount', 'status', 'mpesa_receipt_number', 'created_at']
     list_filter = ['status', 'created_at']
     search_fields = ['phone_number', 'mpesa_receipt_number', 'user__username']
-    readonly_fields = ['created_at', 'updated_at']
\ No newline at end of file
+    readonly_fields = ['created_at', 'updated_at']
+
+
+@admin.register(MpesaCallback)
+class MpesaCallbackAdmin(admin.ModelAdmin):
+    list_display = ['id', 'checkout_request_id', 'received_at', 'processed_at', 'attempts']
+    list_filter = ['processed_at']
+    search_fields = ['checkout_request_id']
+    readonly_fields = ['received_at']
+
+
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    extra = 0
+    readonly_fields = ['food', 'name', 'unit_price', 'quantity', 'line_total']
+    can_delete = False
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'payment', 'total', 'item_count', 'created_at']
+    list_filter = ['created_at']
+    search_fields = ['user__username', 'payment__mpesa_receipt_number']
+    readonly_fields = ['payment', 'user', 'cart', 'total', 'item_count', 'created_at']
+    inlines = [OrderLineInline]
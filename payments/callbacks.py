@@ -0,0 +1,141 @@
+"""
+M-Pesa callback inbox processing.
+
+mpesa_callback stores each raw callback in MpesaCallback (unique on
+CheckoutRequestID, so redeliveries are dropped) and acknowledges straight
+away. process_pending() then applies the stored callbacks in arrival
+order. apply_stk_callback() is idempotent: a payment that already reached
+a final status is left alone. Entries that could not be applied yet are
+retried every RETRY_SECONDS while the process runs; the
+process_mpesa_callbacks command drains the inbox from a separate worker.
+"""
+import logging
+from datetime import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from foods.cart import refresh_badge
+from foods.models import Cart
+from pikaquick import background
+
+from . import orders
+from .models import MpesaCallback, MpesaPayment
+
+logger = logging.getLogger(__name__)
+
+FINAL_STATUSES = ('completed', 'failed', 'cancelled')
+MAX_ATTEMPTS = 5
+RETRY_SECONDS = 30
+
+
+def apply_stk_callback(stk_callback):
+    """
+    Apply a Daraja ``stkCallback`` body to its payment. Returns the payment,
+    or None if no payment matches the CheckoutRequestID (yet).
+    """
+    checkout_request_id = stk_callback.get('CheckoutRequestID')
+    result_code = stk_callback.get('ResultCode')
+    result_desc = stk_callback.get('ResultDesc', 'No description provided.')
+
+    with transaction.atomic():
+        payment = MpesaPayment.objects.select_for_update().filter(
+            checkout_request_id=checkout_request_id
+        ).first() if checkout_request_id else None
+        if payment is None:
+            return None
+        if payment.status in FINAL_STATUSES:
+            return payment  # already applied
+
+        payment.result_code = str(result_code)
+        payment.result_desc = result_desc
+
+        if str(result_code) == '0':
+            # Payment successful
+            callback_metadata = stk_callback.get('CallbackMetadata', {}).get('Item', [])
+
+            for item in callback_metadata:
+                if item.get('Name') == 'MpesaReceiptNumber':
+                    payment.mpesa_receipt_number = item.get('Value')
+                elif item.get('Name') == 'TransactionDate':
+                    # Safaricom format is YYYYMMDDHHmmss
+                    transaction_date = str(item.get('Value'))
+                    payment.transaction_date = timezone.make_aware(
+                        datetime.strptime(transaction_date, '%Y%m%d%H%M%S')
+                    )
+
+            payment.status = 'completed'
+
+            # Payments made before carts were linked fall back to the user's active cart
+            cart_id = payment.cart_id or Cart.objects.filter(
+                user_id=payment.user_id, is_active=True
+            ).values_list('id', flat=True).first()
+            if cart_id:
+                orders.create_order(payment, cart_id)
+                # Mark the cart as completed (inactive)
+                if Cart.objects.filter(id=cart_id, is_active=True).update(is_active=False, updated_at=timezone.now()):
+                    transaction.on_commit(lambda: refresh_badge(cart_id))
+                    logger.info(f"Cart {cart_id} marked as inactive after successful payment.")
+            else:
+                logger.warning(f"No active cart found for user {payment.user_id} during successful callback.")
+        else:
+            # Payment failed/cancelled
+            payment.status = 'failed'
+
+        payment.save()
+    return payment
+
+
+def process_pending(batch_size=100):
+    """Apply unprocessed inbox entries in arrival order; returns how many were handled."""
+    handled = last_id = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                MpesaCallback.objects.select_for_update(skip_locked=True)
+                .filter(processed_at__isnull=True, id__gt=last_id)
+                .order_by('id')[:batch_size]
+            )
+            if not batch:
+                break
+
+            now = timezone.now()
+            for entry in batch:
+                stk_callback = entry.payload.get('Body', {}).get('stkCallback', {})
+                try:
+                    with transaction.atomic():
+                        payment = apply_stk_callback(stk_callback)
+                except Exception as e:
+                    logger.exception(f"Error applying callback {entry.checkout_request_id}")
+                    payment, entry.error = None, str(e)
+                else:
+                    entry.error = '' if payment else 'No matching payment'
+
+                if payment is not None:
+                    entry.processed_at = now
+                else:
+                    entry.attempts += 1
+                    if entry.attempts >= MAX_ATTEMPTS:
+                        logger.error(f"Giving up on callback {entry.checkout_request_id}: {entry.error}")
+                        entry.processed_at = now
+
+            MpesaCallback.objects.bulk_update(batch, ['processed_at', 'attempts', 'error'])
+
+        handled += len(batch)
+        last_id = batch[-1].id
+        if len(batch) < batch_size:
+            break
+    return handled
+
+
+def _process_scheduled():
+    process_pending()
+    return MpesaCallback.objects.filter(processed_at__isnull=True).exists()
+
+
+_processing = background.CoalescedJob(_process_scheduled, retry_interval=RETRY_SECONDS)
+
+
+def schedule_processing():
+    """Process the inbox on the background executor (once per burst)."""
+    _processing.schedule()
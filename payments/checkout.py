@@ -0,0 +1,142 @@
+"""
+STK push dispatch.
+
+initiate_payment records an MpesaPayment in the ``queued`` state and hands
+it to send_stk_push, either on the background executor (MPESA_ASYNC_CHECKOUT)
+or inline. send_stk_push fetches the token, calls Daraja and moves the
+payment to ``pending`` (awaiting the customer's PIN) or ``failed``.
+
+The outcome is written under a row lock and only while the payment is
+still ``queued``: reconcile.fail_unsent may have failed it while the push
+was in flight, and that must not be overwritten.
+"""
+import base64
+import logging
+from datetime import datetime
+
+import requests
+from django.conf import settings
+from django.db import transaction
+
+from pikaquick import background
+
+from . import callbacks, daraja
+from .models import MpesaCallback, MpesaPayment
+
+logger = logging.getLogger(__name__)
+
+STK_POOL = 'stk_push'  # background pool of its own, see BACKGROUND_POOLS
+
+
+def _password():
+    """Return (password, timestamp) for an STK request."""
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    password = base64.b64encode(
+        f"{settings.MPESA_SHORTCODE}{settings.MPESA_PASSKEY}{timestamp}".encode()
+    ).decode('utf-8')
+    return password, timestamp
+
+
+def build_stk_payload(phone_number, amount, account_reference):
+    password, timestamp = _password()
+
+    return {
+        "BusinessShortCode": settings.MPESA_SHORTCODE,
+        "Password": password,
+        "Timestamp": timestamp,
+        "TransactionType": "CustomerPayBillOnline",
+        "Amount": amount,
+        "PartyA": phone_number,
+        "PartyB": settings.MPESA_SHORTCODE,
+        "PhoneNumber": phone_number,
+        "CallBackURL": settings.MPESA_CALLBACK_URL,
+        "AccountReference": account_reference,
+        "TransactionDesc": "Food Order Payment"
+    }
+
+
+def build_query_payload(checkout_request_id):
+    password, timestamp = _password()
+
+    return {
+        "BusinessShortCode": settings.MPESA_SHORTCODE,
+        "Password": password,
+        "Timestamp": timestamp,
+        "CheckoutRequestID": checkout_request_id,
+    }
+
+
+def _record(payment, **fields):
+    """
+    Save ``fields`` on a payment that is still queued. Returns False, and
+    reloads ``payment``, if it has moved on in the meantime.
+    """
+    with transaction.atomic():
+        if not MpesaPayment.objects.select_for_update().filter(id=payment.id, status='queued').exists():
+            payment.refresh_from_db()
+            return False
+        for name, value in fields.items():
+            setattr(payment, name, value)
+        payment.save(update_fields=[*fields, 'updated_at'])
+    return True
+
+
+def _fail(payment, message):
+    return _record(payment, status='failed', result_desc=message)
+
+
+def dispatch_on_commit(payment_id):
+    """Send the STK push on its own background pool once the transaction commits."""
+    transaction.on_commit(lambda: background.submit_to(STK_POOL, send_stk_push, payment_id))
+
+
+def send_stk_push(payment_id):
+    """Send the STK push for a queued payment and record the outcome."""
+    payment = MpesaPayment.objects.filter(id=payment_id, status='queued').first()
+    if payment is None:
+        return None
+
+    try:
+        access_token = daraja.access_tokens.get()
+    except Exception as e:
+        logger.error(f"Error getting access token: {str(e)}")
+        _fail(payment, 'Failed to authenticate with M-Pesa')
+        return payment
+
+    # CRITICAL: For M-Pesa Sandbox testing, the minimum amount is typically 1 KES
+    api_amount = max(int(payment.amount), 1)
+    payload = build_stk_payload(payment.phone_number, api_amount, f"PikaQuick-{payment.user_id}")
+
+    try:
+        response_data = daraja.get_client().stk_push(payload, access_token).json()
+    except requests.exceptions.RequestException as e:
+        logger.error(f"STK Push Request Error: {str(e)}")
+        _fail(payment, 'Failed to communicate with M-Pesa API.')
+        return payment
+    except ValueError as e:
+        logger.error(f"STK Push Internal Error: {str(e)}")
+        _fail(payment, 'Failed to initiate payment. Please try again.')
+        return payment
+
+    if response_data.get('ResponseCode') == '0':
+        if not _record(
+            payment,
+            merchant_request_id=response_data.get('MerchantRequestID'),
+            checkout_request_id=response_data.get('CheckoutRequestID'),
+            status='pending',
+        ):
+            logger.warning(
+                f"STK push {response_data.get('CheckoutRequestID')} was accepted for payment "
+                f"{payment.id} after it became {payment.status}; outcome not recorded"
+            )
+            return payment
+        # The callback can beat us to it when Daraja is quick; apply it now
+        if MpesaCallback.objects.filter(
+            checkout_request_id=payment.checkout_request_id, processed_at__isnull=True
+        ).exists():
+            callbacks.schedule_processing()
+    else:
+        error_message = response_data.get('errorMessage', response_data.get('ResponseDescription', 'Payment request failed'))
+        logger.error(f"STK Push failed for user {payment.user_id}: {error_message}")
+        _fail(payment, error_message)
+    return payment
@@ -0,0 +1,260 @@
+"""
+Safaricom Daraja API helpers.
+
+All calls go through one DarajaClient: a pooled keep-alive requests
+session with per-endpoint timeouts, bounded retries with backoff for
+idempotent calls, and per-endpoint latency counters.
+
+OAuth access tokens are valid for about an hour, so they are cached with
+their expiry and refreshed shortly before it. The cache alias is shared by
+all threads of a process, and by all processes when it points at a shared
+backend (Redis/Memcached). Concurrent refreshes are coalesced into a
+single outbound request: a thread lock inside the process and a cache
+``add()`` lock across processes.
+"""
+import logging
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from requests.adapters import HTTPAdapter
+
+from pikaquick import metrics
+
+logger = logging.getLogger(__name__)
+
+TOKEN_CACHE_KEY = 'mpesa:access_token'
+TOKEN_LOCK_KEY = 'mpesa:access_token:refreshing'
+
+
+def base_url():
+    """Daraja base URL for the configured MPESA_ENVIRONMENT."""
+    environment = getattr(settings, 'MPESA_ENVIRONMENT', 'sandbox')
+    if environment == 'production':
+        return settings.MPESA_PRODUCTION_BASE_URL
+    if environment == 'simulator':
+        return settings.MPESA_SIMULATOR_BASE_URL
+    return settings.MPESA_SANDBOX_BASE_URL
+
+
+# (connect, read) timeouts in seconds, overridable with MPESA_HTTP_TIMEOUTS
+DEFAULT_TIMEOUTS = {
+    'oauth': (3.05, 10),
+    'stk_push': (3.05, 30),
+    'stk_query': (3.05, 15),
+}
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Daraja answers STK queries for a push the customer hasn't acted on yet
+# with HTTP 500 and this error code instead of a result
+STILL_PROCESSING = '500.001.1001'
+
+
+def is_still_processing(response):
+    """True if ``response`` is Daraja's "request is being processed" answer."""
+    try:
+        return response.json().get('errorCode') == STILL_PROCESSING
+    except (ValueError, AttributeError):
+        return False
+
+
+class DarajaClient:
+    """Shared HTTP client for the Daraja API."""
+
+    def __init__(self, base_url=None, timeouts=None, retries=2, backoff=0.25, pool_size=10):
+        self._base_url = base_url
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.retries = retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return self._base_url or base_url()
+
+    def _record(self, endpoint, elapsed, error=False):
+        metrics.record_daraja(elapsed)
+        with self._stats_lock:
+            stats = self._stats.setdefault(
+                endpoint, {'requests': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0}
+            )
+            stats['requests'] += 1
+            stats['errors'] += int(error)
+            stats['total_seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+
+    def metrics(self):
+        """Per-endpoint request/error counts and latency, for monitoring."""
+        with self._stats_lock:
+            return {
+                endpoint: {
+                    **stats,
+                    'avg_seconds': stats['total_seconds'] / stats['requests'] if stats['requests'] else 0.0,
+                }
+                for endpoint, stats in self._stats.items()
+            }
+
+    def request(self, endpoint, method, path, idempotent=False, final=None, **kwargs):
+        """
+        Send a request to ``path`` on the Daraja host. Idempotent calls are
+        retried on connection errors and 429/5xx responses with exponential
+        backoff, unless ``final(response)`` says the response is an answer;
+        others are sent exactly once.
+        """
+        kwargs.setdefault('timeout', self.timeouts.get(endpoint, DEFAULT_TIMEOUTS['stk_push']))
+        url = f"{self.base_url}{path}"
+        attempts = self.retries + 1 if idempotent else 1
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._record(endpoint, time.perf_counter() - started, error=True)
+                if last_attempt:
+                    raise
+            else:
+                failed = response.status_code >= 500
+                self._record(endpoint, time.perf_counter() - started, error=failed)
+                if (last_attempt or response.status_code not in RETRY_STATUSES
+                        or (final is not None and final(response))):
+                    return response
+
+            delay = self.backoff * (2 ** attempt)
+            logger.warning(f"Daraja {endpoint} attempt {attempt + 1} failed, retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+    def fetch_access_token(self):
+        """Request a new OAuth token; returns (token, expires_in_seconds)."""
+        response = self.request(
+            'oauth', 'GET', '/oauth/v1/generate',
+            params={'grant_type': 'client_credentials'},
+            auth=(settings.MPESA_CONSUMER_KEY, settings.MPESA_CONSUMER_SECRET),
+            idempotent=True,
+        )
+        response.raise_for_status()
+        data = response.json()
+        return data['access_token'], int(data.get('expires_in', 3599))
+
+    def stk_push(self, payload, access_token):
+        """Send an STK push request; not retried, as a retry could charge twice."""
+        response = self.request(
+            'stk_push', 'POST', '/mpesa/stkpush/v1/processrequest',
+            json=payload,
+            headers={'Authorization': f'Bearer {access_token}'},
+        )
+        if response.status_code == 401:
+            # Token revoked or expired early; fetch a new one next time
+            access_tokens.invalidate()
+        return response
+
+    def stk_query(self, payload, access_token):
+        """
+        Query the status of an STK push; safe to retry, except that a
+        push still awaiting the customer is an answer, not a failure.
+        """
+        response = self.request(
+            'stk_query', 'POST', '/mpesa/stkpushquery/v1/query',
+            json=payload,
+            headers={'Authorization': f'Bearer {access_token}'},
+            idempotent=True,
+            final=is_still_processing,
+        )
+        if response.status_code == 401:
+            access_tokens.invalidate()
+        return response
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide DarajaClient."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = DarajaClient(timeouts=getattr(settings, 'MPESA_HTTP_TIMEOUTS', None))
+    return _client
+
+
+def fetch_access_token():
+    return get_client().fetch_access_token()
+
+
+class AccessTokenCache:
+    """Expiry-aware, single-flight cache for the Daraja OAuth token."""
+
+    def __init__(self, fetch=fetch_access_token, refresh_margin=300, lock_timeout=15):
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin  # seconds before expiry to refresh
+        self.lock_timeout = lock_timeout
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'MPESA_TOKEN_CACHE_ALIAS', 'default')]
+
+    def _fresh(self, entry, now):
+        return entry is not None and entry['expires_at'] - self.refresh_margin > now
+
+    def get(self):
+        """Return a valid access token, refreshing it if it is near expiry."""
+        entry = self.cache.get(TOKEN_CACHE_KEY)
+        if self._fresh(entry, time.time()):
+            return entry['token']
+
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            entry = self.cache.get(TOKEN_CACHE_KEY)
+            if self._fresh(entry, time.time()):
+                return entry['token']
+            return self._refresh(entry)
+
+    def _refresh(self, entry):
+        if self.cache.add(TOKEN_LOCK_KEY, 1, timeout=self.lock_timeout):
+            try:
+                token, expires_in = self.fetch()
+                self.cache.set(
+                    TOKEN_CACHE_KEY,
+                    {'token': token, 'expires_at': time.time() + expires_in},
+                    timeout=expires_in,
+                )
+                return token
+            finally:
+                self.cache.delete(TOKEN_LOCK_KEY)
+
+        # Another process is refreshing. The old token is still usable until
+        # it actually expires; otherwise wait for the new one to land.
+        if entry is not None and entry['expires_at'] > time.time():
+            return entry['token']
+
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = self.cache.get(TOKEN_CACHE_KEY)
+            if entry is not None and entry['expires_at'] > time.time():
+                return entry['token']
+            if self.cache.get(TOKEN_LOCK_KEY) is None:
+                break
+        return self._refresh(None)
+
+    def invalidate(self):
+        """Drop the cached token, e.g. after Daraja rejected it."""
+        self.cache.delete(TOKEN_CACHE_KEY)
+
+
+access_tokens = AccessTokenCache(
+    refresh_margin=getattr(settings, 'MPESA_TOKEN_REFRESH_MARGIN', 300),
+)
@@ -0,0 +1,47 @@
+"""
+Payment status notifications for server-sent events.
+
+Open SSE connections wait on an asyncio.Event per payment. Whenever an
+MpesaPayment is saved (the callback, the STK push worker, reconciliation)
+the hub wakes the waiters for that payment from whatever thread the save
+ran in. Waiters also re-read the payment every few seconds, which covers
+updates made by another process.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+
+class PaymentEventHub:
+    def __init__(self):
+        self._waiters = defaultdict(set)  # payment_id -> {(loop, event)}
+        self._lock = threading.Lock()
+
+    def subscribe(self, payment_id):
+        """Return an asyncio.Event that is set on the next change to the payment."""
+        event = asyncio.Event()
+        with self._lock:
+            self._waiters[payment_id].add((asyncio.get_running_loop(), event))
+        return event
+
+    def unsubscribe(self, payment_id, event):
+        with self._lock:
+            waiters = self._waiters.get(payment_id)
+            if waiters is None:
+                return
+            waiters.difference_update({w for w in waiters if w[1] is event})
+            if not waiters:
+                del self._waiters[payment_id]
+
+    def publish(self, payment_id):
+        """Wake everyone waiting on ``payment_id``; safe to call from any thread."""
+        with self._lock:
+            waiters = list(self._waiters.get(payment_id, ()))
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # the connection's loop has already shut down
+
+
+hub = PaymentEventHub()
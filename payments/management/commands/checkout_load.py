@@ -0,0 +1,175 @@
+"""
+End-to-end checkout load test against the local Daraja simulator.
+
+Runs N simulated customers concurrently through add-to-cart, checkout
+(initiate_payment) and status polling until the simulator's callback has
+settled their payment, then reports throughput and p50/p95/p99 latency
+per stage. Requests go through the Django test client in this process;
+Daraja calls go over HTTP to a DarajaSimulator started for the run, whose
+callbacks are posted back to mpesa_callback.
+
+Creates ``loadtest-<n>`` users and real payments: run it against a
+development database only. ``--budget stage=seconds`` turns it into a
+regression gate that fails when a stage's p95 exceeds the budget.
+"""
+import math
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from foods.models import Food
+from payments import daraja
+from payments.simulator import DarajaSimulator
+
+STAGES = ('add_to_cart', 'checkout', 'status_check', 'settle')
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(sorted_values)) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+
+def _deliver_callback(url, body):
+    # Simulator callbacks come from its timer threads; each gets a fresh
+    # client and closes the connection it opened
+    try:
+        Client().post(reverse('payments:mpesa_callback'), body, content_type='application/json')
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Run simulated customers through checkout against the Daraja simulator and report latencies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=20)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--min-delay', type=float, default=0.5, help='Simulator callback delay (min seconds)')
+        parser.add_argument('--max-delay', type=float, default=2.0, help='Simulator callback delay (max seconds)')
+        parser.add_argument('--failure-rate', type=float, default=0.1)
+        parser.add_argument('--poll-interval', type=float, default=0.25)
+        parser.add_argument('--timeout', type=float, default=30.0, help='Give up on a payment after this many seconds')
+        parser.add_argument('--budget', action='append', default=[], metavar='STAGE=SECONDS',
+                            help=f'Fail if the p95 of a stage exceeds SECONDS; stages: {", ".join(STAGES)}')
+
+    def handle(self, *args, **options):
+        budgets = self._parse_budgets(options['budget'])
+        food = Food.objects.filter(available=True, price__gt=0).order_by('id').first()
+        if food is None:
+            raise CommandError('Need at least one available food with a price to order.')
+
+        users = []
+        for i in range(options['customers']):
+            user, created = User.objects.get_or_create(username=f'loadtest-{i}')
+            if created:
+                user.set_unusable_password()
+                user.save(update_fields=['password'])
+            users.append(user)
+
+        simulator = DarajaSimulator(
+            callback_delay=(options['min_delay'], options['max_delay']),
+            failure_rate=options['failure_rate'],
+            deliver=_deliver_callback,
+        )
+        overrides = override_settings(
+            MPESA_ENVIRONMENT='simulator',
+            MPESA_SIMULATOR_BASE_URL=simulator.url,
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+        )
+
+        timings = defaultdict(list)
+        outcomes = Counter()
+        with simulator, overrides:
+            daraja.access_tokens.invalidate()
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                for customer_timings, outcome in pool.map(
+                    lambda user: self._run_customer(user, food, options), users
+                ):
+                    for stage, values in customer_timings.items():
+                        timings[stage].extend(values)
+                    outcomes[outcome] += 1
+            elapsed = time.perf_counter() - started
+            daraja.access_tokens.invalidate()
+
+        self._report(timings, outcomes, elapsed)
+        self._check_budgets(timings, budgets)
+
+    def _run_customer(self, user, food, options):
+        timings = defaultdict(list)
+        client = Client()
+        client.force_login(user)
+        try:
+            t0 = time.perf_counter()
+            response = client.post(reverse('add_to_cart', args=[food.id]))
+            timings['add_to_cart'].append(time.perf_counter() - t0)
+            if response.status_code != 302:
+                return timings, f'add_to_cart HTTP {response.status_code}'
+
+            checkout_started = time.perf_counter()
+            response = client.post(reverse('payments:initiate_payment'), {'phone_number': '0700000000'})
+            timings['checkout'].append(time.perf_counter() - checkout_started)
+            if response.status_code != 200:
+                return timings, f'checkout HTTP {response.status_code}'
+            status_url = reverse('payments:check_status', args=[response.json()['payment_id']])
+
+            deadline = checkout_started + options['timeout']
+            while time.perf_counter() < deadline:
+                t0 = time.perf_counter()
+                data = client.get(status_url).json()
+                timings['status_check'].append(time.perf_counter() - t0)
+                if data.get('should_refresh'):
+                    timings['settle'].append(time.perf_counter() - checkout_started)
+                    return timings, data['status']
+                time.sleep(options['poll_interval'])
+            return timings, 'timed out'
+        finally:
+            connections.close_all()
+
+    def _report(self, timings, outcomes, elapsed):
+        total = sum(outcomes.values())
+        self.stdout.write(f'{total} customers in {elapsed:.2f}s ({total / elapsed:.2f} checkouts/s)')
+        self.stdout.write('Outcomes: ' + ', '.join(f'{name}={count}' for name, count in sorted(outcomes.items())))
+        self.stdout.write(f'{"stage":<14}{"count":>7}{"req/s":>9}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"max ms":>10}')
+        for stage in STAGES:
+            values = sorted(timings.get(stage, ()))
+            if not values:
+                continue
+            self.stdout.write(
+                f'{stage:<14}{len(values):>7}{len(values) / elapsed:>9.1f}'
+                + ''.join(f'{percentile(values, pct) * 1000:>10.1f}' for pct in (50, 95, 99))
+                + f'{values[-1] * 1000:>10.1f}'
+            )
+
+    def _parse_budgets(self, raw_budgets):
+        budgets = {}
+        for raw in raw_budgets:
+            stage, _, seconds = raw.partition('=')
+            if stage not in STAGES:
+                raise CommandError(f'Unknown stage "{stage}" in --budget.')
+            try:
+                budgets[stage] = float(seconds)
+            except ValueError:
+                raise CommandError(f'Invalid budget "{raw}", expected STAGE=SECONDS.')
+        return budgets
+
+    def _check_budgets(self, timings, budgets):
+        over = []
+        for stage, budget in budgets.items():
+            p95 = percentile(sorted(timings.get(stage, ())), 95)
+            if p95 > budget:
+                over.append(f'{stage} p95 {p95 * 1000:.1f}ms > {budget * 1000:.1f}ms')
+        if over:
+            raise CommandError('Over budget: ' + '; '.join(over))
+        if budgets:
+            self.stdout.write(self.style.SUCCESS('All stages within budget.'))
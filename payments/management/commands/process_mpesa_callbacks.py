@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments.callbacks import process_pending
+
+
+class Command(BaseCommand):
+    help = 'Apply stored M-Pesa callbacks from the inbox (once, or continuously with --loop)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help='Keep polling the inbox')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            handled = process_pending(batch_size=options['batch_size'])
+            if handled:
+                self.stdout.write(f'Processed {handled} callbacks.')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
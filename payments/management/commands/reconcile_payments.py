@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments.daraja import DarajaClient
+from payments.reconcile import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Settle queued and pending payments whose callback never arrived using the STK Query API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=120,
+                            help='Only payments open for at least this many seconds')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent STK queries')
+        parser.add_argument('--base-url', help='Query this Daraja host instead, e.g. a local simulator')
+        parser.add_argument('--loop', action='store_true', help='Keep reconciling')
+        parser.add_argument('--interval', type=float, default=60.0, help='Seconds between runs with --loop')
+
+    def handle(self, *args, **options):
+        client = DarajaClient(base_url=options['base_url']) if options['base_url'] else None
+
+        while True:
+            checked, settled = reconcile(
+                older_than=options['older_than'],
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+                client=client,
+            )
+            if checked or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Checked {checked} open payments, settled {settled}.'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
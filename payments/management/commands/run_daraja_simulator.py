@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from payments.simulator import DarajaSimulator
+
+
+class Command(BaseCommand):
+    help = "Serve a local Daraja stand-in (set MPESA_ENVIRONMENT = 'simulator' to use it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8010)
+        parser.add_argument('--min-delay', type=float, default=1.0, help='Seconds before a push is settled (min)')
+        parser.add_argument('--max-delay', type=float, default=3.0, help='Seconds before a push is settled (max)')
+        parser.add_argument('--failure-rate', type=float, default=0.1, help='Share of pushes the customer cancels')
+        parser.add_argument('--drop-rate', type=float, default=0.0, help='Share of callbacks never delivered')
+        parser.add_argument('--callback-url', help='Deliver callbacks here instead of the CallBackURL of the push')
+
+    def handle(self, *args, **options):
+        simulator = DarajaSimulator(
+            host=options['host'],
+            port=options['port'],
+            callback_delay=(options['min_delay'], options['max_delay']),
+            failure_rate=options['failure_rate'],
+            drop_rate=options['drop_rate'],
+            callback_url=options['callback_url'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Daraja simulator listening on {simulator.url}'))
+        try:
+            simulator.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            simulator.server.server_close()
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-16 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_mpesapayment_delete_paymentlog'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mpesapayment',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='pending', max_length=20),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-16 20:55
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_categories(apps, schema_editor):
+    """Fill in the category of lines written before it was snapshotted."""
+    Food = apps.get_model('foods', 'Food')
+    OrderLine = apps.get_model('payments', 'OrderLine')
+    OrderLine.objects.filter(food__isnull=False).update(
+        category=Subquery(Food.objects.filter(pk=OuterRef('food_id')).values('category')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_order_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderline',
+            name='category',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.RunPython(copy_categories, migrations.RunPython.noop),
+    ]
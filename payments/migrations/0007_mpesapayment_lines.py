@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-16 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0006_orderline_category'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mpesapayment',
+            name='lines',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
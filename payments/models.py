@@ -5,15 +5,21 @@ from datetime import datetime
 
 class MpesaPayment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # The cart being paid for; its items become the Order on completion
+    cart = models.ForeignKey('foods.Cart', on_delete=models.SET_NULL, null=True, blank=True, related_name='payments')
     phone_number = models.CharField(max_length=15)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # The cart's lines as priced when the payment was initiated; the Order
+    # is written from these, so it matches what M-Pesa was asked to charge
+    lines = models.JSONField(default=list, blank=True)
     merchant_request_id = models.CharField(max_length=100, blank=True)
-    checkout_request_id = models.CharField(max_length=100, blank=True)
+    checkout_request_id = models.CharField(max_length=100, blank=True, db_index=True)
     result_code = models.CharField(max_length=10, blank=True)
     result_desc = models.TextField(blank=True)
     mpesa_receipt_number = models.CharField(max_length=100, blank=True)
     transaction_date = models.DateTimeField(null=True, blank=True)
     status = models.CharField(max_length=20, default='pending', choices=[
+        ('queued', 'Queued'),  # recorded, STK push not sent yet
         ('pending', 'Pending'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
@@ -26,4 +32,63 @@ class MpesaPayment(models.Model):
         return f"Payment {self.id} - {self.phone_number} - KES {self.amount}"
 
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+
+
+class MpesaCallback(models.Model):
+    """
+    Inbox of raw STK callbacks from Daraja. mpesa_callback only appends here
+    and acknowledges; payments.callbacks applies the entries in order.
+    """
+    checkout_request_id = models.CharField(max_length=100, unique=True)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"Callback {self.checkout_request_id} - {'processed' if self.processed_at else 'pending'}"
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['processed_at', 'id'], name='mpesacallback_pending_idx'),
+        ]
+
+
+class Order(models.Model):
+    """
+    What was bought with a completed payment. Written once, when the
+    payment completes, from the lines the payment snapshotted at checkout,
+    so receipts and reports never depend on the live Food rows.
+    """
+    payment = models.OneToOneField(MpesaPayment, on_delete=models.PROTECT, related_name='order')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='orders')
+    cart = models.ForeignKey('foods.Cart', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    total = models.DecimalField(max_digits=10, decimal_places=2)
+    item_count = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Order {self.id} - KES {self.total}"
+
+    class Meta:
+        ordering = ['-created_at']
+
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, related_name='lines', on_delete=models.CASCADE)
+    # Kept for reporting only; name and price below are the record
+    food = models.ForeignKey('foods.Food', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    name = models.CharField(max_length=200)
+    category = models.CharField(max_length=100, blank=True)
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+    line_total = models.DecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.quantity}x {self.name}"
+
+    class Meta:
+        ordering = ['id']
@@ -0,0 +1,100 @@
+"""
+Order snapshots.
+
+When a payment is initiated, the lines of the cart are priced and stored
+on the payment (MpesaPayment.lines), and the amount charged is their
+total. When it completes, those lines become an Order with its
+OrderLines (name, unit price, quantity and totals) in one insert for the
+order and one bulk insert for the lines, so a price or cart change while
+the STK push is pending can't make the order disagree with the charge.
+The confirmation page and reports read the order and never touch Food
+again, and the order is added to the sales rollups
+(dashboard/analytics.py).
+"""
+import logging
+from decimal import Decimal
+
+from dashboard import analytics
+from foods.models import CartItem, Food
+
+from .models import Order, OrderLine
+
+logger = logging.getLogger(__name__)
+
+
+def cart_lines(cart_id):
+    """Unsaved OrderLines for the current contents of a cart, in one query."""
+    rows = CartItem.objects.filter(cart_id=cart_id).order_by('created_at', 'id').values_list(
+        'food_id', 'food__name', 'food__category', 'food__price', 'quantity'
+    )
+    return [
+        OrderLine(
+            food_id=food_id, name=name, category=category,
+            unit_price=price, quantity=quantity, line_total=price * quantity,
+        )
+        for food_id, name, category, price, quantity in rows
+    ]
+
+
+def lines_total(lines):
+    return sum((line.line_total for line in lines), Decimal('0.00'))
+
+
+def snapshot_lines(lines):
+    """JSON-ready form of unsaved OrderLines, for MpesaPayment.lines."""
+    return [
+        {
+            'food_id': line.food_id,
+            'name': line.name,
+            'category': line.category,
+            'unit_price': str(line.unit_price),
+            'quantity': line.quantity,
+        }
+        for line in lines
+    ]
+
+
+def payment_lines(payment, cart_id=None):
+    """
+    Unsaved OrderLines for what ``payment`` was initiated for. Payments
+    recorded before lines were snapshotted fall back to the cart's
+    current contents.
+    """
+    if not payment.lines:
+        cart_id = cart_id or payment.cart_id
+        return cart_lines(cart_id) if cart_id else []
+    lines = []
+    for line in payment.lines:
+        unit_price = Decimal(line['unit_price'])
+        lines.append(OrderLine(
+            food_id=line['food_id'], name=line['name'], category=line['category'],
+            unit_price=unit_price, quantity=line['quantity'], line_total=unit_price * line['quantity'],
+        ))
+    return lines
+
+
+def create_order(payment, cart_id):
+    """Write the Order of a completed payment from the lines it was initiated for."""
+    lines = payment_lines(payment, cart_id)
+    total = lines_total(lines)
+    if int(total) != int(payment.amount):
+        # M-Pesa charges whole shillings, so only cents may differ
+        logger.error(f"Order for payment {payment.pk} totals {total}, but {payment.amount} was charged")
+    order = Order.objects.create(
+        payment=payment,
+        user_id=payment.user_id,
+        cart_id=cart_id,
+        total=total,
+        item_count=sum(line.quantity for line in lines),
+    )
+    # A food deleted since the payment was initiated keeps its line (the
+    # snapshot has its name and price), just without the link to the menu
+    food_ids = {line.food_id for line in lines if line.food_id}
+    on_menu = set(Food.objects.filter(id__in=food_ids).values_list('id', flat=True)) if food_ids else set()
+    for line in lines:
+        line.order = order
+        if line.food_id not in on_menu:
+            line.food_id = None
+    OrderLine.objects.bulk_create(lines)
+    analytics.record_order(order, lines)
+    return order
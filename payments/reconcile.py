@@ -0,0 +1,120 @@
+"""
+Reconciliation of payments whose callback never arrived.
+
+Daraja callbacks get lost (an unreachable MPESA_CALLBACK_URL, a tunnel
+that was down), which leaves the payment ``pending`` and the cart active
+forever. reconcile() walks the open (queued or pending) payments that
+have been waiting longer than a threshold in id order, asks the STK Query
+API for each one with a CheckoutRequestID on a bounded thread pool, and
+applies every final answer through callbacks.apply_stk_callback(), the
+same code path as a real callback. Queued payments without one never got
+their STK push sent (the process stopped first) and are marked failed.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.db import transaction
+from django.utils import timezone
+
+from . import callbacks, checkout, daraja
+from .models import MpesaPayment
+
+logger = logging.getLogger(__name__)
+
+OPEN_STATUSES = ('queued', 'pending')
+
+
+def query_payment(client, access_token, checkout_request_id):
+    """
+    Ask Daraja for the outcome of an STK push. Returns a ``stkCallback``-shaped
+    dict, or None while the push is still in progress or the query failed.
+    """
+    try:
+        response = client.stk_query(checkout.build_query_payload(checkout_request_id), access_token)
+        data = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.warning(f"STK query for {checkout_request_id} failed: {e}")
+        return None
+
+    if data.get('errorCode') == daraja.STILL_PROCESSING:
+        return None
+    if data.get('ResponseCode') != '0' or data.get('ResultCode') is None:
+        logger.warning(f"STK query for {checkout_request_id} rejected: {data}")
+        return None
+
+    return {
+        'MerchantRequestID': data.get('MerchantRequestID'),
+        'CheckoutRequestID': checkout_request_id,
+        'ResultCode': data['ResultCode'],
+        'ResultDesc': data.get('ResultDesc', 'No description provided.'),
+    }
+
+
+def fail_unsent(cutoff):
+    """Fail queued payments last updated before ``cutoff`` whose STK push was never sent."""
+    failed = 0
+    stuck = MpesaPayment.objects.filter(status='queued', updated_at__lt=cutoff, checkout_request_id='')
+    for payment_id in stuck.values_list('id', flat=True):
+        with transaction.atomic():
+            payment = stuck.select_for_update().filter(id=payment_id).first()
+            if payment is None:
+                continue  # sent or settled in the meantime
+            checkout._fail(payment, 'The payment request was not sent. Please try again.')
+            failed += 1
+            logger.info(f"Failed payment {payment_id}: STK push never sent")
+    return failed
+
+
+def reconcile(older_than=120, batch_size=50, workers=4, client=None):
+    """
+    Query and settle open payments last updated more than ``older_than``
+    seconds ago, ``batch_size`` at a time with at most ``workers`` queries in
+    flight, and fail the queued ones that were never sent. ``client``
+    defaults to the shared DarajaClient. Returns (checked, settled).
+    """
+    if client is None:
+        client, get_token = daraja.get_client(), daraja.access_tokens.get
+    else:
+        # A stand-in client (e.g. a local simulator) gets its own tokens,
+        # kept out of the shared token cache
+        get_token = lambda: client.fetch_access_token()[0]  # noqa: E731
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    unsent = fail_unsent(cutoff)
+    pending = MpesaPayment.objects.filter(
+        status__in=OPEN_STATUSES, updated_at__lt=cutoff, checkout_request_id__isnull=False
+    ).exclude(checkout_request_id='').order_by('id')
+
+    checked = settled = unsent
+    last_id = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pikaquick-reconcile') as pool:
+        while True:
+            batch = list(pending.filter(id__gt=last_id).values_list('id', 'checkout_request_id')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+
+            try:
+                access_token = get_token()
+            except Exception as e:
+                logger.error(f"Error getting access token for reconciliation: {e}")
+                break
+
+            # Only the HTTP calls run on the pool; results are applied here,
+            # on this thread's connection, in id order
+            results = pool.map(
+                lambda row: query_payment(client, access_token, row[1]), batch
+            )
+            for (payment_id, checkout_request_id), stk_callback in zip(batch, results):
+                checked += 1
+                if stk_callback is None:
+                    continue
+                payment = callbacks.apply_stk_callback(stk_callback)
+                if payment is not None:
+                    settled += 1
+                    logger.info(f"Reconciled payment {payment_id} ({checkout_request_id}): {payment.status}")
+
+            if len(batch) < batch_size:
+                break
+    return checked, settled
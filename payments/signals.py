@@ -0,0 +1,26 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import status_cache
+from .events import hub
+from .models import MpesaPayment
+
+
+@receiver(post_save, sender=MpesaPayment)
+def payment_saved(sender, instance, **kwargs):
+    """
+    Once the change is visible, write the new status through to the status
+    cache and wake any open status streams for this payment.
+    """
+    def publish():
+        status_cache.store(instance)
+        hub.publish(instance.pk)
+
+    transaction.on_commit(publish)
+
+
+@receiver(post_delete, sender=MpesaPayment)
+def payment_deleted(sender, instance, **kwargs):
+    payment_id = instance.pk
+    transaction.on_commit(lambda: status_cache.invalidate(payment_id))
@@ -0,0 +1,206 @@
+"""
+Local stand-in for the Daraja API.
+
+Serves the endpoints the payments app uses (OAuth, STK push, STK query)
+over HTTP and plays the customer's part: a while after each push it
+completes or fails the payment and delivers the callback, the way
+Safaricom does. The delay, failure rate and share of callbacks that get
+"lost" are configurable, so checkout, the callback inbox and
+reconciliation can be exercised and measured without the sandbox.
+
+Point the app at it with MPESA_ENVIRONMENT = 'simulator' and
+MPESA_SIMULATOR_BASE_URL, or run ``manage.py run_daraja_simulator``.
+"""
+import json
+import logging
+import random
+import threading
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from .daraja import STILL_PROCESSING
+
+logger = logging.getLogger(__name__)
+
+RESULT_SUCCESS = (0, 'The service request is processed successfully.')
+RESULT_CANCELLED = (1032, 'Request cancelled by user')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'DarajaSimulator/1.0'
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        if self.headers.get('Authorization') == f'Bearer {self.server.simulator.token}':
+            return True
+        self._send(401, {'errorCode': '404.001.03', 'errorMessage': 'Invalid Access Token'})
+        return False
+
+    def do_GET(self):
+        if self.path.startswith('/oauth/v1/generate'):
+            with self.server.simulator._lock:
+                self.server.simulator.oauth_requests += 1
+            self._send(200, {'access_token': self.server.simulator.token, 'expires_in': '3599'})
+        else:
+            self._send(404, {'errorMessage': 'Not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send(400, {'errorMessage': 'Bad Request - Invalid JSON'})
+            return
+
+        if not self._authorized():
+            return
+        simulator = self.server.simulator
+        if self.path == '/mpesa/stkpush/v1/processrequest':
+            self._send(200, simulator.stk_push(payload))
+        elif self.path == '/mpesa/stkpushquery/v1/query':
+            self._send(*simulator.stk_query(payload))
+        else:
+            self._send(404, {'errorMessage': 'Not found'})
+
+
+class DarajaSimulator:
+    """
+    ``callback_delay`` is the (min, max) seconds before a push is settled,
+    ``failure_rate`` the share of pushes the customer cancels and
+    ``drop_rate`` the share of callbacks that are never delivered (they
+    can still be found with an STK query). ``callback_url`` overrides the
+    CallBackURL sent with the push; ``deliver`` replaces the HTTP delivery
+    altogether with a ``deliver(url, body)`` callable.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, callback_delay=(1.0, 3.0), failure_rate=0.1,
+                 drop_rate=0.0, callback_url=None, deliver=None, seed=None):
+        self.callback_delay = callback_delay
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.callback_url = callback_url
+        self.deliver = deliver or self._post_callback
+        self.token = uuid.uuid4().hex
+        self.oauth_requests = 0  # token requests served, for tests
+        self._random = random.Random(seed)
+        self._results = {}  # checkout_request_id -> (result_code, result_desc) once settled
+        self._timers = set()
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.simulator = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Serve on a background thread; returns self."""
+        self._thread = threading.Thread(target=self.server.serve_forever, name='daraja-simulator', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        with self._lock:
+            timers, self._timers = self._timers, set()
+        for timer in timers:
+            timer.cancel()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stk_push(self, payload):
+        merchant_request_id = f'sim-{uuid.uuid4().hex[:12]}'
+        checkout_request_id = f'ws_CO_SIM_{uuid.uuid4().hex}'
+        with self._lock:
+            delay = self._random.uniform(*self.callback_delay)
+            failed = self._random.random() < self.failure_rate
+            dropped = self._random.random() < self.drop_rate
+            timer = threading.Timer(delay, self._settle, args=(
+                payload, merchant_request_id, checkout_request_id, failed, dropped,
+            ))
+            timer.daemon = True
+            self._timers.add(timer)
+        timer.start()
+
+        return {
+            'MerchantRequestID': merchant_request_id,
+            'CheckoutRequestID': checkout_request_id,
+            'ResponseCode': '0',
+            'ResponseDescription': 'Success. Request accepted for processing',
+            'CustomerMessage': 'Success. Request accepted for processing',
+        }
+
+    def stk_query(self, payload):
+        """Return (http_status, body) for an STK query."""
+        checkout_request_id = payload.get('CheckoutRequestID')
+        with self._lock:
+            result = self._results.get(checkout_request_id)
+        if result is None:
+            return 500, {'errorCode': STILL_PROCESSING, 'errorMessage': 'The transaction is being processed'}
+
+        result_code, result_desc = result
+        return 200, {
+            'ResponseCode': '0',
+            'ResponseDescription': 'The service request has been accepted successsfully',
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': str(result_code),
+            'ResultDesc': result_desc,
+        }
+
+    def _settle(self, payload, merchant_request_id, checkout_request_id, failed, dropped):
+        result_code, result_desc = RESULT_CANCELLED if failed else RESULT_SUCCESS
+        with self._lock:
+            self._results[checkout_request_id] = (result_code, result_desc)
+            self._timers = {t for t in self._timers if t.is_alive() and t is not threading.current_thread()}
+        if dropped:
+            return
+
+        stk_callback = {
+            'MerchantRequestID': merchant_request_id,
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': result_code,
+            'ResultDesc': result_desc,
+        }
+        if not failed:
+            stk_callback['CallbackMetadata'] = {'Item': [
+                {'Name': 'Amount', 'Value': payload.get('Amount')},
+                {'Name': 'MpesaReceiptNumber', 'Value': uuid.uuid4().hex[:10].upper()},
+                {'Name': 'TransactionDate', 'Value': int(datetime.now().strftime('%Y%m%d%H%M%S'))},
+                {'Name': 'PhoneNumber', 'Value': payload.get('PhoneNumber')},
+            ]}
+
+        url = self.callback_url or payload.get('CallBackURL')
+        try:
+            self.deliver(url, {'Body': {'stkCallback': stk_callback}})
+        except Exception:
+            logger.exception(f"Delivering callback for {checkout_request_id} to {url} failed")
+
+    def _post_callback(self, url, body):
+        self._session.post(url, json=body, timeout=10).raise_for_status()
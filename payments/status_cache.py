@@ -0,0 +1,121 @@
+"""
+Write-through cache of payment statuses for the checkout status checks.
+
+While a customer waits for the STK push, check_payment_status and
+payment_events read the payment's status over and over. Every
+MpesaPayment save (creation, the STK push worker, the callback inbox,
+reconciliation) writes the new status here once it commits, so those
+reads are served from the cache and only fall back to the database on a
+miss. Final statuses never change and are kept for an hour; queued and
+pending entries expire quickly, which bounds how stale a per-process
+cache can be when the status was changed by another process: with the
+default LocMem cache, a poll may report a payment as pending for up to
+PENDING_TIMEOUT seconds after another process settled it. The event
+stream can't wait that long on top of its own recheck interval, so it
+re-reads open statuses from the database (aget_status(recheck_open=True)).
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import MpesaPayment
+
+FINAL_STATUSES = ('completed', 'failed', 'cancelled')
+PENDING_TIMEOUT = 15   # seconds; queued/pending can change at any moment
+FINAL_TIMEOUT = 3600
+
+_FIELDS = ('user_id', 'status', 'result_desc', 'mpesa_receipt_number')
+
+_stats = {'hits': 0, 'misses': 0, 'writes': 0}
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'PAYMENT_STATUS_CACHE_ALIAS', 'default')]
+
+
+def _key(payment_id):
+    return f'payments:status:{payment_id}'
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _timeout(status):
+    return FINAL_TIMEOUT if status in FINAL_STATUSES else PENDING_TIMEOUT
+
+
+def _entry(payment):
+    return {
+        'user_id': payment.user_id,
+        'status': payment.status,
+        'result_desc': payment.result_desc,
+        'mpesa_receipt': payment.mpesa_receipt_number,
+    }
+
+
+def _entry_from_row(row):
+    user_id, status, result_desc, receipt = row
+    return {'user_id': user_id, 'status': status, 'result_desc': result_desc, 'mpesa_receipt': receipt}
+
+
+def store(payment):
+    """Write ``payment``'s current status through to the cache."""
+    _cache().set(_key(payment.pk), _entry(payment), timeout=_timeout(payment.status))
+    _count('writes')
+
+
+def invalidate(payment_id):
+    _cache().delete(_key(payment_id))
+
+
+def get_status(payment_id, user_id):
+    """
+    Return the cached status entry of the user's payment, reading it from
+    the database on a miss. None if the payment doesn't exist or belongs to
+    someone else.
+    """
+    entry = _cache().get(_key(payment_id))
+    if entry is None:
+        _count('misses')
+        row = MpesaPayment.objects.filter(id=payment_id).values_list(*_FIELDS).first()
+        if row is None:
+            return None
+        entry = _entry_from_row(row)
+        _cache().set(_key(payment_id), entry, timeout=_timeout(entry['status']))
+    else:
+        _count('hits')
+    return entry if entry['user_id'] == user_id else None
+
+
+async def aget_status(payment_id, user_id, recheck_open=False):
+    """
+    Async variant of get_status() for the event stream. With
+    ``recheck_open``, a cached queued or pending entry is read again from
+    the database, since another process may have settled the payment.
+    """
+    entry = await _cache().aget(_key(payment_id))
+    if entry is not None and recheck_open and entry['status'] not in FINAL_STATUSES:
+        entry = None
+    if entry is None:
+        _count('misses')
+        row = await MpesaPayment.objects.filter(id=payment_id).values_list(*_FIELDS).afirst()
+        if row is None:
+            return None
+        entry = _entry_from_row(row)
+        await _cache().aset(_key(payment_id), entry, timeout=_timeout(entry['status']))
+    else:
+        _count('hits')
+    return entry if entry['user_id'] == user_id else None
+
+
+def stats():
+    """Hit/miss/write counters of this process, with the hit rate."""
+    with _stats_lock:
+        stats = dict(_stats)
+    reads = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / reads if reads else 0.0
+    return stats
@@ -1,3 +1,401 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from django.urls import reverse
+
+from dashboard.models import FoodSales
+from foods import cart as cart_service
+from foods.models import Cart, Food
+
+from . import callbacks, checkout, daraja, reconcile, status_cache
+from .management.commands.checkout_load import percentile
+from .models import MpesaCallback, MpesaPayment, Order
+from .simulator import DarajaSimulator
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('customer', password='pw')
+        self.food = Food.objects.create(name='Pizza', price=Decimal('100.00'))
+        self.cart = cart_service.get_active_cart(self.user)
+        cart_service.add_item(self.cart, self.food)
+        self.client.force_login(self.user)
+
+    def checkout(self):
+        response = self.client.post(reverse('payments:initiate_payment'), {'phone_number': '0712345678'})
+        self.assertEqual(response.status_code, 200, response.content)
+        return MpesaPayment.objects.get(pk=response.json()['payment_id'])
+
+    def test_checkout_charges_the_current_price(self):
+        staff = User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.post(
+            reverse('dashboard:update_price', args=[self.food.pk]),
+            json.dumps({'price': 200}), content_type='application/json',
+        )
+        self.assertTrue(response.json()['success'])
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.checkout().amount, 200)
+
+    def test_a_stale_stored_subtotal_is_recalculated_not_charged(self):
+        Cart.objects.filter(pk=self.cart.pk).update(subtotal=Decimal('40.00'))
+        with self.assertLogs('payments.views', 'WARNING'):
+            self.assertEqual(self.checkout().amount, 100)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.subtotal, Decimal('100.00'))
+
+    def test_the_push_is_sent_on_its_own_pool_after_commit(self):
+        with mock.patch('pikaquick.background.submit_to') as submit_to:
+            with self.captureOnCommitCallbacks(execute=True):
+                payment = self.checkout()
+        submit_to.assert_called_once_with(checkout.STK_POOL, checkout.send_stk_push, payment.id)
+
+    def test_a_payment_failed_during_the_push_stays_failed(self):
+        payment = MpesaPayment.objects.create(
+            user=self.user, cart=self.cart, phone_number='254712345678', amount=100, status='queued'
+        )
+
+        def push_while_reconcile_fails_it(payload, access_token):
+            reconcile.fail_unsent(timezone.now() + timedelta(minutes=1))
+            response = mock.Mock()
+            response.json.return_value = {
+                'ResponseCode': '0', 'MerchantRequestID': 'm-1', 'CheckoutRequestID': 'ws_CO_late',
+            }
+            return response
+
+        client = mock.Mock(stk_push=push_while_reconcile_fails_it)
+        with mock.patch.object(daraja.access_tokens, 'get', return_value='token'), \
+                mock.patch('payments.daraja.get_client', return_value=client), \
+                self.assertLogs('payments.checkout', 'WARNING'):
+            checkout.send_stk_push(payment.id)
+
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'failed')
+        self.assertEqual(payment.checkout_request_id, '')
+
+
+class PaymentEventsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('customer', password='pw')
+        self.payment = MpesaPayment.objects.create(
+            user=self.user, phone_number='254712345678', amount=100, status='completed'
+        )
+
+    def test_wsgi_clients_are_told_to_poll(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('payments:payment_events', args=[self.payment.pk]))
+        self.assertEqual(response.status_code, 204)
+
+    async def test_asgi_streams_the_status(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('payments:payment_events', args=[self.payment.pk]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn('"status": "completed"', body)
+
+
+def stk_callback(checkout_request_id, result_code=0):
+    return {'Body': {'stkCallback': {
+        'MerchantRequestID': 'm-1',
+        'CheckoutRequestID': checkout_request_id,
+        'ResultCode': result_code,
+        'ResultDesc': 'The service request is processed successfully.',
+        'CallbackMetadata': {'Item': [
+            {'Name': 'MpesaReceiptNumber', 'Value': 'RCP123'},
+            {'Name': 'TransactionDate', 'Value': 20260101120000},
+        ]},
+    }}}
+
+
+class CallbackInboxTests(TestCase):
+    def setUp(self):
+        callbacks._processing._queued = False
+        patcher = mock.patch('pikaquick.background.submit')
+        self.submit = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user('customer', password='pw')
+        food = Food.objects.create(name='Pizza', price=Decimal('100.00'))
+        self.cart = cart_service.get_active_cart(self.user)
+        cart_service.add_item(self.cart, food)
+        self.payment = MpesaPayment.objects.create(
+            user=self.user, cart=self.cart, phone_number='254712345678', amount=100,
+            status='pending', checkout_request_id='ws_CO_1',
+        )
+
+    def post_callback(self, body):
+        return self.client.post(reverse('payments:mpesa_callback'), json.dumps(body), content_type='application/json')
+
+    def test_redelivered_callbacks_are_applied_once(self):
+        for _ in range(2):
+            self.assertEqual(self.post_callback(stk_callback('ws_CO_1')).json()['ResultCode'], 0)
+        self.assertEqual(MpesaCallback.objects.count(), 1)
+
+        callbacks.process_pending()
+        callbacks.apply_stk_callback(stk_callback('ws_CO_1')['Body']['stkCallback'])
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+        self.assertEqual(self.payment.mpesa_receipt_number, 'RCP123')
+        self.assertEqual(Order.objects.filter(payment=self.payment).count(), 1)
+        self.assertFalse(MpesaCallback.objects.filter(processed_at__isnull=True).exists())
+
+    def test_rolled_back_schedule_does_not_block_later_ones(self):
+        try:
+            with transaction.atomic():
+                callbacks.schedule_processing()
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.submit.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            callbacks.schedule_processing()
+            callbacks.schedule_processing()
+        self.submit.assert_called_once()
+
+
+
+class StatusCacheTests(TestCase):
+    def setUp(self):
+        status_cache._cache().clear()
+        self.user = User.objects.create_user('customer', password='pw')
+        self.payment = MpesaPayment.objects.create(
+            user=self.user, phone_number='254712345678', amount=100,
+            status='pending', checkout_request_id='ws_CO_1',
+        )
+
+    def counts(self):
+        stats = status_cache.stats()
+        return stats['hits'], stats['misses']
+
+    def test_a_miss_is_read_from_the_database_then_served_from_the_cache(self):
+        hits, misses = self.counts()
+        with self.assertNumQueries(1):
+            self.assertEqual(status_cache.get_status(self.payment.pk, self.user.pk)['status'], 'pending')
+        with self.assertNumQueries(0):
+            self.assertEqual(status_cache.get_status(self.payment.pk, self.user.pk)['status'], 'pending')
+            self.assertIsNone(status_cache.get_status(self.payment.pk, self.user.pk + 1))
+        self.assertEqual(self.counts(), (hits + 2, misses + 1))
+
+    def test_a_callback_writes_the_new_status_through(self):
+        status_cache.get_status(self.payment.pk, self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            callbacks.apply_stk_callback(stk_callback('ws_CO_1', result_code=1032)['Body']['stkCallback'])
+        with self.assertNumQueries(0):
+            self.assertEqual(status_cache.get_status(self.payment.pk, self.user.pk)['status'], 'failed')
+
+    def test_open_statuses_expire_after_the_pending_timeout(self):
+        settled = MpesaPayment.objects.create(
+            user=self.user, phone_number='254712345678', amount=100, status='completed'
+        )
+        status_cache.get_status(self.payment.pk, self.user.pk)
+        status_cache.get_status(settled.pk, self.user.pk)
+
+        later = time.time() + status_cache.PENDING_TIMEOUT + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            with self.assertNumQueries(1):
+                status_cache.get_status(self.payment.pk, self.user.pk)
+            with self.assertNumQueries(0):
+                status_cache.get_status(settled.pk, self.user.pk)
+
+    async def test_the_event_stream_rechecks_open_statuses(self):
+        await status_cache.aget_status(self.payment.pk, self.user.pk)
+        # Settled by another process: no signal reaches this one's cache
+        await MpesaPayment.objects.filter(pk=self.payment.pk).aupdate(status='completed')
+
+        entry = await status_cache.aget_status(self.payment.pk, self.user.pk)
+        self.assertEqual(entry['status'], 'pending')
+        entry = await status_cache.aget_status(self.payment.pk, self.user.pk, recheck_open=True)
+        self.assertEqual(entry['status'], 'completed')
+
+class DarajaRetryTests(SimpleTestCase):
+    def client_returning(self, status_code, body):
+        client = daraja.DarajaClient(base_url='http://daraja.test', backoff=0)
+        response = mock.Mock(status_code=status_code)
+        response.json.return_value = body
+        client.session = mock.Mock()
+        client.session.request.return_value = response
+        return client
+
+    def test_still_processing_is_not_retried(self):
+        client = self.client_returning(500, {'errorCode': daraja.STILL_PROCESSING})
+        client.stk_query({}, 'token')
+        self.assertEqual(client.session.request.call_count, 1)
+        self.assertIsNone(reconcile.query_payment(client, 'token', 'ws_CO_1'))
+
+    def test_other_server_errors_are_retried(self):
+        client = self.client_returning(500, {'errorCode': '500.003.02'})
+        with self.assertLogs('payments.daraja', 'WARNING'):
+            client.stk_query({}, 'token')
+        self.assertEqual(client.session.request.call_count, client.retries + 1)
+
+    def test_idempotent_calls_are_retried_after_a_timeout(self):
+        client = self.client_returning(200, {'access_token': 'token', 'expires_in': '3599'})
+        answer = client.session.request.return_value
+        client.session.request.side_effect = [requests.Timeout(), answer]
+        with self.assertLogs('payments.daraja', 'WARNING'):
+            self.assertEqual(client.fetch_access_token(), ('token', 3599))
+        self.assertEqual(client.session.request.call_count, 2)
+
+    def test_idempotent_calls_give_up_after_the_last_retry(self):
+        client = self.client_returning(200, {})
+        client.session.request.side_effect = requests.Timeout()
+        with self.assertLogs('payments.daraja', 'WARNING'), self.assertRaises(requests.Timeout):
+            client.stk_query({}, 'token')
+        self.assertEqual(client.session.request.call_count, client.retries + 1)
+
+    def test_stk_push_is_sent_once(self):
+        client = self.client_returning(503, {'errorMessage': 'Service unavailable'})
+        self.assertEqual(client.stk_push({}, 'token').status_code, 503)
+        self.assertEqual(client.session.request.call_count, 1)
+
+        client.session.request.reset_mock()
+        client.session.request.side_effect = requests.Timeout()
+        with self.assertRaises(requests.Timeout):
+            client.stk_push({}, 'token')
+        self.assertEqual(client.session.request.call_count, 1)
+
+
+class ReconcileTests(TestCase):
+    def test_unsent_queued_payments_are_failed(self):
+        user = User.objects.create_user('customer', password='pw')
+        payment = MpesaPayment.objects.create(user=user, phone_number='254712345678', amount=100, status='queued')
+        MpesaPayment.objects.filter(pk=payment.pk).update(updated_at=timezone.now() - timedelta(minutes=10))
+
+        client = mock.Mock()
+        client.fetch_access_token.return_value = ('token', 3599)
+        self.assertEqual(reconcile.reconcile(client=client), (1, 1))
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'failed')
+        client.stk_query.assert_not_called()
+
+    def test_queued_payments_with_a_checkout_request_are_queried(self):
+        user = User.objects.create_user('customer', password='pw')
+        payment = MpesaPayment.objects.create(
+            user=user, phone_number='254712345678', amount=100, status='queued', checkout_request_id='ws_CO_2'
+        )
+        MpesaPayment.objects.filter(pk=payment.pk).update(updated_at=timezone.now() - timedelta(minutes=10))
+
+        client = mock.Mock()
+        client.fetch_access_token.return_value = ('token', 3599)
+        client.stk_query.return_value.json.return_value = {
+            'ResponseCode': '0', 'ResultCode': '1032', 'ResultDesc': 'Request cancelled by user',
+        }
+        self.assertEqual(reconcile.reconcile(client=client), (1, 1))
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'failed')
+
+
+class PercentileTests(SimpleTestCase):
+    def test_nearest_rank(self):
+        values = list(range(1, 21))
+        self.assertEqual(percentile(values, 50), 10)
+        self.assertEqual(percentile(values, 95), 19)
+        self.assertEqual(percentile(values, 55), 11)
+        self.assertEqual(percentile(list(range(1, 11)), 25), 3)
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile(values, 100), 20)
+        self.assertEqual(percentile([], 50), 0.0)
+
+
+class OrderSnapshotTests(TestCase):
+    def setUp(self):
+        mock.patch('pikaquick.background.submit').start()
+        self.addCleanup(mock.patch.stopall)
+        self.user = User.objects.create_user('customer', password='pw')
+        self.food = Food.objects.create(name='Pizza', price=Decimal('100.00'))
+        self.cart = cart_service.get_active_cart(self.user)
+        cart_service.add_item(self.cart, self.food, 2)
+        self.client.force_login(self.user)
+
+    def test_order_matches_what_was_charged(self):
+        response = self.client.post(reverse('payments:initiate_payment'), {'phone_number': '0712345678'})
+        payment = MpesaPayment.objects.get(pk=response.json()['payment_id'])
+        self.assertEqual(payment.amount, 200)
+        MpesaPayment.objects.filter(pk=payment.pk).update(status='pending', checkout_request_id='ws_CO_9')
+
+        # The price and the cart change while the STK push is pending
+        self.food.price = Decimal('150.00')
+        self.food.save()
+        cart_service.add_item(self.cart, Food.objects.create(name='Soda', price=Decimal('80.00')))
+
+        callbacks.apply_stk_callback(stk_callback('ws_CO_9')['Body']['stkCallback'])
+
+        order = Order.objects.get(payment=payment)
+        self.assertEqual(order.total, payment.amount)
+        self.assertEqual(order.item_count, 2)
+        self.assertEqual(
+            [(line.name, line.unit_price, line.quantity) for line in order.lines.all()],
+            [('Pizza', Decimal('100.00'), 2)],
+        )
+
+    def test_a_food_deleted_while_the_push_is_pending_keeps_its_line(self):
+        response = self.client.post(reverse('payments:initiate_payment'), {'phone_number': '0712345678'})
+        payment = MpesaPayment.objects.get(pk=response.json()['payment_id'])
+        MpesaPayment.objects.filter(pk=payment.pk).update(status='pending', checkout_request_id='ws_CO_9')
+
+        self.food.delete()
+        callbacks.apply_stk_callback(stk_callback('ws_CO_9')['Body']['stkCallback'])
+        connection.check_constraints()
+
+        order = Order.objects.get(payment=payment)
+        self.assertEqual(order.total, payment.amount)
+        self.assertEqual(
+            [(line.food_id, line.name, line.quantity) for line in order.lines.all()],
+            [(None, 'Pizza', 2)],
+        )
+        self.assertEqual(
+            list(FoodSales.objects.values_list('food_id', 'name', 'units')),
+            [(None, 'Pizza', 2)],
+        )
+
+
+class AccessTokenCacheTests(SimpleTestCase):
+    def setUp(self):
+        caches['default'].delete_many([daraja.TOKEN_CACHE_KEY, daraja.TOKEN_LOCK_KEY])
+
+    def test_token_is_reused_until_the_refresh_margin(self):
+        now = [1000.0]
+        tokens = iter(['first', 'second'])
+        fetch = mock.Mock(side_effect=lambda: (next(tokens), 600))
+        token_cache = daraja.AccessTokenCache(fetch=fetch, refresh_margin=60)
+
+        with mock.patch('payments.daraja.time.time', side_effect=lambda: now[0]):
+            self.assertEqual(token_cache.get(), 'first')
+            now[0] += 539  # one second before the margin
+            self.assertEqual(token_cache.get(), 'first')
+            self.assertEqual(fetch.call_count, 1)
+
+            now[0] += 1  # expires_at - refresh_margin
+            self.assertEqual(token_cache.get(), 'second')
+            self.assertEqual(fetch.call_count, 2)
+
+    def test_concurrent_gets_make_one_oauth_request(self):
+        with DarajaSimulator() as simulator:
+            client = daraja.DarajaClient(base_url=simulator.url)
+            token_cache = daraja.AccessTokenCache(fetch=client.fetch_access_token)
+            workers = 10
+            barrier = threading.Barrier(workers)
+
+            def get_token(_):
+                barrier.wait()  # all threads find the cache empty together
+                return token_cache.get()
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                tokens = list(pool.map(get_token, range(workers)))
+
+        self.assertEqual(tokens, [simulator.token] * workers)
+        self.assertEqual(simulator.oauth_requests, 1)
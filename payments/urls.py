@@ -9,6 +9,7 @@ urlpatterns = [
     path('initiate/', views.initiate_payment, name='initiate_payment'),
     path('callback/', views.mpesa_callback, name='mpesa_callback'),
     path('check-status/<int:payment_id>/', views.check_payment_status, name='check_status'),
+    path('events/<int:payment_id>/', views.payment_events, name='payment_events'),
     path('confirmation/<int:payment_id>/', views.payment_confirmation, name='payment_confirmation'),
     path('status/<int:payment_id>/', views.payment_status, name='payment_status'),
 ]
\ No newline at end of file
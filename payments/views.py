@@ -2,36 +2,35 @@
 
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from django.utils import timezone
 from django.contrib import messages
-from .models import MpesaPayment
-from foods.models import Cart, CartItem 
-import requests
-import base64
-from datetime import datetime
+from .models import MpesaCallback, MpesaPayment, Order
+from . import callbacks, checkout, orders, status_cache
+from .events import hub
+from foods import cart as cart_service
+from foods.models import Cart
+import asyncio
 import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+PAYMENT_EVENTS_TIMEOUT = 180  # seconds an event stream stays open
+PAYMENT_EVENTS_RECHECK = 10   # seconds between re-reads (catches other processes' updates)
 
-def get_mpesa_access_token():
-    """Get OAuth access token from Daraja API"""
-    consumer_key = settings.MPESA_CONSUMER_KEY
-    consumer_secret = settings.MPESA_CONSUMER_SECRET
-    # Ensure MPESA_SANDBOX_BASE_URL is set in settings.py (e.g., https://sandbox.safaricom.co.ke)
-    api_url = f"{settings.MPESA_SANDBOX_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
-    
-    try:
-        response = requests.get(api_url, auth=(consumer_key, consumer_secret))
-        response.raise_for_status()
-        return response.json()['access_token']
-    except Exception as e:
-        logger.error(f"Error getting access token: {str(e)}")
-        return None
+
+def _status_payload(status, result_desc, mpesa_receipt):
+    return {
+        'status': status,
+        'result_desc': result_desc,
+        'mpesa_receipt': mpesa_receipt,
+        'should_refresh': status in TERMINAL_STATUSES,
+    }
 
 
 @login_required
@@ -43,19 +42,24 @@ def initiate_payment(request):
     if request.method == 'POST':
         phone_number = request.POST.get('phone_number')
         
-        # 1. Get ACTIVE cart and calculate total
+        # 1. Get ACTIVE cart; it is priced from its stored subtotal, and its
+        # lines are snapshotted on the payment so the order written on
+        # completion matches the amount charged
         try:
-            cart = Cart.objects.get(user=request.user, is_active=True)
-            amount = int(cart.total_price())
-            
-            # CRITICAL: For M-Pesa Sandbox testing, the minimum amount is typically 1 KES
-            api_amount = 1 if amount <= 0 else amount
-            
-            if amount <= 0:
-                return JsonResponse({'success': False, 'error': 'Your cart is empty'}, status=400)
-                
+            cart = Cart.objects.only('id', 'subtotal').get(user=request.user, is_active=True)
         except Cart.DoesNotExist:
             return JsonResponse({'success': False, 'error': 'Cart not found'}, status=404)
+        if int(cart.subtotal) <= 0:
+            return JsonResponse({'success': False, 'error': 'Your cart is empty'}, status=400)
+
+        lines = orders.cart_lines(cart.id)
+        if orders.lines_total(lines) != cart.subtotal:
+            # The stored subtotal missed a change; never charge a stale amount
+            logger.warning(f"Cart {cart.id} subtotal {cart.subtotal} did not match its lines; recalculated")
+            cart_service.recalculate(cart)
+        amount = int(cart.subtotal)
+        if amount <= 0:
+            return JsonResponse({'success': False, 'error': 'Your cart is empty'}, status=400)
         
         # 2. Format phone number (remove leading 0, add 254)
         if phone_number.startswith('0'):
@@ -63,73 +67,37 @@ def initiate_payment(request):
         elif not phone_number.startswith('254'):
             phone_number = '254' + phone_number
         
-        # 3. Get access token
-        access_token = get_mpesa_access_token()
-        if not access_token:
-            return JsonResponse({'success': False, 'error': 'Failed to authenticate with M-Pesa'}, status=500)
+        # 3. Record the payment and hand the STK push to checkout.send_stk_push
+        payment = MpesaPayment.objects.create(
+            user=request.user,
+            cart=cart,
+            phone_number=phone_number,
+            amount=amount, # Store the actual cart amount
+            lines=orders.snapshot_lines(lines),
+            status='queued'
+        )
         
-        # 4. Prepare STK Push request
-        api_url = f"{settings.MPESA_SANDBOX_BASE_URL}/mpesa/stkpush/v1/processrequest"
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
+        if settings.MPESA_ASYNC_CHECKOUT:
+            # Return straight away; the client polls while the push is sent
+            checkout.dispatch_on_commit(payment.id)
+            return JsonResponse({
+                'success': True,
+                'payment_id': payment.id,
+                'status': payment.status,
+                'message': 'Sending STK Push. Check your phone shortly.'
+            })
         
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        password = base64.b64encode(
-            f"{settings.MPESA_SHORTCODE}{settings.MPESA_PASSKEY}{timestamp}".encode()
-        ).decode('utf-8')
+        payment = checkout.send_stk_push(payment.id)
+        if payment.status == 'failed':
+            return JsonResponse({'success': False, 'error': payment.result_desc}, status=500)
         
-        payload = {
-            "BusinessShortCode": settings.MPESA_SHORTCODE,
-            "Password": password,
-            "Timestamp": timestamp,
-            "TransactionType": "CustomerPayBillOnline",
-            "Amount": api_amount, # Use the sandbox-safe amount
-            "PartyA": phone_number,
-            "PartyB": settings.MPESA_SHORTCODE,
-            "PhoneNumber": phone_number,
-            "CallBackURL": settings.MPESA_CALLBACK_URL,
-            "AccountReference": f"PikaQuick-{request.user.id}",
-            "TransactionDesc": "Food Order Payment"
-        }
-        
-        try:
-            response = requests.post(api_url, json=payload, headers=headers, timeout=30)
-            response_data = response.json()
-            
-            if response_data.get('ResponseCode') == '0':
-                # 5. Save payment record
-                payment = MpesaPayment.objects.create(
-                    user=request.user,
-                    phone_number=phone_number,
-                    amount=amount, # Store the actual cart amount
-                    merchant_request_id=response_data.get('MerchantRequestID'),
-                    checkout_request_id=response_data.get('CheckoutRequestID'),
-                    status='pending'
-                )
-                
-                # Store cart ID in session for later reference (for confirmation page)
-                request.session['pending_cart_id'] = cart.id
-                
-                # 6. Return JSON SUCCESS to the client to start polling
-                return JsonResponse({
-                    'success': True,
-                    'payment_id': payment.id,
-                    'message': 'STK Push sent successfully. Awaiting PIN.'
-                })
-            else:
-                error_message = response_data.get('errorMessage', response_data.get('ResponseDescription', 'Payment request failed'))
-                logger.error(f"STK Push failed for user {request.user.id}: {error_message}")
-                return JsonResponse({'success': False, 'error': error_message}, status=500)
-                
-        except requests.exceptions.RequestException as e:
-            logger.error(f"STK Push Request Error: {str(e)}")
-            return JsonResponse({'success': False, 'error': 'Failed to communicate with M-Pesa API.'}, status=500)
-            
-        except Exception as e:
-            logger.error(f"STK Push Internal Error: {str(e)}")
-            return JsonResponse({'success': False, 'error': 'Failed to initiate payment. Please try again.'}, status=500)
+        # 4. Return JSON SUCCESS to the client to start polling
+        return JsonResponse({
+            'success': True,
+            'payment_id': payment.id,
+            'status': payment.status,
+            'message': 'STK Push sent successfully. Awaiting PIN.'
+        })
     
     # GET request - return JSON error (frontend should only call via POST)
     return JsonResponse({'success': False, 'error': 'Invalid request method'}, status=405)
@@ -139,57 +107,24 @@ def initiate_payment(request):
 def mpesa_callback(request):
     """
     Handle M-Pesa callback after payment. Called ONLY by the Daraja API.
+
+    The raw callback is stored in the MpesaCallback inbox and acknowledged
+    immediately; payments.callbacks applies it to the payment afterwards.
+    Redelivered callbacks hit the unique CheckoutRequestID and are dropped.
     """
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            stk_callback = data.get('Body', {}).get('stkCallback', {})
-            checkout_request_id = stk_callback.get('CheckoutRequestID')
-            result_code = stk_callback.get('ResultCode')
-            result_desc = stk_callback.get('ResultDesc', 'No description provided.')
+            checkout_request_id = data.get('Body', {}).get('stkCallback', {}).get('CheckoutRequestID')
+            if not checkout_request_id:
+                logger.error(f"Callback without CheckoutRequestID - Raw Data: {request.body}")
+                return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Failed'})
             
-            # Find payment record
-            try:
-                payment = MpesaPayment.objects.get(
-                    checkout_request_id=checkout_request_id
-                )
-                
-                payment.result_code = str(result_code)
-                payment.result_desc = result_desc
-                
-                if result_code == 0:
-                    # Payment successful
-                    callback_metadata = stk_callback.get('CallbackMetadata', {}).get('Item', [])
-                    
-                    for item in callback_metadata:
-                        if item.get('Name') == 'MpesaReceiptNumber':
-                            payment.mpesa_receipt_number = item.get('Value')
-                        elif item.get('Name') == 'TransactionDate':
-                            # Safaricom format is YYYYMMDDHHmmss
-                            transaction_date = str(item.get('Value'))
-                            payment.transaction_date = datetime.strptime(
-                                transaction_date, '%Y%m%d%H%M%S'
-                            )
-                    
-                    payment.status = 'completed'
-                    
-                    # Mark user's ACTIVE cart as completed (inactive)
-                    try:
-                        cart = Cart.objects.get(user=payment.user, is_active=True)
-                        cart.is_active = False
-                        cart.save()
-                        logger.info(f"Cart {cart.id} marked as inactive after successful payment.")
-                    except Cart.DoesNotExist:
-                        logger.warning(f"No active cart found for user {payment.user.id} during successful callback.")
-                        
-                else:
-                    # Payment failed/cancelled
-                    payment.status = 'failed'
-                
-                payment.save()
-                
-            except MpesaPayment.DoesNotExist:
-                logger.error(f"Payment not found for checkout request: {checkout_request_id}")
+            MpesaCallback.objects.bulk_create(
+                [MpesaCallback(checkout_request_id=checkout_request_id, payload=data)],
+                ignore_conflicts=True,
+            )
+            callbacks.schedule_processing()
             
             # Must return success acknowledgement to M-Pesa API
             return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Success'})
@@ -205,27 +140,19 @@ def mpesa_callback(request):
 def payment_confirmation(request, payment_id):
     """Show payment confirmation/receipt page (HTML template)"""
     payment = get_object_or_404(MpesaPayment, id=payment_id, user=request.user)
-    
-    # Logic to fetch cart items for display (remains the same as your original)
-    cart_id = request.session.get('pending_cart_id')
-    cart_items = []
-    
-    if cart_id:
-        try:
-            cart = Cart.objects.get(id=cart_id)
-            cart_items = CartItem.objects.filter(cart=cart)
-        except Cart.DoesNotExist:
-            pass
-    # ... (rest of the cart fetching logic remains the same) ...
-    
-    # Calculate total with item totals
-    for item in cart_items:
-        item.total_price = item.food.price * item.quantity
+
+    # A completed payment has its Order snapshot (one query for the lines);
+    # until then show the lines the payment was initiated for
+    order = Order.objects.filter(payment=payment).prefetch_related('lines').first()
+    if order is not None:
+        cart_items = order.lines.all()
+    else:
+        cart_items = orders.payment_lines(payment)
     
     # Determine payment status
     if payment.status == 'completed':
         payment_status = 'success'
-    elif payment.status == 'pending':
+    elif payment.status in ('queued', 'pending'):
         payment_status = 'pending'
     else:
         payment_status = 'failed'
@@ -237,6 +164,7 @@ def payment_confirmation(request, payment_id):
         'phone_number': payment.phone_number,
         'amount': payment.amount,
         'payment_date': payment.transaction_date or payment.created_at,
+        'order': order,
         'cart_items': cart_items,
         'error_message': payment.result_desc if payment.status == 'failed' else None,
     }
@@ -250,20 +178,73 @@ def check_payment_status(request, payment_id):
     CRITICAL FIX: AJAX endpoint to check payment status. Returns current status 
     to drive the frontend polling and transitions.
     """
-    try:
-        payment = MpesaPayment.objects.get(id=payment_id, user=request.user)
-        
-        # NOTE: The cart is officially marked inactive in mpesa_callback. 
-        # We just report the payment status here.
-        
-        return JsonResponse({
-            'status': payment.status,
-            'result_desc': payment.result_desc,
-            'mpesa_receipt': payment.mpesa_receipt_number,
-            'should_refresh': payment.status in ['completed', 'failed', 'cancelled']
-        })
-    except MpesaPayment.DoesNotExist:
+    # Served from the write-through status cache; the database is only
+    # read on a miss. The cart is officially marked inactive when the
+    # callback is applied, we just report the payment status here.
+    entry = status_cache.get_status(payment_id, request.user.id)
+    if entry is None:
         return JsonResponse({'error': 'Payment not found'}, status=404)
+    return JsonResponse(_status_payload(entry['status'], entry['result_desc'], entry['mpesa_receipt']))
+
+
+@login_required
+async def payment_events(request, payment_id):
+    """
+    Server-sent events stream of a payment's status. Holds one connection
+    per checkout and pushes an event as soon as the status changes, instead
+    of the client polling check_payment_status. Served only under ASGI
+    (pikaquick/asgi.py): a WSGI server would buffer the whole stream and
+    hold a worker thread for it, so there the client is answered 204 and
+    falls back to polling.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+
+    user = await request.auser()
+
+    async def read_status():
+        # Open statuses skip the cache: this process's copy can lag a
+        # callback applied by another one (see status_cache)
+        entry = await status_cache.aget_status(payment_id, user.id, recheck_open=True)
+        return entry and (entry['status'], entry['result_desc'], entry['mpesa_receipt'])
+
+    if await read_status() is None:
+        return JsonResponse({'error': 'Payment not found'}, status=404)
+
+    async def stream():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + PAYMENT_EVENTS_TIMEOUT
+        last = None
+
+        while True:
+            # Subscribe before reading so a change in between isn't missed
+            changed = hub.subscribe(payment_id)
+            try:
+                current = await read_status()
+                if current is None:
+                    yield 'event: gone\ndata: {"error": "Payment not found"}\n\n'
+                    return
+                if current != last:
+                    last = current
+                    yield f"data: {json.dumps(_status_payload(*current))}\n\n"
+                if current[0] in TERMINAL_STATUSES:
+                    return
+
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    yield 'event: timeout\ndata: {}\n\n'
+                    return
+                try:
+                    await asyncio.wait_for(changed.wait(), min(PAYMENT_EVENTS_RECHECK, remaining))
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+            finally:
+                hub.unsubscribe(payment_id, changed)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    return response
 
 
 @login_required
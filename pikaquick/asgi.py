@@ -3,6 +3,10 @@ ASGI config for pikaquick project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the site through this module (e.g. ``uvicorn pikaquick.asgi:application``)
+so the payment status stream (payments.views.payment_events) holds open
+connections on the event loop instead of one worker thread each.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
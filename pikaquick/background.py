@@ -0,0 +1,123 @@
+"""
+In-process background executor.
+
+Work that shouldn't hold a request thread (outbound API calls, file
+processing, mail) is handed to a small thread pool. Jobs run with their
+own DB connection, which is closed when the job finishes, and exceptions
+are logged rather than lost. CoalescedJob wraps the queue drains (M-Pesa
+callback inbox, email outbox) that many events can trigger at once.
+
+Work that can block for long (STK pushes wait up to 30s on Daraja) goes
+to a named pool of its own with submit_to(), so a burst of it can't
+starve the drains on the default pool. Pool sizes are set with
+BACKGROUND_POOLS, falling back to BACKGROUND_WORKERS.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL = 'bg'
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def get_executor(pool=DEFAULT_POOL):
+    executor = _executors.get(pool)
+    if executor is None:
+        with _lock:
+            executor = _executors.get(pool)
+            if executor is None:
+                workers = getattr(settings, 'BACKGROUND_POOLS', {}).get(pool)
+                executor = _executors[pool] = ThreadPoolExecutor(
+                    max_workers=workers or getattr(settings, 'BACKGROUND_WORKERS', 4),
+                    thread_name_prefix=f'pikaquick-{pool}',
+                )
+    return executor
+
+
+def _run(fn, args, kwargs):
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        logger.exception(f"Background job {fn.__module__}.{fn.__qualname__} failed")
+        raise
+    finally:
+        connections.close_all()
+
+
+def submit(fn, *args, **kwargs):
+    """Run ``fn(*args, **kwargs)`` on the background pool; returns a Future."""
+    return get_executor().submit(_run, fn, args, kwargs)
+
+
+def submit_to(pool, fn, *args, **kwargs):
+    """Like submit(), but on the named ``pool``."""
+    return get_executor(pool).submit(_run, fn, args, kwargs)
+
+
+def submit_on_commit(fn, *args, **kwargs):
+    """Like submit(), but only once the current transaction has committed."""
+    transaction.on_commit(lambda: submit(fn, *args, **kwargs))
+
+
+class CoalescedJob:
+    """
+    A drain that any number of events can ask for, run at most once per
+    burst. schedule() queues a run once the current transaction commits;
+    while a run is queued but not started, further requests are folded
+    into it. The queued flag is only set in that on-commit callback, so a
+    rolled-back transaction leaves nothing behind.
+
+    ``fn`` returns whether work is left over (failed or not yet due rows);
+    if so, or if it raised, another run is queued after ``retry_interval``
+    seconds, so leftovers don't wait for an unrelated new event.
+    """
+
+    def __init__(self, fn, retry_interval=None):
+        self.fn = fn
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._queued = False
+        self._timer = None
+
+    def schedule(self):
+        """Run the job once the current transaction has committed."""
+        transaction.on_commit(self.submit)
+
+    def submit(self):
+        """Run the job now, unless a run is already queued."""
+        with self._lock:
+            if self._queued:
+                return None
+            self._queued = True
+        return submit(self._run)
+
+    def _run(self):
+        # Cleared before running, so events during the run queue another one
+        with self._lock:
+            self._queued = False
+        try:
+            leftover = self.fn()
+        except Exception:
+            self._retry_later()
+            raise
+        if leftover:
+            self._retry_later()
+        return leftover
+
+    def _retry_later(self):
+        if not self.retry_interval:
+            return
+        with self._lock:
+            if self._timer is not None and self._timer.is_alive():
+                return
+            self._timer = threading.Timer(self.retry_interval, self.submit)
+            self._timer.daemon = True
+            self._timer.start()
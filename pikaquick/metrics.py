@@ -0,0 +1,298 @@
+"""
+Per-request performance metrics.
+
+MetricsMiddleware times every request and, per view, records into
+in-process histograms: total latency, number and duration of DB queries,
+template render time and time spent calling Daraja. Those figures are
+collected on a per-request RequestStats held in a ContextVar, so they
+follow a request into sync_to_async threads:
+
+- DB queries through an execute wrapper that is installed on every new
+  connection (connection_created), and is a plain pass-through outside
+  of requests;
+- template rendering through the DjangoTemplates backend subclass below
+  (TEMPLATES['BACKEND']);
+- Daraja calls through DarajaClient, which reports each call here.
+
+A request that runs the same SQL ``METRICS_N_PLUS_ONE_THRESHOLD`` times
+or more is counted and logged as a likely N+1 query. The cost per query
+is two clock reads and a dict update; per request, a few histogram
+updates. The body of a streaming response is produced after the
+middleware returns, so only the work up to the first byte is measured.
+
+metrics_view serves everything in the Prometheus text format, together
+with the Daraja client's per-endpoint counters and the payment status
+cache counters. It is open only to requests carrying
+``Authorization: Bearer <METRICS_TOKEN>`` and to staff users; there is
+no address allowlist, because behind ngrok or a local reverse proxy
+every request arrives from 127.0.0.1.
+"""
+import bisect
+import hmac
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """Prometheus-style histogram with one label, safe to update from any thread."""
+
+    def __init__(self, name, documentation, buckets, label='view'):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._values = {}  # label value -> [bucket counts, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_value)
+            if entry is None:
+                entry = self._values[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def expose(self):
+        with self._lock:
+            values = {label_value: (list(counts), total) for label_value, (counts, total) in self._values.items()}
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for label_value, (counts, total) in sorted(values.items()):
+            label = f'{self.label}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {total}')
+            lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+        return lines
+
+
+class Counter:
+    """Prometheus counter keyed by a tuple of label values."""
+
+    def __init__(self, name, documentation, labels=('view',)):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def expose(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(values.items()):
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values))
+            lines.append(f'{self.name}{{{labels}}} {value}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUESTS = Counter('pikaquick_requests_total', 'Requests by view and status class.', ('view', 'status'))
+REQUEST_SECONDS = Histogram('pikaquick_request_duration_seconds', 'Request latency.', LATENCY_BUCKETS)
+DB_QUERIES = Histogram('pikaquick_db_queries', 'DB queries per request.', QUERY_COUNT_BUCKETS)
+DB_SECONDS = Histogram('pikaquick_db_duration_seconds', 'Time in DB queries per request.', LATENCY_BUCKETS)
+TEMPLATE_SECONDS = Histogram(
+    'pikaquick_template_render_seconds', 'Template render time per request that renders one.', LATENCY_BUCKETS
+)
+DARAJA_SECONDS = Histogram(
+    'pikaquick_daraja_duration_seconds', 'Time calling Daraja per request that calls it.', LATENCY_BUCKETS
+)
+N_PLUS_ONE = Counter('pikaquick_n_plus_one_total', 'Requests that repeated one SQL statement many times.')
+
+METRICS = (REQUESTS, REQUEST_SECONDS, DB_QUERIES, DB_SECONDS, TEMPLATE_SECONDS, DARAJA_SECONDS, N_PLUS_ONE)
+
+
+class RequestStats:
+    """What one request spent its time on."""
+
+    __slots__ = ('queries', 'db_seconds', 'template_seconds', 'daraja_seconds', 'statements')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.daraja_seconds = 0.0
+        self.statements = {}  # SQL (placeholders, not values) -> times run
+
+
+_current = ContextVar('pikaquick_request_stats', default=None)
+
+
+def _time_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_seconds += time.perf_counter() - started
+        stats.queries += 1
+        stats.statements[sql] = stats.statements.get(sql, 0) + 1
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+def record_daraja(seconds):
+    """Add time spent on a Daraja call to the current request, if any."""
+    stats = _current.get()
+    if stats is not None:
+        stats.daraja_seconds += seconds
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The standard Django template backend, timing each render."""
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_seconds += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """Record latency, DB, template and Daraja time of every request, per view."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'METRICS_N_PLUS_ONE_THRESHOLD', 10)
+        # Connections opened before this module was imported
+        for connection in connections.all(initialized_only=True):
+            install_query_timer(None, connection)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def _record(self, request, response, stats, elapsed):
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+
+        REQUESTS.inc((view, f'{response.status_code // 100}xx'))
+        REQUEST_SECONDS.observe(view, elapsed)
+        DB_QUERIES.observe(view, stats.queries)
+        DB_SECONDS.observe(view, stats.db_seconds)
+        if stats.template_seconds:
+            TEMPLATE_SECONDS.observe(view, stats.template_seconds)
+        if stats.daraja_seconds:
+            DARAJA_SECONDS.observe(view, stats.daraja_seconds)
+
+        repeated = [(count, sql) for sql, count in stats.statements.items() if count >= self.threshold]
+        if repeated:
+            N_PLUS_ONE.inc((view,))
+            for count, sql in sorted(repeated, reverse=True):
+                logger.warning(f"Possible N+1 in {view}: {count} x {sql[:200]}")
+
+
+def _allowed(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    return request.user.is_authenticated and request.user.is_staff
+
+
+def _sample_lines(name, kind, documentation, samples):
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+    lines.extend(f'{name}{labels} {value}' for labels, value in samples)
+    return lines
+
+
+def metrics_view(request):
+    """Prometheus text exposition of this process's metrics."""
+    if not _allowed(request):
+        return HttpResponseForbidden()
+    # Imported here: payments.daraja reports into this module
+    from payments import daraja, status_cache
+
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+
+    endpoints = sorted(daraja.get_client().metrics().items())
+    for key, name, kind, documentation in (
+        ('requests', 'pikaquick_daraja_requests_total', 'counter', 'Daraja HTTP requests by endpoint.'),
+        ('errors', 'pikaquick_daraja_errors_total', 'counter', 'Failed Daraja HTTP requests by endpoint.'),
+        ('total_seconds', 'pikaquick_daraja_seconds_total', 'counter', 'Time in Daraja HTTP requests.'),
+        ('max_seconds', 'pikaquick_daraja_max_seconds', 'gauge', 'Slowest Daraja HTTP request.'),
+    ):
+        lines.extend(_sample_lines(name, kind, documentation, [
+            (f'{{endpoint="{_escape(endpoint)}"}}', stats[key]) for endpoint, stats in endpoints
+        ]))
+
+    cache_stats = status_cache.stats()
+    for key in ('hits', 'misses', 'writes'):
+        lines.extend(_sample_lines(
+            f'pikaquick_payment_status_cache_{key}_total', 'counter', f'Payment status cache {key}.',
+            [('', cache_stats[key])],
+        ))
+
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'pikaquick.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -64,7 +66,8 @@ LOGOUT_REDIRECT_URL = 'landing_page'  # Redirect to landing page after logout
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, with render times reported to pikaquick.metrics
+        'BACKEND': 'pikaquick.metrics.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -101,6 +104,53 @@ DATABASES = {
     }
 }
 
+# Caches
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pikaquick-default',
+    },
+    # Menu snapshots for the ordering page (see foods/catalog.py).
+    # LocMem is per process: with more than one worker process point this
+    # alias at a shared backend (Redis/Memcached), or a menu edit in one
+    # worker leaves the others serving the old snapshots until TIMEOUT.
+    # Bounded: once MAX_ENTRIES is reached 1/CULL_FREQUENCY of the entries are evicted.
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pikaquick-catalog',
+        'TIMEOUT': 600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 500,
+            'CULL_FREQUENCY': 4,
+        },
+    },
+    # Payment statuses polled during checkout (see payments/status_cache.py)
+    'payments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pikaquick-payments',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+            'CULL_FREQUENCY': 4,
+        },
+    },
+}
+CATALOG_CACHE_ALIAS = 'catalog'
+PAYMENT_STATUS_CACHE_ALIAS = 'payments'
+
+# Threads in the in-process background executor (pikaquick/background.py)
+BACKGROUND_WORKERS = 4
+# Sizes of the named pools; STK pushes get their own so slow Daraja
+# calls can't hold up the callback inbox drain
+BACKGROUND_POOLS = {'stk_push': 8}
+
+# /metrics (pikaquick/metrics.py): open to "Authorization: Bearer
+# <METRICS_TOKEN>" if set, and to staff users
+METRICS_TOKEN = ''
+# Runs of one SQL statement in a request that count as a likely N+1
+METRICS_N_PLUS_ONE_THRESHOLD = 10
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -137,6 +187,10 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded files (food images and their resized variants)
+MEDIA_URL = '/media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 
 
 # M-Pesa Daraja Configuration
@@ -150,6 +204,25 @@ MPESA_CALLBACK_URL = 'https://giggly-hank-hypermodestly.ngrok-free.dev/payments/
 # M-Pesa API URLs
 MPESA_SANDBOX_BASE_URL = 'https://sandbox.safaricom.co.ke'
 MPESA_PRODUCTION_BASE_URL = 'https://api.safaricom.co.ke'
+# Local stand-in (payments/simulator.py), used when MPESA_ENVIRONMENT = 'simulator'
+MPESA_SIMULATOR_BASE_URL = 'http://127.0.0.1:8010'
+
+# OAuth tokens are cached in this cache alias (use a shared backend such as
+# Redis to share them between worker processes) and refreshed this many
+# seconds before they expire.
+MPESA_TOKEN_CACHE_ALIAS = 'default'
+MPESA_TOKEN_REFRESH_MARGIN = 300
+
+# Send the STK push on the background executor and answer initiate_payment
+# immediately, instead of holding the request until Daraja responds.
+MPESA_ASYNC_CHECKOUT = True
+
+# (connect, read) timeouts in seconds per Daraja endpoint
+MPESA_HTTP_TIMEOUTS = {
+    'oauth': (3.05, 10),
+    'stk_push': (3.05, 30),
+    'stk_query': (3.05, 15),
+}
 
 
 
@@ -162,5 +235,8 @@ EMAIL_HOST_USER = 'gkibetronoh10@gmail.com'  # ← Your Gmail address
 EMAIL_HOST_PASSWORD = 'zmte bons umrw mlpm'  # ← Paste your 16-char app password (remove spaces)
 DEFAULT_FROM_EMAIL = 'PikaQuick <gkibetronoh10@gmail.com>'
 SERVER_EMAIL = 'gkibetronoh10@gmail.com'
+# Mail is sent by the outbox (accounts/outbox.py) off the request path;
+# don't let a hung SMTP server hold a background worker forever
+EMAIL_TIMEOUT = 30
 
     
\ No newline at end of file
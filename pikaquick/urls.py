@@ -3,12 +3,15 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from pikaquick.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('foods.urls')),          # Homepage handled by foods app
     path('accounts/', include('accounts.urls')),
     path('dashboard/', include('dashboard.urls', namespace='dashboard')),
     path('payments/', include('payments.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 